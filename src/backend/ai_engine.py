@@ -1,14 +1,159 @@
-import requests
 import json
 import os
+import hashlib
+import random
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 # 加载环境变量 - 修复路径指向项目根目录
 env_path = os.path.join(os.path.dirname(__file__), '..', '..', '.env')
 load_dotenv(env_path)
 
+API_ERROR_PREFIX = "API调用失败"
+# 需要退避重试的HTTP状态码
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+SYSTEM_PROMPT = "你是一个专业的聊天记录分析助手，擅长从对话中提取关键信息并生成结构化摘要。"
+
+def estimate_tokens(text):
+    """粗略估算文本的token数：中文约每字1个token，ASCII字符约每4个1个token"""
+    if not text:
+        return 0
+    char_count = len(text)
+    # UTF-8下ASCII占1字节、中文占3字节，据此在C层面算出中文字符数
+    wide_count = max(0, (len(text.encode('utf-8')) - char_count) // 2)
+    return wide_count + (char_count - wide_count + 3) // 4
+
+class SummaryCache:
+    """按内容寻址的摘要磁盘缓存
+    
+    以 (模型, 系统提示词, 用户提示词) 的SHA-256作为键，每条结果保存为一个JSON文件。
+    超过max_age_seconds的条目视为失效，总大小超过max_bytes时按最近使用时间淘汰。
+    """
+    
+    def __init__(self, cache_dir, max_bytes=100 * 1024 * 1024, max_age_seconds=30 * 24 * 3600):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._total_bytes = None
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def make_key(model, system_prompt, prompt):
+        content = json.dumps([model, system_prompt, prompt], ensure_ascii=False)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+    
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+    
+    def get(self, key):
+        """读取缓存，未命中或已过期返回None"""
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        
+        if time.time() - entry.get('created', 0) > self.max_age_seconds:
+            self._remove(path)
+            with self._lock:
+                self.misses += 1
+            return None
+        
+        # 更新修改时间，作为最近使用时间参与淘汰
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return entry.get('text')
+    
+    def set(self, key, text):
+        """写入缓存，必要时淘汰旧条目"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps({'created': time.time(), 'text': text}, ensure_ascii=False).encode('utf-8')
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        try:
+            # 覆盖已有条目时只计入大小的差值
+            old_size = os.stat(path).st_size
+        except OSError:
+            old_size = 0
+        os.replace(tmp_path, path)
+        
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, _, size in self._entries())
+            else:
+                self._total_bytes += len(data) - old_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+    
+    def _entries(self):
+        """遍历缓存文件，生成 (路径, 修改时间, 大小)"""
+        if not os.path.isdir(self.cache_dir):
+            return
+        for root, dirs, files in os.walk(self.cache_dir):
+            for file in files:
+                if file.endswith('.json'):
+                    path = os.path.join(root, file)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, stat.st_mtime, stat.st_size
+    
+    def _evict(self):
+        """先删除过期条目，再按最近使用时间从旧到新删除，直到低于容量上限的90%"""
+        now = time.time()
+        entries = []
+        total = 0
+        for path, mtime, size in self._entries():
+            if now - mtime > self.max_age_seconds:
+                self._remove(path)
+                continue
+            entries.append((mtime, path, size))
+            total += size
+        
+        entries.sort()
+        target = self.max_bytes * 0.9
+        for mtime, path, size in entries:
+            if total <= target:
+                break
+            self._remove(path)
+            total -= size
+        self._total_bytes = total
+    
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    
+    def stats(self):
+        """缓存命中统计"""
+        with self._lock:
+            entries = list(self._entries())
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(entries),
+                'bytes': sum(size for _, _, size in entries)
+            }
+
 class QwenAI:
-    def __init__(self, api_key=None, model=None):
+    def __init__(self, api_key=None, model=None, connect_timeout=None, read_timeout=None,
+                 max_retries=None, max_concurrency=None, cache=None):
         # 优先使用传入的API密钥，其次使用环境变量，最后尝试从文件读取
         if api_key is None:
             api_key = os.getenv('QWEN_API_KEY')
@@ -27,32 +172,210 @@ class QwenAI:
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        
+        # 连接池与超时、重试设置
+        self.timeout = (
+            connect_timeout or float(os.getenv('QWEN_CONNECT_TIMEOUT', 5)),
+            read_timeout or float(os.getenv('QWEN_READ_TIMEOUT', 120))
+        )
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('QWEN_MAX_RETRIES', 3))
+        self.backoff_base = 0.5
+        self.backoff_max = 30.0
+        self.max_concurrency = max_concurrency or int(os.getenv('QWEN_MAX_CONCURRENCY', 4))
+        self._session = None
+        self._session_lock = threading.Lock()
+        self.cache = cache
+    
+    @property
+    def session(self):
+        """复用连接的HTTP会话，首次使用时创建"""
+        if self._session is None:
+            # requests在首次调用模型时才导入，缩短后端启动时间
+            import requests
+            from requests.adapters import HTTPAdapter
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(10, self.max_concurrency))
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    session.headers.update(self.headers)
+                    self._session = session
+        return self._session
+    
+    def close(self):
+        """关闭连接池"""
+        if self._session is not None:
+            self._session.close()
+            self._session = None
     
     def generate_summary(self, chat_history, query=None):
         """生成聊天记录摘要"""
+        return self._chat(self._summary_prompt(chat_history, query))
+    
+    def stream_summary(self, chat_history, query=None):
+        """流式生成聊天记录摘要，逐段返回新增的文本"""
+        return self._stream_chat(self._summary_prompt(chat_history, query))
+    
+    def _summary_prompt(self, chat_history, query=None):
         # 构建提示词
         if query:
-            prompt = f"以下是一段聊天记录，请根据问题'{query}'提取相关信息并总结：\n\n{chat_history}"
-        else:
-            prompt = f"以下是一段聊天记录，请提取其中的关键信息，包括但不限于：商品名称、数量、价格、发货时间、客户需求等，并以结构化方式呈现：\n\n{chat_history}"
-        
+            return f"以下是一段聊天记录，请根据问题'{query}'提取相关信息并总结：\n\n{chat_history}"
+        return f"以下是一段聊天记录，请提取其中的关键信息，包括但不限于：商品名称、数量、价格、发货时间、客户需求等，并以结构化方式呈现：\n\n{chat_history}"
+    
+    def summarize_window(self, chat_history, index, total, query=None):
+        """总结长聊天记录中的一段，供分段汇总使用"""
+        focus = f"，重点关注与问题'{query}'相关的内容" if query else "，保留商品名称、数量、价格、发货时间、客户需求等关键信息"
+        prompt = f"以下是一段较长聊天记录的第{index}/{total}部分，请提取这一部分的关键信息{focus}：\n\n{chat_history}"
+        return self._chat(prompt)
+    
+    def merge_summaries(self, partial_summaries, query=None):
+        """将多段摘要合并为一份完整摘要"""
+        return self._chat(self._merge_prompt(partial_summaries, query))
+    
+    def stream_merge_summaries(self, partial_summaries, query=None):
+        """流式合并多段摘要"""
+        return self._stream_chat(self._merge_prompt(partial_summaries, query))
+    
+    def _merge_prompt(self, partial_summaries, query=None):
+        sections = "\n\n".join(f"【第{i + 1}部分】\n{summary}" for i, summary in enumerate(partial_summaries))
+        if query:
+            return f"以下是同一段聊天记录按时间顺序分段提取的摘要，请根据问题'{query}'合并为一份完整的回答，去除重复内容：\n\n{sections}"
+        return f"以下是同一段聊天记录按时间顺序分段提取的摘要，请合并为一份完整的结构化摘要，去除重复内容：\n\n{sections}"
+    
+    def _build_payload(self, prompt, incremental=False):
         # 构建请求数据
-        payload = {
+        return {
             "model": self.model,
             "input": {
                 "messages": [
-                    {"role": "system", "content": "你是一个专业的聊天记录分析助手，擅长从对话中提取关键信息并生成结构化摘要。"},
+                    {"role": "system", "content": SYSTEM_PROMPT},
                     {"role": "user", "content": prompt}
                 ]
             },
-            "parameters": {}
+            "parameters": {"incremental_output": True} if incremental else {}
         }
+    
+    def _cache_lookup(self, prompt):
+        """返回 (缓存键, 缓存结果)，未启用缓存时均为None"""
+        if self.cache is None:
+            return None, None
+        cache_key = self.cache.make_key(self.model, SYSTEM_PROMPT, prompt)
+        return cache_key, self.cache.get(cache_key)
+    
+    def _chat(self, prompt):
+        """调用对话接口，返回模型输出文本"""
+        import requests
+        cache_key, cached = self._cache_lookup(prompt)
+        if cached is not None:
+            return cached
         
-        # 发送请求
-        response = requests.post(self.api_url, headers=self.headers, json=payload)
+        try:
+            response = self._post(self._build_payload(prompt))
+        except requests.RequestException as e:
+            return f"{API_ERROR_PREFIX}: {e}"
         
         if response.status_code == 200:
             result = response.json()
-            return result['output']['text']
+            text = result['output']['text']
+            if cache_key is not None and text:
+                self.cache.set(cache_key, text)
+            return text
         else:
-            return f"API调用失败: {response.status_code} - {response.text}"
\ No newline at end of file
+            return f"{API_ERROR_PREFIX}: {response.status_code} - {response.text}"
+    
+    def _stream_chat(self, prompt):
+        """以DashScope的SSE增量输出调用对话接口，逐段生成新增文本"""
+        import requests
+        cache_key, cached = self._cache_lookup(prompt)
+        if cached is not None:
+            yield cached
+            return
+        
+        try:
+            response = self._post(self._build_payload(prompt, incremental=True), stream=True,
+                                  headers={"X-DashScope-SSE": "enable", "Accept": "text/event-stream"})
+        except requests.RequestException as e:
+            yield f"{API_ERROR_PREFIX}: {e}"
+            return
+        
+        parts = []
+        # 只有收到结束标记的完整输出才写入缓存，连接中途断开时不缓存截断的内容
+        finished = False
+        try:
+            if response.status_code != 200:
+                yield f"{API_ERROR_PREFIX}: {response.status_code} - {response.text}"
+                return
+            
+            response.encoding = 'utf-8'
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                try:
+                    event = json.loads(line[5:])
+                except ValueError:
+                    continue
+                if 'output' not in event:
+                    # 流中途出错时DashScope返回code和message
+                    yield f"{API_ERROR_PREFIX}: {event.get('code')} - {event.get('message')}"
+                    return
+                delta = event['output'].get('text') or ''
+                if delta:
+                    parts.append(delta)
+                    yield delta
+                if event['output'].get('finish_reason') == 'stop':
+                    finished = True
+        finally:
+            response.close()
+        
+        text = "".join(parts)
+        if cache_key is not None and finished and text:
+            self.cache.set(cache_key, text)
+    
+    def _post(self, payload, **kwargs):
+        """发送请求，遇到限流、服务端错误或网络异常时按带抖动的指数退避重试"""
+        import requests
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.post(self.api_url, json=payload, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self._backoff_delay(attempt))
+                continue
+            
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                return response
+            delay = self._backoff_delay(attempt, response.headers.get('Retry-After'))
+            # 流式请求的响应不关闭时会一直占用连接池中的连接
+            response.close()
+            time.sleep(delay)
+        return response
+    
+    def _backoff_delay(self, attempt, retry_after=None):
+        """计算第attempt次重试前的等待秒数，优先遵循服务端的Retry-After"""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except (TypeError, ValueError):
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+    
+    def generate_many(self, chat_histories, query=None, max_concurrency=None):
+        """并发生成多段聊天记录的摘要，结果顺序与输入一致"""
+        with ThreadPoolExecutor(max_workers=max_concurrency or self.max_concurrency) as executor:
+            return list(executor.map(lambda chat_history: self.generate_summary(chat_history, query), chat_histories))
+    
+    async def agenerate_summary(self, chat_history, query=None):
+        """generate_summary的asyncio版本，在线程中复用同一连接池"""
+        return await asyncio.to_thread(self.generate_summary, chat_history, query)
+    
+    async def agenerate_many(self, chat_histories, query=None, max_concurrency=None):
+        """generate_many的asyncio版本，同时进行的请求数不超过max_concurrency"""
+        semaphore = asyncio.Semaphore(max_concurrency or self.max_concurrency)
+        
+        async def run(chat_history):
+            async with semaphore:
+                return await self.agenerate_summary(chat_history, query)
+        
+        return await asyncio.gather(*(run(chat_history) for chat_history in chat_histories))
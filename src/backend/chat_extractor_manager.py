@@ -4,21 +4,65 @@
 """
 
 import os
+import re
 import json
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Callable, Iterable, Iterator, List, Dict, Optional, Tuple
 import logging
 
-from windows_wechat import WindowsWeChatExtractor
-from windows_qqchat import WindowsQQExtractor
+from message_store import MessageStore
+from message_archive import DATABASE_CHAT_TYPES
+import process_pool
+
+# 自动检测格式时只读取文件开头的这部分字符
+SNIFF_SIZE = 64 * 1024
+# QQ导出中发送者后带QQ号: 2024-01-01 12:00:00 昵称(12345)
+_QQ_HEADER_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} .+?\(\d+\)\n')
+# 消息列表拆分出的有序段超过这个数量时不再多路归并，直接整体排序
+MAX_MERGE_RUNS = 16
+
+def _message_timestamp(msg: Dict) -> str:
+    return msg.get('timestamp') or ''
+
+# 工作进程中复用的提取管理器
+_worker_manager = None
+
+def _extract_file_worker(config: Dict) -> Optional[List[Dict]]:
+    """在工作进程中解析单个文件"""
+    global _worker_manager
+    if _worker_manager is None:
+        _worker_manager = ChatExtractorManager()
+    return _worker_manager._extract_file(config)
 
 class ChatExtractorManager:
     """聊天记录提取管理器"""
     
-    def __init__(self):
+    def __init__(self, archive=None, max_workers: Optional[int] = None):
         self.logger = self._setup_logger()
-        self.wechat_extractor = WindowsWeChatExtractor()
-        self.qq_extractor = WindowsQQExtractor()
+        self.archive = archive
+        self.max_workers = max_workers or process_pool.max_workers()
+        self._wechat_extractor = None
+        self._qq_extractor = None
+    
+    @property
+    def wechat_extractor(self):
+        """微信提取器，首次使用时才创建（会探测本机微信目录）"""
+        if self._wechat_extractor is None:
+            from windows_wechat import WindowsWeChatExtractor
+            self._wechat_extractor = WindowsWeChatExtractor()
+        return self._wechat_extractor
+    
+    @property
+    def qq_extractor(self):
+        """QQ提取器，首次使用时才创建（会探测本机QQ目录）"""
+        if self._qq_extractor is None:
+            from windows_qqchat import WindowsQQExtractor
+            self._qq_extractor = WindowsQQExtractor()
+        return self._qq_extractor
         
     def _setup_logger(self):
         """设置日志"""
@@ -40,13 +84,13 @@ class ChatExtractorManager:
         }
         
         try:
-            # 扫描微信账户
-            self.logger.info("正在扫描微信账户...")
-            result['wechat_accounts'] = self.wechat_extractor.scan_wechat_accounts()
-            
-            # 扫描QQ账户
-            self.logger.info("正在扫描QQ账户...")
-            result['qq_accounts'] = self.qq_extractor.scan_qq_accounts()
+            # 微信和QQ账户同时扫描
+            self.logger.info("正在扫描微信和QQ账户...")
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                wechat_future = executor.submit(self.wechat_extractor.scan_wechat_accounts)
+                qq_future = executor.submit(self.qq_extractor.scan_qq_accounts)
+                result['wechat_accounts'] = wechat_future.result()
+                result['qq_accounts'] = qq_future.result()
             
             self.logger.info(f"扫描完成: 微信 {len(result['wechat_accounts'])} 个账户, "
                            f"QQ {len(result['qq_accounts'])} 个账户")
@@ -56,79 +100,196 @@ class ChatExtractorManager:
         
         return result
     
-    def extract_from_files(self, file_configs: List[Dict]) -> List[Dict]:
-        """从多个文件中提取聊天记录"""
+    def extract_from_files(self, file_configs: List[Dict],
+                           progress: Optional[Callable[[Dict, int], None]] = None) -> List[Dict]:
+        """从多个文件中提取聊天记录，progress(配置, 消息数) 在每个文件解析完成后调用"""
+        extract_many = self._progress_extractor(progress)
+        if self.archive is not None:
+            # 通过本地归档增量导入，只有变化的文件才会重新解析
+            return self.archive.extract(file_configs, extract_many)
+        
         all_messages = []
+        for _, messages in extract_many(file_configs):
+            all_messages.extend(messages or [])
+        return all_messages
+    
+    def extract_file_streams(self, file_configs: List[Dict],
+                             progress: Optional[Callable[[Dict, int], None]] = None) -> List[Iterable[Dict]]:
+        """从多个文件中提取聊天记录，每个文件返回一个按时间排序的消息流，供iter_merged_messages多路归并
+
+        使用本地归档时各文件的消息从归档中分批读取，不整体载入内存
+        """
+        extract_many = self._progress_extractor(progress)
+        if self.archive is not None:
+            paths = self.archive.ingest(file_configs, extract_many)
+            return [self.archive.iter_file_messages(path) for path in paths]
         
-        for config in file_configs:
-            file_path = config.get('file_path')
-            chat_type = config.get('type', 'auto')  # wechat, qq, auto
-            
-            if not os.path.exists(file_path):
-                self.logger.warning(f"文件不存在: {file_path}")
+        streams = []
+        for _, messages in extract_many(file_configs):
+            if messages is None:
                 continue
-            
-            try:
-                if chat_type == 'wechat':
-                    messages = self.wechat_extractor.extract_from_text_export(file_path)
-                elif chat_type == 'qq':
-                    messages = self.qq_extractor.extract_from_text_export(file_path)
-                else:
-                    # 自动检测
-                    messages = self._auto_detect_and_extract(file_path)
-                
-                # 添加文件来源信息
-                for msg in messages:
-                    msg['source_file'] = file_path
-                    msg['detected_type'] = chat_type
-                
-                all_messages.extend(messages)
-                self.logger.info(f"从 {file_path} 提取到 {len(messages)} 条消息")
-                
-            except Exception as e:
-                self.logger.error(f"处理文件 {file_path} 时出错: {e}")
+            if isinstance(messages, list):
+                # 导出文件本身基本按时间排列，排序接近线性
+                messages.sort(key=_message_timestamp)
+            streams.append(messages)
+        return streams
+    
+    def iter_extract_merged(self, file_configs: List[Dict],
+                            progress: Optional[Callable[[Dict, int], None]] = None) -> Iterator[Dict]:
+        """按时间顺序逐条生成多个文件中去重后的消息"""
+        return self.iter_merged_messages(self.extract_file_streams(file_configs, progress))
+    
+    def _progress_extractor(self, progress: Optional[Callable[[Dict, int], None]]):
+        """包装iter_extract_from_files，每个文件解析完成后调用progress(配置, 消息数)"""
+        def extract_many(configs):
+            for config, messages in self.iter_extract_from_files(configs):
+                if progress:
+                    if messages is None or isinstance(messages, list):
+                        progress(config, len(messages or []))
+                    else:
+                        messages = self._report_when_consumed(config, messages, progress)
+                yield config, messages
+        return extract_many
+    
+    def _report_when_consumed(self, config: Dict, messages: Iterator[Dict],
+                              progress: Callable[[Dict, int], None]) -> Iterator[Dict]:
+        count = 0
+        for msg in messages:
+            count += 1
+            yield msg
+        progress(config, count)
+    
+    def iter_extract_from_files(self, file_configs: List[Dict]) -> Iterator[Tuple[Dict, Iterable[Dict]]]:
+        """在共享进程池中并行解析多个文件，按完成顺序逐个生成 (配置, 消息列表)，解析失败的文件消息列表为None
+
+        聊天数据库（type为wechat_db）不经过进程池，生成的是逐条读取的消息迭代器
+        """
+        for config in file_configs:
+            if config.get('type') in DATABASE_CHAT_TYPES:
+                yield config, self.iter_extract_from_database(config)
+        file_configs = [config for config in file_configs if config.get('type') not in DATABASE_CHAT_TYPES]
         
-        return all_messages
+        if len(file_configs) < 2 or self.max_workers <= 1:
+            for config in file_configs:
+                yield config, self._extract_file(config)
+            return
+        
+        pool = process_pool.get_pool()
+        futures = {pool.submit(_extract_file_worker, config): config for config in file_configs}
+        try:
+            for future in as_completed(futures):
+                try:
+                    messages = future.result()
+                except BrokenProcessPool as e:
+                    self.logger.error(f"解析进程异常退出: {e}")
+                    process_pool.discard(pool)
+                    messages = None
+                except Exception as e:
+                    self.logger.error(f"处理文件 {futures[future].get('file_path')} 时出错: {e}")
+                    messages = None
+                yield futures[future], messages
+        finally:
+            # 调用方提前停止迭代（如任务被取消）时，取消尚未开始的解析
+            for future in futures:
+                future.cancel()
     
-    def _auto_detect_and_extract(self, file_path: str) -> List[Dict]:
-        """自动检测文件类型并提取"""
+    def _extract_file(self, config: Dict) -> Optional[List[Dict]]:
+        """从单个文件中提取聊天记录，文件不存在或解析出错时返回None，与"文件中没有消息"区分开"""
+        file_path = config.get('file_path')
+        chat_type = config.get('type', 'auto')  # wechat, qq, auto
+        offset = config.get('offset', 0)  # 增量导入时只解析该字节位置之后的内容
+        
+        if not os.path.exists(file_path):
+            self.logger.warning(f"文件不存在: {file_path}")
+            return None
+        
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # 简单的启发式检测
-            if 'wxid_' in content or '微信' in content:
-                self.logger.info(f"检测到微信格式: {file_path}")
-                return self.wechat_extractor.extract_from_text_export(file_path)
-            elif any(keyword in content for keyword in ['QQ', 'qq.com', '腾讯']):
-                self.logger.info(f"检测到QQ格式: {file_path}")
-                return self.qq_extractor.extract_from_text_export(file_path)
+            if chat_type == 'wechat':
+                messages = self.wechat_extractor.extract_from_text_export(file_path, offset=offset, raise_errors=True)
+            elif chat_type == 'qq':
+                messages = self.qq_extractor.extract_from_text_export(file_path, offset=offset, raise_errors=True)
             else:
-                self.logger.warning(f"无法自动检测文件类型: {file_path}")
-                # 尝试两种格式
-                wechat_messages = self.wechat_extractor.extract_from_text_export(file_path)
-                qq_messages = self.qq_extractor.extract_from_text_export(file_path)
-                return wechat_messages if len(wechat_messages) > len(qq_messages) else qq_messages
-                
+                # 自动检测
+                messages = self._auto_detect_and_extract(file_path, offset)
+            
+            # 添加文件来源信息
+            for msg in messages:
+                msg['source_file'] = file_path
+                msg['detected_type'] = chat_type
+            
+            self.logger.info(f"从 {file_path} 提取到 {len(messages)} 条消息")
+            return messages
+            
         except Exception as e:
-            self.logger.error(f"自动检测文件 {file_path} 时出错: {e}")
-            return []
+            self.logger.error(f"处理文件 {file_path} 时出错: {e}")
+            return None
+    
+    def iter_extract_from_database(self, config: Dict) -> Optional[Iterator[Dict]]:
+        """逐条读取已解密的微信数据库，文件不存在、仍加密或无法打开时返回None"""
+        file_path = config.get('file_path')
+        chat_type = config.get('type')
+        if not file_path or not os.path.exists(file_path):
+            self.logger.warning(f"文件不存在: {file_path}")
+            return None
+        
+        stream = self.wechat_extractor.iter_database_messages(file_path)
+        try:
+            # 先读取第一条，打开失败时在这里就能区分出来
+            first = next(stream, None)
+        except Exception as e:
+            self.logger.error(f"读取数据库 {file_path} 时出错: {e}")
+            return None
+        if first is None:
+            return iter(())
+        return self._tag_source(itertools.chain([first], stream), file_path, chat_type)
+    
+    def _tag_source(self, messages: Iterable[Dict], file_path: str, chat_type: str) -> Iterator[Dict]:
+        for msg in messages:
+            msg['source_file'] = file_path
+            msg['detected_type'] = chat_type
+            yield msg
+    
+    def extract_to_store(self, file_configs: List[Dict],
+                         progress: Optional[Callable[[Dict, int], None]] = None) -> MessageStore:
+        """从多个文件中提取聊天记录，按时间归并去重后直接写入列式存储，不生成合并后的消息列表"""
+        return MessageStore.from_messages(self.iter_extract_merged(file_configs, progress), content_key='message')
+    
+    def _sniff_chat_type(self, file_path: str) -> Optional[str]:
+        """只读取文件开头判断聊天记录类型，无法判断时返回None"""
+        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+            head = f.read(SNIFF_SIZE)
+        
+        # 简单的启发式检测
+        if 'wxid_' in head or '微信' in head:
+            return 'wechat'
+        elif any(keyword in head for keyword in ['QQ', 'qq.com', '腾讯']) or _QQ_HEADER_PATTERN.search(head):
+            return 'qq'
+        return None
+    
+    def _auto_detect_and_extract(self, file_path: str, offset: int = 0) -> List[Dict]:
+        """自动检测文件类型并提取，读取出错时抛出异常"""
+        chat_type = self._sniff_chat_type(file_path)
+        
+        if chat_type == 'wechat':
+            self.logger.info(f"检测到微信格式: {file_path}")
+            return self.wechat_extractor.extract_from_text_export(file_path, offset=offset, raise_errors=True)
+        elif chat_type == 'qq':
+            self.logger.info(f"检测到QQ格式: {file_path}")
+            return self.qq_extractor.extract_from_text_export(file_path, offset=offset, raise_errors=True)
+        else:
+            self.logger.warning(f"无法自动检测文件类型: {file_path}")
+            # 尝试两种格式
+            wechat_messages = self.wechat_extractor.extract_from_text_export(file_path, offset=offset, raise_errors=True)
+            qq_messages = self.qq_extractor.extract_from_text_export(file_path, offset=offset, raise_errors=True)
+            return wechat_messages if len(wechat_messages) > len(qq_messages) else qq_messages
     
     def merge_and_sort_messages(self, messages: List[Dict]) -> List[Dict]:
-        """合并并排序消息"""
+        """合并并排序已经整体载入的消息列表，返回列表
+
+        从文件提取时应使用iter_extract_merged，按文件逐个归并，不生成合并后的消息列表
+        """
         try:
-            # 按时间戳排序
-            sorted_messages = sorted(messages, key=lambda x: x.get('timestamp', ''))
-            
-            # 去重（基于时间戳和发送者）
-            unique_messages = []
-            seen = set()
-            
-            for msg in sorted_messages:
-                key = (msg.get('timestamp'), msg.get('sender'), msg.get('message', '')[:50])
-                if key not in seen:
-                    seen.add(key)
-                    unique_messages.append(msg)
+            unique_messages = list(self.iter_merge_and_sort(messages))
             
             self.logger.info(f"合并排序完成: {len(messages)} -> {len(unique_messages)} 条消息")
             return unique_messages
@@ -137,6 +298,52 @@ class ChatExtractorManager:
             self.logger.error(f"合并排序消息时出错: {e}")
             return messages
     
+    def iter_merge_and_sort(self, messages: List[Dict]) -> Iterator[Dict]:
+        """按时间顺序逐条生成列表中去重后的消息
+
+        列表由少数几段有序的消息拼接而成时多路归并，有序段只记录起止位置，不复制消息列表；
+        有序段过多（基本无序）时多路归并反而更慢，直接排序
+        """
+        runs = self._sorted_runs(messages)
+        if runs is None:
+            runs = [sorted(messages, key=_message_timestamp)]
+        return self.iter_merged_messages(runs)
+    
+    def iter_merged_messages(self, streams: Iterable[Iterable[Dict]]) -> Iterator[Dict]:
+        """多路归并各自按时间有序的消息流，同时去重
+        
+        去重键为 (时间戳, 发送者, 消息前50字)，重复消息的时间戳必然相同，
+        因此只需保存当前时间戳下已出现的键，内存占用与消息总数无关。
+        """
+        current_timestamp = None
+        seen = set()
+        for msg in heapq.merge(*streams, key=_message_timestamp):
+            timestamp = _message_timestamp(msg)
+            if timestamp != current_timestamp:
+                current_timestamp = timestamp
+                seen.clear()
+            key = (msg.get('sender'), (msg.get('message') or '')[:50])
+            if key not in seen:
+                seen.add(key)
+                yield msg
+    
+    def _sorted_runs(self, messages: List[Dict]) -> Optional[List[Iterator[Dict]]]:
+        """将消息列表按时间戳非递减拆分为连续段，每段为按位置读取原列表的迭代器，段数超过MAX_MERGE_RUNS时返回None"""
+        bounds = []
+        start = 0
+        previous = None
+        for i, msg in enumerate(messages):
+            timestamp = _message_timestamp(msg)
+            if i > start and timestamp < previous:
+                bounds.append((start, i))
+                start = i
+                if len(bounds) >= MAX_MERGE_RUNS:
+                    return None
+            previous = timestamp
+        if start < len(messages):
+            bounds.append((start, len(messages)))
+        return [(messages[i] for i in range(begin, end)) for begin, end in bounds]
+    
     def export_unified_format(self, messages: List[Dict], output_path: str, metadata: Dict = None):
         """导出统一格式"""
         try:
@@ -156,61 +363,48 @@ class ChatExtractorManager:
         except Exception as e:
             self.logger.error(f"导出统一格式时出错: {e}")
     
-    def generate_extraction_report(self, scan_result: Dict, messages: List[Dict]) -> Dict:
-        """生成提取报告"""
-        report = {
+    def generate_extraction_report(self, scan_result: Dict, messages: Iterable[Dict], top_n: int = 10) -> Dict:
+        """生成提取报告，只遍历一次messages，可以直接传入列式存储的iter_records()"""
+        total = 0
+        earliest = latest = None
+        sender_counts = {}
+        message_sources = {}
+        for msg in messages:
+            total += 1
+            timestamp = msg.get('timestamp')
+            if timestamp:
+                if earliest is None or timestamp < earliest:
+                    earliest = timestamp
+                if latest is None or timestamp > latest:
+                    latest = timestamp
+            sender = msg.get('sender', 'Unknown')
+            sender_counts[sender] = sender_counts.get(sender, 0) + 1
+            source = msg.get('source', 'unknown')
+            message_sources[source] = message_sources.get(source, 0) + 1
+        
+        # 发言最多的用户
+        sorted_senders = sorted(sender_counts.items(), key=lambda x: x[1], reverse=True)
+        return {
             'scan_summary': {
                 'wechat_accounts': len(scan_result.get('wechat_accounts', [])),
                 'qq_accounts': len(scan_result.get('qq_accounts', [])),
                 'scan_time': scan_result.get('scan_time')
             },
             'extraction_summary': {
-                'total_messages': len(messages),
-                'message_sources': {},
-                'time_range': self._get_time_range(messages),
-                'top_senders': self._get_top_senders(messages)
+                'total_messages': total,
+                'message_sources': message_sources,
+                'time_range': {'earliest': earliest, 'latest': latest} if earliest is not None else {},
+                'top_senders': [{'sender': sender, 'message_count': count}
+                                for sender, count in sorted_senders[:top_n]]
             },
-            'recommendations': self._generate_recommendations(scan_result, messages)
-        }
-        
-        # 统计消息来源
-        for msg in messages:
-            source = msg.get('source', 'unknown')
-            report['extraction_summary']['message_sources'][source] = \
-                report['extraction_summary']['message_sources'].get(source, 0) + 1
-        
-        return report
-    
-    def _get_time_range(self, messages: List[Dict]) -> Dict:
-        """获取时间范围"""
-        if not messages:
-            return {}
-        
-        timestamps = [msg.get('timestamp') for msg in messages if msg.get('timestamp')]
-        if not timestamps:
-            return {}
-        
-        return {
-            'earliest': min(timestamps),
-            'latest': max(timestamps)
+            'recommendations': self._generate_recommendations(scan_result, total)
         }
     
-    def _get_top_senders(self, messages: List[Dict], top_n: int = 10) -> List[Dict]:
-        """获取发言最多的用户"""
-        sender_counts = {}
-        for msg in messages:
-            sender = msg.get('sender', 'Unknown')
-            sender_counts[sender] = sender_counts.get(sender, 0) + 1
-        
-        sorted_senders = sorted(sender_counts.items(), key=lambda x: x[1], reverse=True)
-        return [{'sender': sender, 'message_count': count} 
-                for sender, count in sorted_senders[:top_n]]
-    
-    def _generate_recommendations(self, scan_result: Dict, messages: List[Dict]) -> List[str]:
+    def _generate_recommendations(self, scan_result: Dict, message_count: int) -> List[str]:
         """生成建议"""
         recommendations = []
         
-        if len(messages) == 0:
+        if message_count == 0:
             recommendations.append("未提取到任何消息，建议检查文件格式或路径")
         
         if len(scan_result.get('wechat_accounts', [])) > 0:
@@ -241,11 +435,9 @@ def main():
         {'file_path': 'qq_export.txt', 'type': 'qq'},
     ]
     
-    messages = manager.extract_from_files(file_configs)
-    
     # 3. 合并排序
     print("\n3. 合并排序消息...")
-    unified_messages = manager.merge_and_sort_messages(messages)
+    unified_messages = list(manager.iter_extract_merged(file_configs))
     
     # 4. 导出结果
     print("\n4. 导出结果...")
@@ -0,0 +1,89 @@
+"""
+聊天会话缓存模块
+在服务端保存已解析的聊天记录，前端只需通过chat_id引用，避免重复上传整个聊天数据
+"""
+
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional
+
+from message_store import MessageStore
+from search_index import SearchIndex, get_search_index
+
+# 默认最多缓存512MB的聊天数据
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class ChatSession:
+    """一次加载的聊天记录"""
+
+    def __init__(self, chat_id: str, store: MessageStore, metadata: Optional[Dict] = None):
+        self.chat_id = chat_id
+        self.store = store
+        self.metadata = metadata or {}
+        self.created_at = datetime.now()
+        self.search_index: Optional[SearchIndex] = None
+        self.nbytes = store.nbytes
+
+
+class ChatSessionCache:
+    """按LRU淘汰的聊天会话缓存，总内存不超过max_bytes"""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._sessions: 'OrderedDict[str, ChatSession]' = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, store: MessageStore, **metadata) -> ChatSession:
+        """缓存聊天记录并返回新会话"""
+        session = ChatSession(uuid.uuid4().hex, store, metadata)
+        with self._lock:
+            self._sessions[session.chat_id] = session
+            self._total_bytes += session.nbytes
+            self._evict()
+        return session
+
+    def get(self, chat_id: str) -> Optional[ChatSession]:
+        """获取会话，命中时标记为最近使用"""
+        with self._lock:
+            session = self._sessions.get(chat_id)
+            if session is not None:
+                self._sessions.move_to_end(chat_id)
+            return session
+
+    def search_index(self, session: ChatSession) -> SearchIndex:
+        """获取会话的检索索引，索引占用的内存计入缓存大小，随会话一起淘汰"""
+        index = get_search_index(session.store)
+        with self._lock:
+            if session.search_index is not index:
+                delta = index.nbytes - (session.search_index.nbytes if session.search_index is not None else 0)
+                session.search_index = index
+                session.nbytes += delta
+                if self._sessions.get(session.chat_id) is session:
+                    self._total_bytes += delta
+                    self._evict()
+        return index
+
+    def remove(self, chat_id: str) -> bool:
+        with self._lock:
+            session = self._sessions.pop(chat_id, None)
+            if session is None:
+                return False
+            self._total_bytes -= session.nbytes
+            return True
+
+    def _evict(self):
+        # 至少保留最近加载的一个会话，即使它本身超过上限
+        while self._total_bytes > self.max_bytes and len(self._sessions) > 1:
+            _, session = self._sessions.popitem(last=False)
+            self._total_bytes -= session.nbytes
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
@@ -0,0 +1,155 @@
+"""
+目录扫描模块
+用os.scandir遍历聊天软件的账户目录和聊天记录导出目录，跳过图片、视频等与聊天记录无关的子目录；
+按目录修改时间缓存每个目录中匹配的文件，再次扫描时只重新列出发生变化的目录
+"""
+
+import fnmatch
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+DEFAULT_MAX_WORKERS = 4
+
+
+def default_cache_dir() -> str:
+    return os.path.expanduser(os.getenv('CHAT_CACHE_PATH') or '~/.memochat/cache')
+
+
+class DirectoryScanner:
+    """带缓存的目录扫描器
+
+    缓存项为 目录 -> (修改时间, 目录下匹配的文件名, 子目录名)。目录的修改时间只在
+    其直接包含的条目增删或改名时变化，所以修改时间未变的目录可以直接复用上次的结果，
+    只需要对子目录逐个stat，不必重新列出其中成千上万的文件。
+    """
+
+    def __init__(self, match: Callable[[str], bool], skip_dirs: Iterable[str] = (),
+                 cache_path: Optional[str] = None, max_workers: Optional[int] = None):
+        self.match = match
+        self.skip_dirs = {name.lower() for name in skip_dirs}
+        self.cache_path = cache_path
+        self.max_workers = max_workers or DEFAULT_MAX_WORKERS
+        self.logger = logging.getLogger('DirectoryScanner')
+        self._lock = threading.Lock()
+        self._cache: Dict[str, list] = self._load_cache()
+        self._dirty = False
+
+    def _load_cache(self) -> Dict[str, list]:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"读取扫描缓存失败，将重新扫描: {e}")
+            return {}
+
+    def save(self):
+        """将缓存写入磁盘，下次启动后的首次扫描也可以复用"""
+        if not self.cache_path or not self._dirty:
+            return
+        with self._lock:
+            snapshot = dict(self._cache)
+            self._dirty = False
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            tmp_path = self.cache_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            self.logger.warning(f"保存扫描缓存失败: {e}")
+
+    def find_files(self, root: str) -> List[str]:
+        """返回root下所有匹配的文件路径"""
+        return [path for path, _ in self.iter_files(root)]
+
+    def iter_files(self, root: str, max_depth: Optional[int] = None, ignore: Iterable[str] = (),
+                   with_stat: bool = False) -> Iterator[Tuple[str, Optional[os.stat_result]]]:
+        """边遍历边生成 (文件路径, stat信息)
+
+        max_depth为0时只看root本身，None表示不限深度；ignore为按名称匹配的通配符，
+        匹配的文件和目录都会跳过。with_stat为True时附带文件的stat信息：新列出的目录直接
+        使用DirEntry已有的数据，来自缓存的目录再单独stat（文件内容变化不会改变目录的修改时间）。
+        """
+        ignore = list(ignore)
+        pending = [(root, 0)]
+        while pending:
+            directory, depth = pending.pop()
+            stats = {} if with_stat else None
+            entry = self._list_directory(directory, stats)
+            if entry is None:
+                continue
+            _, files, subdirs = entry
+            for name in files:
+                if ignore and any(fnmatch.fnmatch(name, pattern) for pattern in ignore):
+                    continue
+                path = os.path.join(directory, name)
+                stat = None
+                if with_stat:
+                    stat = stats.get(name)
+                    if stat is None:
+                        try:
+                            stat = os.stat(path)
+                        except OSError:
+                            continue
+                yield path, stat
+            if max_depth is not None and depth >= max_depth:
+                continue
+            # 逆序入栈，使同一目录下的子目录按列出顺序遍历
+            for name in reversed(subdirs):
+                if ignore and any(fnmatch.fnmatch(name, pattern) for pattern in ignore):
+                    continue
+                pending.append((os.path.join(directory, name), depth + 1))
+
+    def _list_directory(self, directory: str, stats: Optional[Dict] = None) -> Optional[list]:
+        """列出目录中匹配的文件和需要继续遍历的子目录，目录未变化时使用缓存
+
+        传入stats时，重新列出的目录会把匹配文件的stat信息写入其中
+        """
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return None
+        cached = self._cache.get(directory)
+        if cached is not None and cached[0] == mtime:
+            return cached
+
+        files, subdirs = [], []
+        try:
+            with os.scandir(directory) as entries:
+                for item in entries:
+                    try:
+                        if item.is_dir(follow_symlinks=False):
+                            if item.name.lower() not in self.skip_dirs:
+                                subdirs.append(item.name)
+                        elif self.match(item.name):
+                            files.append(item.name)
+                            if stats is not None:
+                                stats[item.name] = item.stat()
+                    except OSError:
+                        continue
+        except PermissionError:
+            self.logger.warning(f"无权限访问目录: {directory}")
+            return None
+        except OSError as e:
+            self.logger.warning(f"无法读取目录 {directory}: {e}")
+            return None
+
+        entry = [mtime, files, subdirs]
+        with self._lock:
+            self._cache[directory] = entry
+            self._dirty = True
+        return entry
+
+    def map(self, func: Callable, items: Iterable) -> list:
+        """并行处理多个账户目录，扫描以文件系统IO为主，使用线程即可"""
+        items = list(items)
+        if len(items) < 2:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items))) as executor:
+            return list(executor.map(func, items))
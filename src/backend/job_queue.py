@@ -0,0 +1,206 @@
+"""
+后台任务模块
+将耗时的扫描、提取和摘要放到有限大小的线程池中执行，前端提交后轮询进度；
+任务状态保存在SQLite中，服务重启后仍可查询
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+DEFAULT_MAX_WORKERS = 2
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+# 服务重启时尚未完成的任务
+INTERRUPTED = 'interrupted'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress TEXT,
+    result TEXT,
+    error TEXT,
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs(created_at);
+"""
+
+
+class JobCancelled(Exception):
+    """任务被取消"""
+
+
+class Job:
+    """传给任务函数的句柄，用于上报进度和检查是否已取消"""
+
+    def __init__(self, manager: 'JobManager', job_id: str):
+        self.manager = manager
+        self.job_id = job_id
+        self.cancel_event = threading.Event()
+        self.finished = threading.Event()
+        self.progress: Dict = {}
+
+    def update(self, **progress):
+        """合并并保存进度字段，例如 files_done、messages_parsed、chunks_done"""
+        self.check_cancelled()
+        self.progress.update(progress)
+        self.manager._save(self.job_id, progress=self.progress)
+
+    def check_cancelled(self):
+        """任务函数应在各步骤之间调用，已取消时抛出JobCancelled"""
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+
+class JobManager:
+    """后台任务队列：提交、查询进度、取消"""
+
+    def __init__(self, db_path: str, max_workers: Optional[int] = None):
+        self.db_path = db_path
+        self.max_workers = max_workers or int(os.getenv('JOB_MAX_WORKERS', DEFAULT_MAX_WORKERS))
+        self.logger = logging.getLogger('JobManager')
+        self._conn = None
+        self._lock = threading.RLock()
+        self._executor = None
+        self._jobs: Dict[str, Job] = {}
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """数据库连接，首次使用时创建，并将上次未完成的任务标记为中断"""
+        if self._conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            conn.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE status IN (?, ?)",
+                         (INTERRUPTED, datetime.now().isoformat(), QUEUED, RUNNING))
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='memochat-job')
+            return self._executor
+
+    def submit(self, kind: str, func: Callable[[Job], Dict]) -> str:
+        """提交任务，func接收Job句柄并返回可JSON序列化的结果，返回任务ID"""
+        job_id = uuid.uuid4().hex
+        now = datetime.now().isoformat()
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO jobs (id, kind, status, progress, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, '{}', now, now)
+            )
+            self.conn.commit()
+            job = self._jobs[job_id] = Job(self, job_id)
+        self.executor.submit(self._run, job, func)
+        return job_id
+
+    def _run(self, job: Job, func: Callable[[Job], Dict]):
+        try:
+            job.check_cancelled()
+            self._save(job.job_id, status=RUNNING)
+            result = func(job)
+            self._save(job.job_id, status=SUCCEEDED, result=result)
+        except JobCancelled:
+            self._save(job.job_id, status=CANCELLED)
+        except Exception as e:
+            self.logger.error(f"任务 {job.job_id} 执行失败: {e}")
+            self._save(job.job_id, status=FAILED, error=str(e))
+        finally:
+            with self._lock:
+                self._jobs.pop(job.job_id, None)
+            job.finished.set()
+
+    def _save(self, job_id: str, status: Optional[str] = None, progress: Optional[Dict] = None,
+              result=None, error: Optional[str] = None):
+        fields = {'updated_at': datetime.now().isoformat()}
+        if status is not None:
+            fields['status'] = status
+        if progress is not None:
+            fields['progress'] = json.dumps(progress, ensure_ascii=False)
+        if result is not None:
+            fields['result'] = json.dumps(result, ensure_ascii=False)
+        if error is not None:
+            fields['error'] = error
+        with self._lock:
+            # 已取消的任务不再被覆盖为其他状态
+            self.conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{key} = ?' for key in fields)} WHERE id = ? AND status != ?",
+                (*fields.values(), job_id, CANCELLED)
+            )
+            self.conn.commit()
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row is not None else None
+
+    def list(self, limit: int = 50) -> List[Dict]:
+        """最近提交的任务，不包含结果内容"""
+        with self._lock:
+            rows = self.conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        jobs = [self._row_to_job(row) for row in rows]
+        for job in jobs:
+            job.pop('result', None)
+        return jobs
+
+    def cancel(self, job_id: str) -> bool:
+        """取消排队中或运行中的任务，运行中的任务在下一次上报进度时停止；任务不存在或已结束时返回False"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            job.cancel_event.set()
+            self.conn.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status IN (?, ?)",
+                              (CANCELLED, datetime.now().isoformat(), job_id, QUEUED, RUNNING))
+            self.conn.commit()
+            return True
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Dict]:
+        """等待任务结束（主要用于测试和命令行），返回任务状态"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            job.finished.wait(timeout)
+        return self.get(job_id)
+
+    def _row_to_job(self, row) -> Dict:
+        return {
+            'job_id': row['id'],
+            'kind': row['kind'],
+            'status': row['status'],
+            'progress': json.loads(row['progress']) if row['progress'] else {},
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error'],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at']
+        }
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,430 @@
+"""
+本地消息归档模块
+将解析后的聊天记录保存到SQLite数据库，并建立FTS5全文索引；
+源文件未变化时直接读取归档，无需重新解析
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# 消息中单独成列的字段，其余字段以JSON形式保存在extra列
+_CORE_FIELDS = ('timestamp', 'sender', 'message')
+
+# 这些类型的文件是聊天数据库而非文本导出：消息以迭代器的形式逐条写入，不记录字节位置检查点
+DATABASE_CHAT_TYPES = ('wechat_db',)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    chat_type TEXT,
+    size INTEGER,
+    mtime REAL,
+    hash TEXT,
+    message_count INTEGER DEFAULT 0,
+    ingested_at TEXT,
+    checkpoint_offset INTEGER,
+    checkpoint_message_id INTEGER,
+    last_timestamp TEXT,
+    prefix_hash TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    timestamp TEXT,
+    sender TEXT,
+    message TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_messages_file ON messages(file_id, id);
+CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp);
+CREATE INDEX IF NOT EXISTS idx_messages_file_time ON messages(file_id, IFNULL(timestamp, ''), id);
+"""
+
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    message, content='messages', content_rowid='id', tokenize='{tokenizer}'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, message) VALUES (new.id, new.message);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, message) VALUES ('delete', old.id, old.message);
+END;
+"""
+
+
+# 增量导入检查点相关字段，旧版本创建的数据库缺少时自动补齐
+_CHECKPOINT_COLUMNS = {
+    'checkpoint_offset': 'INTEGER',
+    'checkpoint_message_id': 'INTEGER',
+    'last_timestamp': 'TEXT',
+    'prefix_hash': 'TEXT'
+}
+
+# 导出文件中每条消息的首行: 2024-01-01 12:00:00 发送者
+_MESSAGE_HEADER = re.compile(rb'\n(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} )')
+
+
+def file_digest(file_path: str, chunk_size: int = 1024 * 1024, length: Optional[int] = None) -> str:
+    """分块计算文件的SHA-256，指定length时只计算前length个字节"""
+    digest = hashlib.sha256()
+    remaining = length
+    with open(file_path, 'rb') as f:
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return digest.hexdigest()
+
+
+def _iter_message_offsets(f, chunk_size: int):
+    """从文件末尾向前逐个生成消息首行的字节位置"""
+    end = f.seek(0, os.SEEK_END)
+    tail = b''
+    while end > 0:
+        start = max(0, end - chunk_size)
+        f.seek(start)
+        # 保留上一块开头的部分，避免首行被切断在两块之间
+        tail = f.read(end - start) + tail[:64]
+        # 文件开头视为紧跟在换行之后
+        buffer = b'\n' + tail if start == 0 else tail
+        shift = start - (len(buffer) - len(tail))
+        for match in reversed(list(_MESSAGE_HEADER.finditer(buffer))):
+            offset = shift + match.start(1)
+            # 位置在end之后的首行已在上一块中生成过
+            if offset <= end:
+                yield offset
+        end = start
+
+
+def message_offset(file_path: str, message: Dict, chunk_size: int = 64 * 1024) -> Optional[int]:
+    """从文件末尾向前查找指定消息首行的字节位置，找不到时返回None
+
+    首行须以该消息的时间和发送者开头，且正文以该消息的内容开头
+    """
+    header = f"{str(message.get('timestamp')).replace('T', ' ')} {message.get('sender')}".encode('utf-8')
+    body = (message.get('message') or '')[:50].encode('utf-8')
+    with open(file_path, 'rb') as f:
+        for offset in _iter_message_offsets(f, chunk_size):
+            f.seek(offset)
+            if f.readline().startswith(header) and f.read(len(body) + 64).lstrip().startswith(body):
+                return offset
+    return None
+
+
+class MessageArchive:
+    """基于SQLite的本地消息归档，支持增量导入和全文检索"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.logger = logging.getLogger('MessageArchive')
+        self.fts_tokenizer = None
+        self._conn = None
+        self._lock = threading.RLock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """数据库连接，首次使用时创建并初始化表结构"""
+        if self._conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.executescript(_SCHEMA)
+            self._migrate(conn)
+            self.fts_tokenizer = self._init_fts(conn)
+            self._conn = conn
+        return self._conn
+
+    def _migrate(self, conn):
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(files)")}
+        for name, column_type in _CHECKPOINT_COLUMNS.items():
+            if name not in columns:
+                conn.execute(f"ALTER TABLE files ADD COLUMN {name} {column_type}")
+        conn.commit()
+
+    def _init_fts(self, conn) -> Optional[str]:
+        """创建全文索引，优先使用适合中文的trigram分词，不支持FTS5时返回None"""
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'messages_fts'").fetchone()
+        if row is not None:
+            return 'trigram' if 'trigram' in row['sql'] else 'unicode61'
+        for tokenizer in ('trigram', 'unicode61'):
+            try:
+                conn.executescript(_FTS_SCHEMA.format(tokenizer=tokenizer))
+                return tokenizer
+            except sqlite3.OperationalError:
+                continue
+        self.logger.warning("当前SQLite不支持FTS5，全文检索将退化为LIKE查询")
+        return None
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def extract(self, file_configs: List[Dict],
+                extract_many: Callable[[List[Dict]], Iterable[Tuple[Dict, Iterable[Dict]]]]) -> List[Dict]:
+        """增量导入文件后从归档中读取消息，与直接解析的结果格式一致"""
+        return self.load_messages(self.ingest(file_configs, extract_many))
+
+    def ingest(self, file_configs: List[Dict],
+               extract_many: Callable[[List[Dict]], Iterable[Tuple[Dict, Iterable[Dict]]]]) -> List[str]:
+        """增量导入文件，返回存在的文件在归档中的路径
+
+        extract_many接收需要重新解析的文件配置列表，逐个生成 (配置, 消息列表)，
+        可以并行解析；未变化的文件不会传给它。只在末尾追加了内容的文件，
+        配置中会带上offset，只需解析该字节位置之后的部分。
+        """
+        paths = []
+        pending = []
+        states = {}
+        for config in file_configs:
+            file_path = config.get('file_path')
+            if not file_path or not os.path.exists(file_path):
+                continue
+            path = os.path.abspath(file_path)
+            paths.append(path)
+            state = self._check_file(path, config.get('type', 'auto'))
+            if state is None:
+                continue
+            if state['append_offset'] is not None:
+                config = dict(config, offset=state['append_offset'])
+            pending.append(config)
+            states[id(config)] = state
+
+        while pending:
+            retry = []
+            for config, messages in extract_many(pending):
+                state = states[id(config)]
+                if messages is None:
+                    # 解析失败时不写入文件状态，保留已归档的内容，下次导入时重新解析
+                    self.logger.warning(f"{state['path']} 解析失败，本次跳过")
+                    continue
+                if state['append_offset'] is not None and not self._append_matches(state, messages):
+                    # 追加部分与已归档的内容衔接不上，回退为完整解析
+                    self.logger.info(f"{state['path']} 无法增量导入，重新完整解析")
+                    state['append_offset'] = None
+                    config = {key: value for key, value in config.items() if key != 'offset'}
+                    states[id(config)] = state
+                    retry.append(config)
+                    continue
+                try:
+                    self._store_file(state, messages)
+                except (sqlite3.Error, OSError) as e:
+                    # 流式读取的数据库中途出错时事务已回滚，不写入文件状态，下次导入时重新读取；
+                    # 其他异常（如进度回调中抛出的任务取消）不在这里处理，直接中止导入
+                    self.logger.error(f"{state['path']} 写入归档失败，本次跳过: {e}")
+            pending = retry
+        return paths
+
+    def _check_file(self, path: str, chat_type: str) -> Optional[Dict]:
+        """检查文件是否需要重新解析，需要时返回写入归档所需的文件状态，否则返回None
+
+        计算文件哈希需要读取整个文件，在锁外进行，不阻塞其他线程对归档的读写
+        """
+        stat = os.stat(path)
+        append_offset = None
+        with self._lock:
+            row = self.conn.execute("SELECT * FROM files WHERE path = ?", (path,)).fetchone()
+        if row is not None and row['chat_type'] == chat_type:
+            if row['size'] == stat.st_size and row['mtime'] == stat.st_mtime:
+                return None
+            digest = file_digest(path)
+            if row['hash'] == digest:
+                # 内容未变，只是修改时间变化
+                with self._lock:
+                    self.conn.execute("UPDATE files SET mtime = ? WHERE id = ?", (stat.st_mtime, row['id']))
+                    self.conn.commit()
+                return None
+            # 最后一条消息之前的内容未变时，从最后一条消息开始解析追加的部分
+            checkpoint = row['checkpoint_offset']
+            if (checkpoint is not None and stat.st_size > row['size']
+                    and file_digest(path, length=checkpoint) == row['prefix_hash']):
+                append_offset = checkpoint
+        else:
+            digest = file_digest(path)
+
+        return {
+            'path': path,
+            'chat_type': chat_type,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'hash': digest,
+            'file_id': row['id'] if row is not None else None,
+            'append_offset': append_offset,
+            'checkpoint_message_id': row['checkpoint_message_id'] if row is not None else None,
+            'last_timestamp': row['last_timestamp'] if row is not None else None
+        }
+
+    def _append_matches(self, state: Dict, messages: List[Dict]) -> bool:
+        """追加解析的第一条消息应当与上次归档的最后一条消息的时间、发送者和内容都相同"""
+        if not messages:
+            return False
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT timestamp, sender, message FROM messages WHERE id = ?", (state['checkpoint_message_id'],)
+            ).fetchone()
+        first = messages[0]
+        return row is not None and (
+            (first.get('timestamp'), first.get('sender'), first.get('message'))
+            == (row['timestamp'], row['sender'], row['message'])
+        )
+
+    def _store_file(self, state: Dict, messages: Iterable[Dict]):
+        """将新解析的消息写入归档
+
+        完整解析时替换该文件的全部旧消息；增量解析时messages从上次的最后一条消息开始，
+        只替换这一条并追加其后的消息。聊天数据库的messages可以是迭代器，在同一事务中逐批写入。
+        """
+        appended = state['append_offset'] is not None
+        if state['chat_type'] in DATABASE_CHAT_TYPES or not messages:
+            checkpoint_offset = None
+        else:
+            # 检查点取最后一条实际解析并写入的消息，而不是文件中最后一个首行：
+            # 文件末尾没有换行时最后一条消息不会被解析出来
+            checkpoint_offset = message_offset(state['path'], messages[-1])
+        prefix_hash = file_digest(state['path'], length=checkpoint_offset) if checkpoint_offset is not None else None
+
+        with self._lock:
+            conn = self.conn
+            with conn:
+                conn.execute(
+                    "INSERT INTO files (path, chat_type, size, mtime, hash, ingested_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(path) DO UPDATE SET chat_type = excluded.chat_type, size = excluded.size, "
+                    "mtime = excluded.mtime, hash = excluded.hash, ingested_at = excluded.ingested_at",
+                    (state['path'], state['chat_type'], state['size'], state['mtime'], state['hash'],
+                     datetime.now().isoformat())
+                )
+                # file_id在同一事务中重新读取：其他线程可能在_check_file之后已导入过该文件
+                file_id = conn.execute("SELECT id FROM files WHERE path = ?", (state['path'],)).fetchone()['id']
+                if appended:
+                    conn.execute("DELETE FROM messages WHERE file_id = ? AND id >= ?",
+                                 (file_id, state['checkpoint_message_id']))
+                else:
+                    conn.execute("DELETE FROM messages WHERE file_id = ?", (file_id,))
+                self._insert_messages(conn, file_id, messages)
+
+                last = conn.execute(
+                    "SELECT id, timestamp FROM messages WHERE file_id = ? ORDER BY id DESC LIMIT 1", (file_id,)
+                ).fetchone()
+                message_count = conn.execute(
+                    "SELECT COUNT(*) FROM messages WHERE file_id = ?", (file_id,)
+                ).fetchone()[0]
+                if last is None:
+                    checkpoint_offset = prefix_hash = None
+                conn.execute(
+                    "UPDATE files SET message_count = ?, checkpoint_offset = ?, checkpoint_message_id = ?, "
+                    "last_timestamp = ?, prefix_hash = ? WHERE id = ?",
+                    (message_count, checkpoint_offset, last['id'] if last else None,
+                     last['timestamp'] if last else None, prefix_hash, file_id)
+                )
+
+        if appended:
+            self.logger.info(f"已增量归档 {state['path']}: 新解析 {len(messages)} 条消息")
+        else:
+            self.logger.info(f"已归档 {state['path']}: {message_count} 条消息")
+
+    def _insert_messages(self, conn, file_id: int, messages: Iterable[Dict]):
+        conn.executemany(
+            "INSERT INTO messages (file_id, timestamp, sender, message, extra) VALUES (?, ?, ?, ?, ?)",
+            (
+                (file_id, msg.get('timestamp'), msg.get('sender'), msg.get('message'),
+                 json.dumps({key: value for key, value in msg.items() if key not in _CORE_FIELDS},
+                            ensure_ascii=False))
+                for msg in messages
+            )
+        )
+
+    def load_messages(self, paths: List[str]) -> List[Dict]:
+        """按文件顺序读取归档中的消息"""
+        messages = []
+        with self._lock:
+            for path in paths:
+                cursor = self.conn.execute(
+                    "SELECT m.timestamp, m.sender, m.message, m.extra FROM messages m "
+                    "JOIN files f ON f.id = m.file_id WHERE f.path = ? ORDER BY m.id",
+                    (path,)
+                )
+                messages.extend(self._row_to_message(row) for row in cursor)
+        return messages
+
+    def iter_file_messages(self, path: str, batch_size: int = 1000) -> Iterator[Dict]:
+        """按时间顺序逐批读取一个文件的归档消息，供多路归并使用，内存占用与文件大小无关"""
+        last = ('', 0)
+        while True:
+            with self._lock:
+                rows = self.conn.execute(
+                    "SELECT m.id, IFNULL(m.timestamp, '') AS sort_key, m.timestamp, m.sender, m.message, m.extra "
+                    "FROM messages m JOIN files f ON f.id = m.file_id "
+                    "WHERE f.path = ? AND (IFNULL(m.timestamp, ''), m.id) > (?, ?) "
+                    "ORDER BY IFNULL(m.timestamp, ''), m.id LIMIT ?",
+                    (path, last[0], last[1], batch_size)
+                ).fetchall()
+            for row in rows:
+                yield self._row_to_message(row)
+            if len(rows) < batch_size:
+                return
+            last = (rows[-1]['sort_key'], rows[-1]['id'])
+
+    def _row_to_message(self, row) -> Dict:
+        message = {'timestamp': row['timestamp'], 'sender': row['sender'], 'message': row['message']}
+        if row['extra']:
+            message.update(json.loads(row['extra']))
+        return message
+
+    def search(self, query: str, limit: int = 50) -> List[Dict]:
+        """全文检索归档中的消息内容"""
+        if not query:
+            return []
+        with self._lock:
+            conn = self.conn
+            # trigram分词至少需要3个字符，更短的关键词使用LIKE
+            if self.fts_tokenizer and (self.fts_tokenizer != 'trigram' or len(query) >= 3):
+                phrase = '"' + query.replace('"', '""') + '"'
+                cursor = conn.execute(
+                    "SELECT m.id, m.timestamp, m.sender, m.message, m.extra, f.path FROM messages_fts "
+                    "JOIN messages m ON m.id = messages_fts.rowid JOIN files f ON f.id = m.file_id "
+                    "WHERE messages_fts MATCH ? ORDER BY rank LIMIT ?",
+                    (phrase, limit)
+                )
+            else:
+                pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                cursor = conn.execute(
+                    "SELECT m.id, m.timestamp, m.sender, m.message, m.extra, f.path FROM messages m "
+                    "JOIN files f ON f.id = m.file_id WHERE m.message LIKE ? ESCAPE '\\' "
+                    "ORDER BY m.timestamp DESC LIMIT ?",
+                    (pattern, limit)
+                )
+            results = []
+            for row in cursor:
+                message = self._row_to_message(row)
+                message['archive_id'] = row['id']
+                message['source_file'] = row['path']
+                results.append(message)
+            return results
+
+    def stats(self) -> Dict:
+        with self._lock:
+            conn = self.conn
+            return {
+                'files': conn.execute("SELECT COUNT(*) FROM files").fetchone()[0],
+                'messages': conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0],
+                'fts_tokenizer': self.fts_tokenizer,
+                'db_path': self.db_path
+            }
@@ -0,0 +1,325 @@
+"""
+列式消息存储模块
+以紧凑的列式结构在内存中保存聊天消息，供解析器、提取管理器和API接口共享
+"""
+
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional
+
+_EPOCH = datetime(1970, 1, 1)
+_MISSING = -1
+# 整数列中表示缺失的取值，也是int64的下限
+_MISSING_INT = -2 ** 63
+_INT_MAX = 2 ** 63 - 1
+
+
+def to_epoch(value) -> int:
+    """将datetime或ISO字符串转换为秒级时间戳"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.replace(tzinfo=None)
+    return (value - _EPOCH) // timedelta(seconds=1)
+
+
+def from_epoch(seconds: int) -> datetime:
+    """将秒级时间戳还原为datetime"""
+    return _EPOCH + timedelta(seconds=seconds)
+
+
+def iso_formatter(sep: str = 'T'):
+    """返回将秒级时间戳格式化为ISO字符串的函数，结果与 datetime.isoformat(sep) 相同
+
+    批量格式化时日期部分和一天内的时间部分各自缓存，
+    避免逐行创建datetime对象。
+    """
+    dates = {}
+    times = {}
+
+    def format_timestamp(seconds: int) -> str:
+        day, rest = divmod(seconds, 86400)
+        date = dates.get(day)
+        if date is None:
+            date = dates[day] = from_epoch(day * 86400).date().isoformat() + sep
+        time = times.get(rest)
+        if time is None:
+            hour, minute = divmod(rest // 60, 60)
+            time = times[rest] = '%02d:%02d:%02d' % (hour, minute, rest % 60)
+        return date + time
+
+    return format_timestamp
+
+
+class MessageStore:
+    """列式消息存储
+
+    - timestamps: int64 秒级时间戳
+    - sender_ids: 发送者在 senders 中的编号
+    - 所有消息内容保存在同一块 UTF-8 缓冲区中，通过 offsets 定位
+    - 其余字段（source、type 等）按列保存驻留后的取值编号
+    - 只出现整数的字段（如数据库中的create_time、local_id）每行取值往往各不相同，
+      不驻留，直接保存在 int64 列中
+    """
+
+    def __init__(self, content_key: str = 'content'):
+        self.content_key = content_key
+        self.timestamps = array('q')
+        self.sender_ids = array('i')
+        self.senders: List[str] = []
+        self._sender_lookup: Dict[str, int] = {}
+        self._content = bytearray()
+        self._offsets = array('q', [0])
+        self._extra_columns: Dict[str, array] = {}
+        self._int_columns: Dict[str, array] = {}
+        self._values: List = []
+        self._value_lookup: Dict = {}
+        self._index: Optional['MessageIndex'] = None
+
+    @classmethod
+    def from_messages(cls, messages: Iterable[Dict], content_key: str = 'content') -> 'MessageStore':
+        """从消息字典序列构建存储"""
+        store = cls(content_key=content_key)
+        store.extend(messages)
+        return store
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def _intern_sender(self, sender: str) -> int:
+        sender_id = self._sender_lookup.get(sender)
+        if sender_id is None:
+            sender_id = len(self.senders)
+            self.senders.append(sender)
+            self._sender_lookup[sender] = sender_id
+        return sender_id
+
+    def _intern_value(self, value) -> int:
+        # 按类型区分，避免 1 与 True、1.0 被合并为同一个取值
+        key = (type(value), value)
+        value_id = self._value_lookup.get(key)
+        if value_id is None:
+            value_id = len(self._values)
+            self._values.append(value)
+            self._value_lookup[key] = value_id
+        return value_id
+
+    def _intern_int_column(self, key: str) -> array:
+        """整数列中出现了其他类型的取值时，转换为驻留取值编号的列"""
+        column = array('i', (_MISSING if value == _MISSING_INT else self._intern_value(value)
+                             for value in self._int_columns.pop(key)))
+        self._extra_columns[key] = column
+        return column
+
+    def append(self, timestamp, sender: str, content: str, **extras):
+        """追加一条消息"""
+        row = len(self.timestamps)
+        self._index = None
+        self.timestamps.append(timestamp if isinstance(timestamp, int) else to_epoch(timestamp))
+        self.sender_ids.append(self._intern_sender(sender or ''))
+        self._content += (content or '').encode('utf-8')
+        self._offsets.append(len(self._content))
+
+        for key, value in extras.items():
+            column = self._extra_columns.get(key)
+            if column is None:
+                int_column = self._int_columns.get(key)
+                if type(value) is int and _MISSING_INT < value <= _INT_MAX:
+                    if int_column is None:
+                        int_column = self._int_columns[key] = array('q', [_MISSING_INT]) * row
+                    int_column.append(value)
+                    continue
+                if int_column is not None:
+                    column = self._intern_int_column(key)
+                else:
+                    column = self._extra_columns[key] = array('i', [_MISSING]) * row
+            column.append(self._intern_value(value))
+        # 本条消息没有的字段补齐为缺失
+        for key, column in self._extra_columns.items():
+            if len(column) == row:
+                column.append(_MISSING)
+        for key, column in self._int_columns.items():
+            if len(column) == row:
+                column.append(_MISSING_INT)
+
+    def extend(self, messages: Iterable[Dict]):
+        """批量追加消息字典"""
+        content_key = self.content_key
+        for msg in messages:
+            extras = {key: value for key, value in msg.items()
+                      if key not in ('timestamp', 'sender', content_key)}
+            self.append(msg.get('timestamp'), msg.get('sender', ''), msg.get(content_key, ''), **extras)
+
+    def timestamp_at(self, row: int) -> datetime:
+        return from_epoch(self.timestamps[row])
+
+    def sender_at(self, row: int) -> str:
+        return self.senders[self.sender_ids[row]]
+
+    def content_at(self, row: int) -> str:
+        return self._content[self._offsets[row]:self._offsets[row + 1]].decode('utf-8')
+
+    def record(self, row: int, iso: bool = True) -> Dict:
+        """取出一行，返回消息字典"""
+        timestamp = self.timestamp_at(row)
+        record = {
+            'timestamp': timestamp.isoformat() if iso else timestamp,
+            'sender': self.sender_at(row),
+            self.content_key: self.content_at(row)
+        }
+        record.update(self._extras_at(row))
+        return record
+
+    def _extras_at(self, row: int) -> Dict:
+        extras = {}
+        for key, column in self._extra_columns.items():
+            value_id = column[row]
+            if value_id != _MISSING:
+                extras[key] = self._values[value_id]
+        for key, column in self._int_columns.items():
+            value = column[row]
+            if value != _MISSING_INT:
+                extras[key] = value
+        return extras
+
+    def iter_records(self, rows: Optional[Iterable[int]] = None, iso: bool = True) -> Iterator[Dict]:
+        if rows is None:
+            rows = range(len(self))
+        if not iso:
+            for row in rows:
+                yield self.record(row, iso=False)
+            return
+
+        # 批量输出时直接读取各列，不经过逐行的datetime转换
+        format_timestamp = iso_formatter()
+        timestamps, sender_ids, senders = self.timestamps, self.sender_ids, self.senders
+        content, offsets, content_key = self._content, self._offsets, self.content_key
+        extra_columns = list(self._extra_columns.items())
+        int_columns = list(self._int_columns.items())
+        values = self._values
+        for row in rows:
+            record = {
+                'timestamp': format_timestamp(timestamps[row]),
+                'sender': senders[sender_ids[row]],
+                content_key: content[offsets[row]:offsets[row + 1]].decode('utf-8')
+            }
+            for key, column in extra_columns:
+                value_id = column[row]
+                if value_id != _MISSING:
+                    record[key] = values[value_id]
+            for key, column in int_columns:
+                value = column[row]
+                if value != _MISSING_INT:
+                    record[key] = value
+            yield record
+
+    def to_records(self, rows: Optional[Iterable[int]] = None, iso: bool = True) -> List[Dict]:
+        """转换为消息字典列表，时间戳默认输出为ISO字符串"""
+        return list(self.iter_records(rows, iso=iso))
+
+    def take(self, rows: Iterable[int]) -> 'MessageStore':
+        """按行号取出子集，返回新的存储"""
+        subset = MessageStore(content_key=self.content_key)
+        for row in rows:
+            subset.append(self.timestamps[row], self.sender_at(row), self.content_at(row), **self._extras_at(row))
+        return subset
+
+    @property
+    def index(self) -> 'MessageIndex':
+        """时间和发送者索引，首次使用时建立，追加消息后自动失效"""
+        if self._index is None:
+            self._index = MessageIndex(self)
+        return self._index
+
+    def filter(self, start_time=None, end_time=None, sender: Optional[str] = None) -> List[int]:
+        """按时间范围和发送者筛选，返回行号列表"""
+        start = end = None
+        if start_time and end_time:
+            start, end = to_epoch(start_time), to_epoch(end_time)
+        sender_id = None
+        if sender:
+            sender_id = self._sender_lookup.get(sender)
+            if sender_id is None:
+                return []
+        return self.index.query(start, end, sender_id)
+
+    def to_dataframe(self, rows: Optional[Iterable[int]] = None):
+        """转换为pandas DataFrame，兼容原有基于DataFrame的处理逻辑"""
+        import pandas as pd
+        return pd.DataFrame(self.to_records(rows, iso=False))
+
+    def get_contacts(self) -> List[str]:
+        return list(self.senders)
+
+    @property
+    def nbytes(self) -> int:
+        """估算占用的内存字节数，包括发送者和字段取值的驻留表"""
+        size = (self.timestamps.itemsize * len(self.timestamps)
+                + self.sender_ids.itemsize * len(self.sender_ids)
+                + self._offsets.itemsize * len(self._offsets)
+                + len(self._content))
+        size += sum(column.itemsize * len(column) for column in self._extra_columns.values())
+        size += sum(column.itemsize * len(column) for column in self._int_columns.values())
+        # 驻留表：列表和字典本身，以及其中的字符串、取值对象和 (类型, 取值) 键
+        size += sys.getsizeof(self.senders) + sys.getsizeof(self._sender_lookup)
+        size += sum(sys.getsizeof(sender) for sender in self.senders)
+        size += sys.getsizeof(self._values) + sys.getsizeof(self._value_lookup)
+        size += sum(sys.getsizeof(value) + sys.getsizeof((None, value)) for value in self._values)
+        return size
+
+
+class MessageIndex:
+    """消息的时间和发送者索引
+
+    - order: 按时间排序后的行号
+    - sorted_timestamps: 与 order 对应的有序时间戳，用于二分查找时间范围
+    - postings: 发送者编号 -> 该发送者消息在 order 中的位置（升序）
+
+    时间范围查询为 O(log n + k)，时间加发送者的组合查询直接在发送者的
+    位置列表上二分截取，不需要两次全表扫描。
+    """
+
+    def __init__(self, store: MessageStore):
+        timestamps = store.timestamps
+        n = len(timestamps)
+        self.is_time_sorted = all(timestamps[i] <= timestamps[i + 1] for i in range(n - 1))
+        if self.is_time_sorted:
+            self.order = array('i', range(n))
+            self.sorted_timestamps = timestamps
+        else:
+            self.order = array('i', sorted(range(n), key=timestamps.__getitem__))
+            self.sorted_timestamps = array('q', (timestamps[row] for row in self.order))
+
+        self.postings: Dict[int, array] = {}
+        sender_ids = store.sender_ids
+        for position, row in enumerate(self.order):
+            posting = self.postings.get(sender_ids[row])
+            if posting is None:
+                posting = self.postings[sender_ids[row]] = array('i')
+            posting.append(position)
+
+    def time_range(self, start: Optional[int] = None, end: Optional[int] = None):
+        """返回时间范围在 order 中对应的位置区间 [lo, hi)"""
+        lo = 0 if start is None else bisect_left(self.sorted_timestamps, start)
+        hi = len(self.order) if end is None else bisect_right(self.sorted_timestamps, end)
+        return lo, max(lo, hi)
+
+    def query(self, start: Optional[int] = None, end: Optional[int] = None,
+              sender_id: Optional[int] = None) -> List[int]:
+        """按秒级时间范围和发送者编号查询，返回按原顺序排列的行号"""
+        lo, hi = self.time_range(start, end)
+        if sender_id is None:
+            positions = range(lo, hi)
+        else:
+            posting = self.postings.get(sender_id)
+            if posting is None:
+                return []
+            positions = posting[bisect_left(posting, lo):bisect_left(posting, hi)]
+
+        order = self.order
+        rows = [order[position] for position in positions]
+        if not self.is_time_sorted:
+            rows.sort()
+        return rows
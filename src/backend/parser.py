@@ -1,15 +1,34 @@
+import io
 import re
-import pandas as pd
 from datetime import datetime
 
+from message_store import MessageStore, iso_formatter
+
+# 微信聊天记录通常格式: [2023/1/1 12:00:00] 张三: 消息内容
+WECHAT_PATTERN = re.compile(r'\[(\d{4}/\d{1,2}/\d{1,2}\s+\d{1,2}:\d{1,2}:\d{1,2})\]\s+([^:]+):\s+(.+)', re.MULTILINE)
+# QQ聊天记录通常格式: 2023-01-01 12:00:00 张三: 消息内容
+QQ_PATTERN = re.compile(r'(\d{4}-\d{1,2}-\d{1,2}\s+\d{1,2}:\d{1,2}:\d{1,2})\s+([^:]+):\s+(.+)', re.MULTILINE)
+
+# 格式检测只读取文件开头的这部分字符
+DETECT_SAMPLE_SIZE = 4096
+# 流式解析时每次从文件读取的字符数
+STREAM_CHUNK_SIZE = 1024 * 1024
+
 class ChatParser:
     def __init__(self, file_path=None, text_content=None):
         self.file_path = file_path
         self.text_content = text_content
-        self.raw_text = self._read_content()
+        self._raw_text = None
         self.messages = []
         self.contacts = set()
     
+    @property
+    def raw_text(self):
+        """完整聊天内容，首次访问时才读取整个文件"""
+        if self._raw_text is None:
+            self._raw_text = self._read_content()
+        return self._raw_text
+    
     def _read_content(self):
         """读取聊天内容，支持文件路径或直接文本内容"""
         if self.text_content:
@@ -19,35 +38,123 @@ class ChatParser:
                 return f.read()
         return ""
     
+    def read_head(self, size=DETECT_SAMPLE_SIZE):
+        """只读取内容开头的一小段，用于格式检测和预览"""
+        if self._raw_text is not None:
+            return self._raw_text[:size]
+        if self.text_content:
+            return self.text_content[:size]
+        elif self.file_path:
+            with open(self.file_path, 'r', encoding='utf-8') as f:
+                return f.read(size)
+        return ""
+    
+    def _iter_chunks(self, chunk_size):
+        """按块读取内容，文本内容已在内存中时直接整体返回"""
+        if self._raw_text is not None or self.text_content or not self.file_path:
+            if self.raw_text:
+                yield self.raw_text
+            return
+        
+        with open(self.file_path, 'r', encoding='utf-8') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if chunk:
+                    yield chunk
+                # 文本模式下读到的字符数不足说明已到文件末尾
+                if len(chunk) < chunk_size:
+                    break
+    
+    def _iter_blocks(self, chunk_size):
+        """按行边界切分内容块，跨块的不完整行会拼接到下一块"""
+        pending = ""
+        for chunk in self._iter_chunks(chunk_size):
+            chunk = pending + chunk
+            cut = chunk.rfind('\n') + 1
+            if cut == 0:
+                pending = chunk
+                continue
+            pending = chunk[cut:]
+            yield chunk[:cut]
+        if pending:
+            yield pending
+    
+    def _parse_timestamp(self, timestamp_str, formats):
+        for fmt in formats:
+            try:
+                return datetime.strptime(timestamp_str, fmt)
+            except ValueError:
+                continue
+        return datetime.now()  # 默认值
+    
+    def detect_format(self, sample=None):
+        """根据内容开头的片段检测聊天记录类型，无法判断时返回None"""
+        if sample is None:
+            sample = self.read_head()
+        
+        # 简单检测：如果包含[yyyy/mm/dd]格式，可能是微信记录
+        if re.search(r'\[\d{4}/\d{1,2}/\d{1,2}', sample):
+            return 'wechat'
+        # 如果包含yyyy-mm-dd格式，可能是QQ记录
+        elif re.search(r'\d{4}-\d{1,2}-\d{1,2}', sample):
+            return 'qq'
+        return None
+    
+    def iter_messages(self, format_type=None, chunk_size=STREAM_CHUNK_SIZE):
+        """流式解析聊天记录，逐条生成消息，内存占用与文件大小无关
+
+        未指定格式时与auto_detect_and_parse一致：先按从文件开头判断出的格式解析
+        （无法判断时按微信格式），没有解析到消息再按另一种格式解析。
+        """
+        if format_type is not None:
+            yield from self._iter_format(format_type, chunk_size)
+            return
+        
+        first, second = self._format_order()
+        found = False
+        for msg in self._iter_format(first, chunk_size):
+            found = True
+            yield msg
+        if not found:
+            yield from self._iter_format(second, chunk_size)
+    
+    def _format_order(self):
+        """自动检测时依次尝试的两种格式，文件开头只是碰巧像某种格式时仍会尝试另一种"""
+        if self.detect_format() == 'qq':
+            return 'qq', 'wechat'
+        return 'wechat', 'qq'
+    
+    def _iter_format(self, format_type, chunk_size):
+        if format_type == 'wechat':
+            pattern = WECHAT_PATTERN
+            formats = ('%Y/%m/%d %H:%M:%S', '%Y-%m-%d %H:%M:%S')
+        else:
+            pattern = QQ_PATTERN
+            formats = ('%Y-%m-%d %H:%M:%S',)
+        
+        for block in self._iter_blocks(chunk_size):
+            for match in pattern.finditer(block):
+                timestamp_str, sender, content = match.groups()
+                self.contacts.add(sender)
+                yield {
+                    'timestamp': self._parse_timestamp(timestamp_str, formats),
+                    'sender': sender,
+                    'content': content
+                }
+    
+    def _to_dataframe(self, messages):
+        # pandas导入较慢，只在需要DataFrame时才导入
+        import pandas as pd
+        return pd.DataFrame(messages)
+    
     def parse_wechat(self):
         """解析微信聊天记录格式"""
         # 重置数据
         self.messages = []
         self.contacts = set()
         
-        # 微信聊天记录通常格式: [2023/1/1 12:00:00] 张三: 消息内容
-        pattern = r'\[(\d{4}/\d{1,2}/\d{1,2}\s+\d{1,2}:\d{1,2}:\d{1,2})\]\s+([^:]+):\s+(.+)'
-        matches = re.findall(pattern, self.raw_text, re.MULTILINE)
-        
-        for match in matches:
-            timestamp_str, sender, content = match
-            try:
-                timestamp = datetime.strptime(timestamp_str, '%Y/%m/%d %H:%M:%S')
-            except ValueError:
-                # 尝试其他可能的日期格式
-                try:
-                    timestamp = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-                except ValueError:
-                    timestamp = datetime.now()  # 默认值
-            
-            self.contacts.add(sender)
-            self.messages.append({
-                'timestamp': timestamp,
-                'sender': sender,
-                'content': content
-            })
-        
-        return pd.DataFrame(self.messages)
+        self.messages = list(self.iter_messages('wechat'))
+        return self._to_dataframe(self.messages)
     
     def parse_qq(self):
         """解析QQ聊天记录格式"""
@@ -55,25 +162,8 @@ class ChatParser:
         self.messages = []
         self.contacts = set()
         
-        # QQ聊天记录通常格式: 2023-01-01 12:00:00 张三: 消息内容
-        pattern = r'(\d{4}-\d{1,2}-\d{1,2}\s+\d{1,2}:\d{1,2}:\d{1,2})\s+([^:]+):\s+(.+)'
-        matches = re.findall(pattern, self.raw_text, re.MULTILINE)
-        
-        for match in matches:
-            timestamp_str, sender, content = match
-            try:
-                timestamp = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-            except ValueError:
-                timestamp = datetime.now()  # 默认值
-            
-            self.contacts.add(sender)
-            self.messages.append({
-                'timestamp': timestamp,
-                'sender': sender,
-                'content': content
-            })
-        
-        return pd.DataFrame(self.messages)
+        self.messages = list(self.iter_messages('qq'))
+        return self._to_dataframe(self.messages)
     
     def auto_detect_and_parse(self):
         """自动检测聊天记录类型并解析"""
@@ -81,22 +171,29 @@ class ChatParser:
         self.messages = []
         self.contacts = set()
         
-        # 简单检测：如果包含[yyyy/mm/dd]格式，可能是微信记录
-        if re.search(r'\[\d{4}/\d{1,2}/\d{1,2}', self.raw_text):
-            return self.parse_wechat()
-        # 如果包含yyyy-mm-dd格式，可能是QQ记录
-        elif re.search(r'\d{4}-\d{1,2}-\d{1,2}', self.raw_text):
-            return self.parse_qq()
-        # 尝试两种格式都解析
-        else:
-            wechat_result = self.parse_wechat()
-            if len(wechat_result) > 0:
-                return wechat_result
-            return self.parse_qq()
+        # 先按文件开头几KB判断出的格式解析，没有解析到消息时再尝试另一种格式
+        parsers = {'wechat': self.parse_wechat, 'qq': self.parse_qq}
+        first, second = self._format_order()
+        result = parsers[first]()
+        if len(result) > 0:
+            return result
+        return parsers[second]()
+    
+    def parse_to_store(self, format_type=None):
+        """流式解析并直接写入列式存储，不经过中间的消息列表"""
+        self.messages = []
+        self.contacts = set()
+        
+        store = MessageStore()
+        for msg in self.iter_messages(format_type):
+            store.append(msg['timestamp'], msg['sender'], msg['content'])
+        return store
     
     def filter_by_time(self, df, start_time, end_time):
         """按时间范围筛选消息"""
         if start_time and end_time:
+            if isinstance(df, MessageStore):
+                return df.take(df.filter(start_time, end_time))
             mask = (df['timestamp'] >= start_time) & (df['timestamp'] <= end_time)
             return df[mask]
         return df
@@ -104,6 +201,8 @@ class ChatParser:
     def filter_by_sender(self, df, sender):
         """按发送者筛选消息"""
         if sender:
+            if isinstance(df, MessageStore):
+                return df.take(df.filter(sender=sender))
             return df[df['sender'] == sender]
         return df
     
@@ -111,10 +210,42 @@ class ChatParser:
         """获取所有联系人列表"""
         return list(self.contacts)
     
-    def format_for_ai(self, df):
-        """将DataFrame格式化为适合AI处理的文本"""
-        formatted_text = ""
-        for _, row in df.iterrows():
-            timestamp = row['timestamp'].strftime('%Y-%m-%d %H:%M:%S')
-            formatted_text += f"[{timestamp}] {row['sender']}: {row['content']}\n"
-        return formatted_text
\ No newline at end of file
+    def format_for_ai(self, df, rows=None, max_chars=None):
+        """将DataFrame或MessageStore格式化为适合AI处理的文本，rows可指定MessageStore中的行号
+
+        指定max_chars时只保留不超过该长度的完整行
+        """
+        buffer = io.StringIO()
+        self.write_for_ai(df, buffer, rows, max_chars)
+        return buffer.getvalue()
+    
+    def write_for_ai(self, df, buffer, rows=None, max_chars=None):
+        """将格式化文本逐行写入buffer，累计长度达到max_chars时停止，返回写入的行数"""
+        written = 0
+        remaining = max_chars
+        for line in self._iter_ai_lines(df, rows):
+            if remaining is not None:
+                remaining -= len(line)
+                if remaining < 0:
+                    break
+            buffer.write(line)
+            written += 1
+        return written
+    
+    def _iter_ai_lines(self, df, rows=None):
+        """逐行生成 "[时间] 发送者: 内容" 格式的文本"""
+        if isinstance(df, MessageStore):
+            if rows is None:
+                rows = range(len(df))
+            format_timestamp = iso_formatter(' ')
+            timestamps, sender_ids, senders = df.timestamps, df.sender_ids, df.senders
+            for row in rows:
+                yield f"[{format_timestamp(timestamps[row])}] {senders[sender_ids[row]]}: {df.content_at(row)}\n"
+            return
+        
+        if df.empty:
+            return
+        # 按列格式化时间戳并拼接，避免逐行iterrows
+        timestamps = df['timestamp'].dt.strftime('%Y-%m-%d %H:%M:%S')
+        lines = '[' + timestamps + '] ' + df['sender'].astype(str) + ': ' + df['content'].astype(str) + '\n'
+        yield from lines.tolist()
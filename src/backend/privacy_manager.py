@@ -5,9 +5,55 @@
 
 import re
 import hashlib
+from concurrent.futures.process import BrokenProcessPool
 from typing import List, Dict, Optional
 from datetime import datetime
 
+import process_pool
+
+# 所有敏感模式都至少包含数字、@、wxid_ 或 省市区县 之一，不含这些字符的消息可直接跳过
+_SENSITIVE_HINT = re.compile(r'[\d@省市区县]|wxid_')
+
+class ContentAnonymizer:
+    """单次扫描的内容脱敏器
+    
+    将所有敏感模式合并为一个带命名分组的预编译正则，每条消息只扫描一遍。
+    同一位置可匹配多个模式时，按 patterns 中的先后顺序取第一个。
+    """
+    
+    def __init__(self, patterns: Dict[str, str]):
+        self.patterns = dict(patterns)
+        self.replacements = {name: f'[{name.upper()}]' for name in self.patterns}
+        self.regex = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern in self.patterns.items()))
+    
+    def _replace(self, match):
+        return self.replacements[match.lastgroup]
+    
+    def anonymize(self, content: str) -> str:
+        if not content or not _SENSITIVE_HINT.search(content):
+            return content
+        return self.regex.sub(self._replace, content)
+    
+    def anonymize_batch(self, contents: List[str]) -> List[str]:
+        """批量脱敏"""
+        hint = _SENSITIVE_HINT.search
+        sub = self.regex.sub
+        replace = self._replace
+        return [sub(replace, content) if content and hint(content) else content for content in contents]
+
+# 消息数达到该值时使用多进程并行脱敏
+PARALLEL_ANONYMIZE_THRESHOLD = 50000
+
+# 工作进程中按敏感模式缓存的脱敏器，进程池与其他任务共用，不能使用初始化函数
+_worker_anonymizers: Dict[tuple, ContentAnonymizer] = {}
+
+def _anonymize_shard(patterns: Dict[str, str], contents: List[str]) -> List[str]:
+    key = tuple(patterns.items())
+    anonymizer = _worker_anonymizers.get(key)
+    if anonymizer is None:
+        anonymizer = _worker_anonymizers[key] = ContentAnonymizer(patterns)
+    return anonymizer.anonymize_batch(contents)
+
 class PrivacyManager:
     """隐私管理器"""
     
@@ -37,6 +83,7 @@ class PrivacyManager:
             'qq_number': r'[1-9]\d{4,10}',
             'wechat_id': r'wxid_[a-zA-Z0-9_-]+',
         }
+        self.anonymizer = ContentAnonymizer(self.sensitive_patterns)
     
     def has_valid_consent(self, privacy_level: str) -> bool:
         """检查是否有有效的用户授权"""
@@ -44,12 +91,20 @@ class PrivacyManager:
         # 暂时返回True，实际应该检查配置文件
         return True
     
-    def anonymize_messages(self, messages: List[Dict]) -> List[Dict]:
-        """对消息进行脱敏处理"""
+    def anonymize_messages(self, messages: List[Dict], parallel_threshold: int = PARALLEL_ANONYMIZE_THRESHOLD,
+                           max_workers: Optional[int] = None) -> List[Dict]:
+        """对消息进行脱敏处理，消息数达到parallel_threshold时内容脱敏分片到多个进程并行执行"""
         anonymized_messages = []
-        sender_mapping = {}  # 发送者映射表
+        sender_mapping = {}  # 发送者映射表，始终在主进程中按顺序分配，保证各分片一致
         
-        for msg in messages:
+        # 消息内容整批脱敏
+        contents = [msg.get('message', '') for msg in messages]
+        if parallel_threshold and len(contents) >= parallel_threshold:
+            anonymized_contents = self.anonymize_contents_parallel(contents, max_workers)
+        else:
+            anonymized_contents = self.anonymizer.anonymize_batch(contents)
+        
+        for msg, anonymized_content in zip(messages, anonymized_contents):
             anonymized_msg = msg.copy()
             
             # 脱敏发送者信息
@@ -59,8 +114,6 @@ class PrivacyManager:
             anonymized_msg['sender'] = sender_mapping[sender]
             
             # 脱敏消息内容
-            content = msg.get('message', '')
-            anonymized_content = self._anonymize_content(content)
             anonymized_msg['message'] = anonymized_content
             
             # 移除或脱敏其他敏感字段
@@ -73,14 +126,34 @@ class PrivacyManager:
         
         return anonymized_messages
     
-    def _anonymize_content(self, content: str) -> str:
-        """脱敏消息内容"""
-        anonymized = content
+    def anonymize_contents_parallel(self, contents: List[str], max_workers: Optional[int] = None) -> List[str]:
+        """将消息内容分片到共享进程池并行脱敏，结果顺序与输入一致"""
+        max_workers = max_workers or process_pool.max_workers()
+        if max_workers <= 1 or len(contents) < 2:
+            return self.anonymizer.anonymize_batch(contents)
         
-        for pattern_name, pattern in self.sensitive_patterns.items():
-            anonymized = re.sub(pattern, f'[{pattern_name.upper()}]', anonymized)
+        # 每个进程分到若干个分片，平衡负载
+        shard_size = max(1000, -(-len(contents) // (max_workers * 4)))
+        shards = [contents[i:i + shard_size] for i in range(0, len(contents), shard_size)]
+        if len(shards) < 2:
+            return self.anonymizer.anonymize_batch(contents)
         
-        return anonymized
+        pool = None
+        try:
+            pool = process_pool.get_pool()
+            results = []
+            for shard_result in pool.map(_anonymize_shard, [self.sensitive_patterns] * len(shards), shards):
+                results.extend(shard_result)
+            return results
+        except (BrokenProcessPool, OSError) as e:
+            print(f"[WARNING] 并行脱敏失败，改为单进程处理: {e}")
+            if pool is not None and isinstance(e, BrokenProcessPool):
+                process_pool.discard(pool)
+            return self.anonymizer.anonymize_batch(contents)
+    
+    def _anonymize_content(self, content: str) -> str:
+        """脱敏消息内容"""
+        return self.anonymizer.anonymize(content)
     
     def generate_data_hash(self, messages: List[Dict]) -> str:
         """生成数据哈希用于完整性验证"""
@@ -0,0 +1,59 @@
+"""
+进程池模块
+脱敏和文件解析等CPU密集的任务共用一个常驻进程池，不在每次请求中新建进程池：
+fork方式下在服务启动、尚未创建其他线程时预先启动全部工作进程，避免在多线程进程中fork；
+spawn方式下（Windows）首次使用时才创建，工作进程只在启动时导入一次服务模块
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+_pool: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def max_workers() -> int:
+    """工作进程数，可通过 PROCESS_POOL_WORKERS 设置"""
+    return int(os.getenv('PROCESS_POOL_WORKERS', 0)) or os.cpu_count() or 1
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """获取共享进程池，不存在时创建"""
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=max_workers())
+        return _pool
+
+
+def _noop(_):
+    return None
+
+
+def start():
+    """服务启动时调用：fork方式下立即启动全部工作进程，之后处理请求时不再fork"""
+    if multiprocessing.get_start_method() != 'fork' or max_workers() <= 1:
+        return
+    pool = get_pool()
+    list(pool.map(_noop, range(max_workers())))
+
+
+def discard(pool: ProcessPoolExecutor):
+    """工作进程异常退出导致进程池不可用时丢弃，下次使用时重新创建"""
+    global _pool
+    with _lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown():
+    """退出前关闭进程池"""
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
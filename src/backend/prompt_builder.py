@@ -0,0 +1,142 @@
+"""
+提示词构建模块
+在调用模型前按token预算挑选消息：去掉"好的""嗯"、纯表情等寒暄内容，
+超出预算时优先保留包含数字、价格、日期、订单关键词和查询关键词的消息；
+查询词与检索索引一样按字符二元组匹配，没有空格分隔的中文问题也能命中相关消息
+"""
+
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from ai_engine import estimate_tokens
+from message_store import MessageStore
+from search_index import bigrams
+from summarizer import LINE_OVERHEAD_TOKENS
+
+# 默认只把约4个分段窗口的内容交给模型，设置为0时不限制
+DEFAULT_BUDGET_TOKENS = 24000
+
+# 单独出现时不包含信息量的回复
+CHATTER_PHRASES = {
+    '好', '好的', '好滴', '好哒', '好嘞', '嗯', '嗯嗯', '恩', '哦', '哦哦', '噢', '喔', '啊', '哈', '哈哈',
+    '哈哈哈', '呵呵', '嘿嘿', '收到', '收到了', '好的收到', '谢谢', '谢谢你', '多谢', '感谢', '行', '可以',
+    '没问题', '知道了', '明白', '了解', 'ok', 'okay', '嗯好', '好吧', '在', '在的', '在吗'
+}
+_CHATTER_STRIP = ' \t\r\n!！。.~～?？,，、…'
+# 纯表情、标点或 [微笑] 之类的表情占位符
+_EMOJI_ONLY = re.compile(r'^(?:[\W_]|\[[^\[\]]{1,8}\])*$')
+
+_NUMBER = re.compile(r'\d')
+_PRICE = re.compile(r'[¥￥$]|\d\s*(?:元|块|万|千|百|rmb|RMB)|价格|报价|单价|总价|优惠|折')
+_DATE = re.compile(r'\d{1,4}[-/年月]\d{1,2}|\d{1,2}[日号点]|今天|明天|后天|昨天|下周|周[一二三四五六日天]|星期')
+_ORDER = re.compile(r'发货|订单|下单|数量|快递|物流|单号|退款|退货|换货|付款|支付|定金|尾款|地址|型号|规格|库存|合同|发票')
+
+
+class PromptBuilder:
+    """按token预算和消息重要性挑选发送给模型的消息"""
+
+    def __init__(self, budget_tokens: Optional[int] = None):
+        if budget_tokens is None:
+            budget_tokens = int(os.getenv('SUMMARY_PROMPT_BUDGET_TOKENS', DEFAULT_BUDGET_TOKENS))
+        self.budget_tokens = budget_tokens
+
+    def select(self, store: MessageStore, rows: Optional[List[int]] = None,
+               query: Optional[str] = None) -> Tuple[List[int], Dict]:
+        """挑选消息，返回 (保留的行号, 统计信息)
+
+        统计信息记录原始和保留的消息数、估算token数，以及因寒暄和超出预算被去掉的消息数。
+        """
+        if rows is None:
+            rows = range(len(store))
+        terms = self.query_terms(query)
+
+        kept, scores, tokens = [], {}, {}
+        chatter = 0
+        total_tokens = 0
+        for row in rows:
+            content = store.content_at(row)
+            row_tokens = estimate_tokens(content) + LINE_OVERHEAD_TOKENS
+            total_tokens += row_tokens
+            # 先按关键词判断是否为寒暄，长度加分不参与判断，较长的纯表情刷屏同样去掉
+            score = self.keyword_score(content, terms)
+            if score == 0 and self.is_chatter(content):
+                chatter += 1
+                continue
+            score += self.length_bonus(content, score)
+            kept.append(row)
+            scores[row] = score
+            tokens[row] = row_tokens
+
+        kept_tokens = sum(tokens.values())
+        over_budget = 0
+        if self.budget_tokens and kept_tokens > self.budget_tokens:
+            # 按重要性从高到低装入预算，同分时保留较新的消息，最后恢复原有顺序
+            selected, kept_tokens = [], 0
+            for row in sorted(kept, key=lambda r: (-scores[r], -r)):
+                if kept_tokens + tokens[row] > self.budget_tokens:
+                    continue
+                selected.append(row)
+                kept_tokens += tokens[row]
+            over_budget = len(kept) - len(selected)
+            kept = sorted(selected)
+
+        stats = {
+            'total_messages': len(rows),
+            'kept_messages': len(kept),
+            'dropped_chatter': chatter,
+            'dropped_over_budget': over_budget,
+            'total_tokens': total_tokens,
+            'kept_tokens': kept_tokens,
+            'budget_tokens': self.budget_tokens
+        }
+        return kept, stats
+
+    @staticmethod
+    def is_chatter(content: str) -> bool:
+        """是否为不含信息量的寒暄、纯表情或标点"""
+        text = content.strip(_CHATTER_STRIP).lower()
+        return text in CHATTER_PHRASES or bool(_EMOJI_ONLY.match(text))
+
+    @staticmethod
+    def query_terms(query: Optional[str]) -> List[Tuple[str, set]]:
+        """将查询按空白拆分为关键词，返回 (关键词, 字符二元组) 列表"""
+        return [(term, bigrams(term)) for term in (query or '').lower().split() if term]
+
+    @staticmethod
+    def salience(content: str, terms: List[Tuple[str, set]]) -> float:
+        """消息重要性得分：查询关键词 > 订单关键词、价格 > 日期 > 数字，较长的消息略微加分"""
+        score = PromptBuilder.keyword_score(content, terms)
+        return score + PromptBuilder.length_bonus(content, score)
+
+    @staticmethod
+    def keyword_score(content: str, terms: List[Tuple[str, set]]) -> float:
+        """关键词得分，不含长度加分
+
+        每个查询关键词按其字符二元组在消息中出现的比例计分，完整出现时得10分
+        """
+        score = 0.0
+        if terms:
+            lowered = content.lower()
+            content_grams = bigrams(lowered)
+            for term, grams in terms:
+                if grams:
+                    score += 10 * len(grams & content_grams) / len(grams)
+                elif term in lowered:
+                    score += 10
+        if _ORDER.search(content):
+            score += 3
+        if _PRICE.search(content):
+            score += 3
+        if _DATE.search(content):
+            score += 2
+        if _NUMBER.search(content):
+            score += 1
+        return score
+
+    @staticmethod
+    def length_bonus(content: str, keyword_score: float) -> float:
+        """较长的消息最多加1分，没有关键词的短消息不加分"""
+        if keyword_score or len(content) > 10:
+            return min(len(content) / 100, 1.0)
+        return 0.0
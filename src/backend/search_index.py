@@ -0,0 +1,140 @@
+"""
+聊天内容检索模块
+为已加载的聊天记录建立字符二元组倒排索引，支持中文关键词、订单号等的即时检索
+"""
+
+import bisect
+import math
+import re
+import threading
+import weakref
+from array import array
+from typing import Dict, Iterable, List, Optional
+
+from message_store import MessageStore
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def bigrams(text: str) -> set:
+    """将文本切分为字符二元组，忽略空白字符"""
+    text = _WHITESPACE.sub('', text.lower())
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class SearchIndex:
+    """消息内容的倒排索引
+
+    中文没有天然的分词边界，这里对所有文本统一使用字符二元组作为索引项：
+    查询词的所有二元组对应的倒排表求交集得到候选消息，再做子串校验排除误匹配。
+    单个字符的查询词无法用二元组表示，退化为顺序扫描。
+    """
+
+    def __init__(self, store: MessageStore):
+        self.store = store
+        self.size = len(store)
+        self.postings: Dict[str, array] = {}
+        for row in range(self.size):
+            for gram in bigrams(store.content_at(row)):
+                posting = self.postings.get(gram)
+                if posting is None:
+                    posting = self.postings[gram] = array('i')
+                posting.append(row)
+
+    @property
+    def nbytes(self) -> int:
+        """估算占用的内存字节数，每个索引项另计字典和字符串对象的开销"""
+        return sum(posting.itemsize * len(posting) + 140 for posting in self.postings.values())
+
+    def _match_term(self, term: str) -> List[int]:
+        """返回内容包含term的行号（升序）"""
+        store = self.store
+        grams = bigrams(term)
+        if not grams:
+            return [row for row in range(self.size) if term in store.content_at(row).lower()]
+
+        postings = []
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if posting is None:
+                return []
+            postings.append(posting)
+        postings.sort(key=len)
+
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                return []
+        needle = _WHITESPACE.sub('', term)
+        return sorted(row for row in candidates
+                      if needle in _WHITESPACE.sub('', store.content_at(row).lower()))
+
+    def search(self, query: str, limit: int = 20, context: int = 2,
+               rows: Optional[Iterable[int]] = None) -> List[Dict]:
+        """检索消息，按相关度排序返回命中消息及其上下文
+
+        query按空白拆分为多个关键词，命中的关键词越多、越罕见得分越高，
+        同分时较新的消息排在前面。rows可限定检索范围（如时间、发送者筛选的结果），
+        此时上下文也只取筛选范围内的相邻消息。
+        """
+        allowed = sorted(set(rows)) if rows is not None else None
+        scores = self._score(query, allowed)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        hits = []
+        for row, score in ranked[:limit] if limit else ranked:
+            hits.append({
+                'id': row,
+                'score': round(score, 4),
+                'message': self.store.record(row),
+                'context': [self.store.record(r) for r in self._context_rows(row, context, allowed) if r != row]
+            })
+        return hits
+
+    def relevant_rows(self, query: str, context: int = 2, rows: Optional[Iterable[int]] = None) -> List[int]:
+        """返回所有命中消息及其上下文的行号（升序），用于只把相关内容发送给模型
+
+        指定rows时上下文取筛选范围内的相邻消息，不会带入其他发送者或时间范围外的消息
+        """
+        allowed = sorted(set(rows)) if rows is not None else None
+        selected = set()
+        for row in self._score(query, allowed):
+            selected.update(self._context_rows(row, context, allowed))
+        return sorted(selected)
+
+    def _score(self, query: str, rows: Optional[Iterable[int]] = None) -> Dict[int, float]:
+        terms = [term for term in _WHITESPACE.split((query or '').lower()) if term]
+        allowed = set(rows) if rows is not None else None
+        scores: Dict[int, float] = {}
+        for term in terms:
+            matched = self._match_term(term)
+            if allowed is not None:
+                matched = [row for row in matched if row in allowed]
+            if not matched:
+                continue
+            # 越罕见的关键词权重越高
+            weight = math.log(1 + self.size / len(matched)) * len(term)
+            for row in matched:
+                scores[row] = scores.get(row, 0.0) + weight
+        return scores
+
+    def _context_rows(self, row: int, context: int, allowed: Optional[List[int]] = None) -> Iterable[int]:
+        """row前后各context条消息；allowed为升序的筛选结果时，在其中取相邻的行"""
+        if allowed is None:
+            return range(max(0, row - context), min(self.size, row + context + 1))
+        position = bisect.bisect_left(allowed, row)
+        return allowed[max(0, position - context):position + context + 1]
+
+
+_indexes = weakref.WeakKeyDictionary()
+_indexes_lock = threading.Lock()
+
+
+def get_search_index(store: MessageStore) -> SearchIndex:
+    """获取聊天记录的检索索引，同一份数据只建立一次，追加消息后自动重建"""
+    with _indexes_lock:
+        index = _indexes.get(store)
+        if index is None or index.size != len(store):
+            index = SearchIndex(store)
+            _indexes[store] = index
+        return index
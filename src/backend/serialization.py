@@ -0,0 +1,59 @@
+"""
+响应序列化模块
+安装orjson时使用它替换Flask默认的JSON序列化；安装msgpack且客户端声明接受时，
+消息列表可以以MessagePack二进制格式返回
+"""
+
+from flask import Response
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # 未安装时退回标准库json
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # 未安装时只提供JSON响应
+    msgpack = None
+
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """基于orjson的JSON序列化，输出的键顺序和对日期等类型的处理与Flask默认实现一致"""
+
+    def _orjson_dumps(self, obj) -> bytes:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def dumps(self, obj, **kwargs) -> str:
+        # 指定了json.dumps的其他参数时交给默认实现
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return self._orjson_dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs) -> Response:
+        # 调试模式下保留默认的缩进输出
+        if orjson is None or (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._orjson_dumps(obj), mimetype=self.mimetype)
+
+
+def accepts_msgpack(request) -> bool:
+    """客户端是否明确优先接受MessagePack格式"""
+    if msgpack is None:
+        return False
+    return request.accept_mimetypes.best_match(['application/json', MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE
+
+
+def msgpack_response(payload, status: int = 200) -> Response:
+    return Response(msgpack.packb(payload, use_bin_type=True), status=status, mimetype=MSGPACK_MIMETYPE)
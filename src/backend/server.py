@@ -1,6 +1,13 @@
-from flask import Flask, request, jsonify
+import time
+# 记录开始导入的时刻，用于统计后端冷启动耗时
+_import_started = time.perf_counter()
+
+from flask import Flask, request, jsonify, make_response, Response, stream_with_context
 import os
-import pandas as pd
+import sys
+import signal
+import functools
+import threading
 from datetime import datetime
 import json
 from flask_cors import CORS
@@ -11,20 +18,167 @@ env_path = os.path.join(os.path.dirname(__file__), '..', '..', '.env')
 load_dotenv(env_path)
 
 from parser import ChatParser
-from ai_engine import QwenAI
+from message_store import MessageStore
+from chat_session import ChatSessionCache
+from message_archive import MessageArchive
+from search_index import get_search_index
+from summarizer import HierarchicalSummarizer
+from prompt_builder import PromptBuilder
+from ai_engine import QwenAI, SummaryCache, API_ERROR_PREFIX
 from chat_extractor_manager import ChatExtractorManager
 from privacy_manager import PrivacyManager
+from job_queue import JobManager
+import process_pool
+from directory_scanner import DirectoryScanner
+from serialization import FastJSONProvider, accepts_msgpack, msgpack_response
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)  # 安装orjson时使用更快的JSON序列化
 CORS(app)  # 启用CORS支持
 
 # 从环境变量获取API密钥
 api_key = os.getenv('QWEN_API_KEY')
-ai_engine = QwenAI(api_key=api_key)
+# 摘要结果的磁盘缓存，相同聊天片段和问题不重复调用模型
+cache_root = os.path.expanduser(os.getenv('CHAT_CACHE_PATH') or '~/.memochat/cache')
+summary_cache = SummaryCache(
+    os.path.join(cache_root, 'summaries'),
+    max_bytes=int(os.getenv('SUMMARY_CACHE_MAX_MB', 100)) * 1024 * 1024,
+    max_age_seconds=int(os.getenv('SUMMARY_CACHE_MAX_AGE_DAYS', 30)) * 24 * 3600
+)
+ai_engine = QwenAI(api_key=api_key, cache=summary_cache)
+summarizer = HierarchicalSummarizer(ai_engine)
+prompt_builder = PromptBuilder()
 
-# 初始化提取管理器和隐私管理器
-extractor_manager = ChatExtractorManager()
+# 初始化提取管理器和隐私管理器，提取结果保存在本地归档数据库中
+message_archive = MessageArchive(os.path.expanduser(os.getenv('DATABASE_PATH') or '~/.memochat/memochat.db'))
+extractor_manager = ChatExtractorManager(archive=message_archive)
 privacy_manager = PrivacyManager()
+anonymize_parallel_threshold = int(os.getenv('ANONYMIZE_PARALLEL_THRESHOLD', 50000))
+
+# 耗时的扫描、提取和摘要作为后台任务执行，任务状态与归档保存在同一个数据库中
+job_manager = JobManager(message_archive.db_path)
+
+# 已加载聊天记录的服务端缓存
+chat_sessions = ChatSessionCache(max_bytes=int(os.getenv('CHAT_SESSION_MAX_MB', 512)) * 1024 * 1024)
+
+# /api/scan-directory 支持的文件类型，按目录修改时间缓存扫描结果，重复扫描同一导出目录时几乎不需要IO
+SUPPORTED_EXPORT_EXTENSIONS = ('.txt', '.csv', '.json', '.log')
+DEFAULT_SCAN_IGNORE = ('.git', 'node_modules', '__pycache__')
+export_scanner = DirectoryScanner(
+    match=lambda name: os.path.splitext(name)[1].lower() in SUPPORTED_EXPORT_EXTENSIONS,
+    cache_path=os.path.join(cache_root, 'scan_directory.json')
+)
+
+# 生产模式下的工作线程数；耗时接口最多同时占用其中的一部分，保证健康检查等轻量接口始终有空闲线程
+server_threads = int(os.getenv('SERVER_THREADS', 8))
+heavy_requests = threading.BoundedSemaphore(int(os.getenv('MAX_HEAVY_REQUESTS', max(1, server_threads - 2))))
+
+def _limit_concurrency(view):
+    """限制解析、提取和模型调用等耗时接口的并发数，已满时直接返回503，由客户端稍后重试"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not heavy_requests.acquire(blocking=False):
+            response = jsonify({'error': '服务繁忙，请稍后重试'})
+            response.status_code = 503
+            response.headers['Retry-After'] = '1'
+            return response
+        try:
+            response = make_response(view(*args, **kwargs))
+        except BaseException:
+            heavy_requests.release()
+            raise
+        if response.is_streamed:
+            # 流式响应在输出结束后才释放
+            response.call_on_close(heavy_requests.release)
+        else:
+            heavy_requests.release()
+        return response
+    return wrapper
+
+def _resolve_chat(data):
+    """根据chat_id取出已缓存的聊天记录，兼容直接上传chat_data的旧调用方式"""
+    chat_id = data.get('chat_id')
+    if chat_id:
+        session = chat_sessions.get(chat_id)
+        if session is None:
+            return None, (jsonify({'error': '聊天会话不存在或已过期，请重新加载聊天记录'}), 404)
+        return session.store, None
+    chat_data = data.get('chat_data')
+    if not chat_data:
+        return None, (jsonify({'error': '未提供聊天数据'}), 400)
+    return MessageStore.from_messages(chat_data), None
+
+def _search_index(store, data):
+    """获取检索索引，已缓存的会话会把索引占用的内存计入会话缓存的上限"""
+    chat_id = data.get('chat_id')
+    session = chat_sessions.get(chat_id) if chat_id else None
+    if session is not None and session.store is store:
+        return chat_sessions.search_index(session)
+    return get_search_index(store)
+
+def _select_rows(store, data):
+    """按请求中的时间范围和发送者筛选行号"""
+    start_time = data.get('start_time')
+    end_time = data.get('end_time')
+    if start_time and end_time:
+        start_time = datetime.fromisoformat(start_time)
+        end_time = datetime.fromisoformat(end_time)
+    return store.filter(start_time, end_time, data.get('sender'))
+
+def _respond(payload):
+    """返回消息列表等大体积数据，客户端优先接受MessagePack时以二进制格式返回"""
+    if accepts_msgpack(request):
+        return msgpack_response(payload)
+    return jsonify(payload)
+
+class InvalidParameter(ValueError):
+    """请求参数无效，返回400"""
+
+@app.errorhandler(InvalidParameter)
+def _invalid_parameter(e):
+    return jsonify({'error': str(e)}), 400
+
+def _int_param(value, name, default=None):
+    """将客户端传入的参数转换为整数，无法转换时抛出InvalidParameter"""
+    if value is None or value == '':
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise InvalidParameter(f'{name}必须为整数')
+
+# 分页读取聊天记录时单页的最大条数
+MAX_PAGE_SIZE = 5000
+
+def _page(store, after=None, limit=None):
+    """按游标分页取出消息，after为上一页最后一条消息的行号，返回的next_cursor为None表示已到末尾"""
+    after = _int_param(after, 'after')
+    limit = _int_param(limit, 'limit')
+    start = 0 if after is None else max(0, after + 1)
+    end = len(store) if limit is None else min(len(store), start + max(1, min(limit, MAX_PAGE_SIZE)))
+    start = min(start, end)
+    return {
+        'chat_data': store.to_records(range(start, end)),
+        'total': len(store),
+        'next_cursor': end - 1 if end < len(store) else None
+    }
+
+def _summary_store(store, data):
+    """取出需要发送给模型的消息，返回 (消息存储, 挑选统计)
+
+    先按条件筛选，指定search_query时只保留命中消息及其上下文，
+    再去掉寒暄内容并按token预算保留最重要的消息。
+    """
+    rows = _select_rows(store, data)
+    search_query = data.get('search_query')
+    if search_query:
+        rows = _search_index(store, data).relevant_rows(
+            search_query, context=_int_param(data.get('context'), 'context', 2), rows=rows)
+    query_terms = ' '.join(filter(None, [data.get('query'), search_query]))
+    rows, prompt_stats = prompt_builder.select(store, rows, query_terms)
+    if len(rows) < len(store):
+        store = store.take(rows)
+    return store, prompt_stats
 
 @app.route('/')
 def index():
@@ -33,9 +187,14 @@ def index():
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """健康检查端点"""
-    return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
+    return jsonify({
+        'status': 'healthy',
+        'timestamp': datetime.now().isoformat(),
+        'startup_ms': round(startup_seconds * 1000, 1)
+    })
 
 @app.route('/api/load-chat', methods=['POST'])
+@_limit_concurrency
 def load_chat():
     try:
         data = request.json
@@ -51,34 +210,36 @@ def load_chat():
         parser = ChatParser(file_path=file_path)
         
         # 添加调试信息
-        print(f"[DEBUG] 文件内容长度: {len(parser.raw_text)}")
-        print(f"[DEBUG] 文件前100字符: {repr(parser.raw_text[:100])}")
+        print(f"[DEBUG] 文件前100字符: {repr(parser.read_head(100))}")
         
-        chat_df = parser.auto_detect_and_parse()
+        store = parser.parse_to_store()
         
-        print(f"[DEBUG] 解析结果: {len(chat_df)} 条消息")
-        print(f"[DEBUG] 联系人数量: {len(parser.contacts)}")
+        print(f"[DEBUG] 解析结果: {len(store)} 条消息")
+        print(f"[DEBUG] 联系人数量: {len(store.senders)}")
         
         # 检查是否成功解析到消息
-        if chat_df.empty:
+        if len(store) == 0:
             print(f"[ERROR] 解析结果为空")
             return jsonify({'error': '无法解析聊天文件，请检查文件格式是否正确'}), 400
         
         # 获取联系人列表
-        contacts = parser.get_contacts()
+        contacts = store.get_contacts()
         
-        # 转换为JSON格式返回
-        chat_data = chat_df.to_dict('records')
-        for item in chat_data:
-            item['timestamp'] = item['timestamp'].isoformat()
+        session = chat_sessions.add(store, file_path=file_path)
         
-        print(f"[DEBUG] 成功返回 {len(chat_data)} 条消息")
+        # 转换为JSON格式返回，指定limit时只返回第一页，其余通过 /api/chat/<chat_id>/messages 分页获取
+        page = _page(store, limit=data.get('limit'))
         
-        return jsonify({
-            'chat_data': chat_data,
-            'contacts': contacts
+        print(f"[DEBUG] 成功返回 {len(page['chat_data'])} 条消息")
+        
+        return _respond({
+            'chat_id': session.chat_id,
+            'contacts': contacts,
+            **page
         })
         
+    except InvalidParameter as e:
+        return jsonify({'error': str(e)}), 400
     except UnicodeDecodeError as e:
         print(f"[ERROR] 编码错误: {e}")
         return jsonify({'error': '文件编码错误，请确保文件是UTF-8编码'}), 400
@@ -91,52 +252,110 @@ def load_chat():
 @app.route('/api/filter-chat', methods=['POST'])
 def filter_chat():
     data = request.json
-    chat_data = data.get('chat_data', [])
-    start_time = data.get('start_time')
-    end_time = data.get('end_time')
-    sender = data.get('sender')
-    
-    # 转换回DataFrame
-    df = pd.DataFrame(chat_data)
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    
-    # 创建解析器实例
-    parser = ChatParser()
+    store, error = _resolve_chat(data)
+    if error:
+        return error
     
     # 应用过滤
-    if start_time and end_time:
-        start_time = datetime.fromisoformat(start_time)
-        end_time = datetime.fromisoformat(end_time)
-        df = parser.filter_by_time(df, start_time, end_time)
-    
-    if sender:
-        df = parser.filter_by_sender(df, sender)
+    rows = _select_rows(store, data)
     
     # 转换为JSON格式返回
-    filtered_data = df.to_dict('records')
-    for item in filtered_data:
-        item['timestamp'] = item['timestamp'].isoformat()
+    filtered_data = store.to_records(rows)
     
-    return jsonify({'filtered_data': filtered_data})
+    return _respond({'filtered_data': filtered_data})
 
 @app.route('/api/generate-summary', methods=['POST'])
+@_limit_concurrency
 def generate_summary():
     data = request.json
-    chat_data = data.get('chat_data', [])
     query = data.get('query')
+    store, error = _resolve_chat(data)
+    if error:
+        return error
+    
+    store, prompt_stats = _summary_store(store, data)
+    
+    # 生成摘要，超出上下文窗口时自动分段并发总结后合并
+    summary = summarizer.summarize(store, query)
+    
+    return jsonify({'summary': summary, 'prompt_stats': prompt_stats})
+
+@app.route('/api/search-chat', methods=['POST'])
+def search_chat():
+    """在已加载的聊天记录中检索关键词，返回按相关度排序的命中消息及上下文"""
+    data = request.json
+    query = data.get('query')
+    if not query:
+        return jsonify({'error': '未提供检索关键词'}), 400
+    
+    store, error = _resolve_chat(data)
+    if error:
+        return error
+    
+    hits = _search_index(store, data).search(
+        query,
+        limit=_int_param(data.get('limit'), 'limit', 20),
+        context=_int_param(data.get('context'), 'context', 2),
+        rows=_select_rows(store, data)
+    )
+    return jsonify({'hits': hits, 'count': len(hits)})
+
+def _sse_event(data, event=None):
+    """编码一条Server-Sent Events消息"""
+    payload = json.dumps(data, ensure_ascii=False)
+    if event:
+        return f"event: {event}\ndata: {payload}\n\n"
+    return f"data: {payload}\n\n"
+
+@app.route('/api/generate-summary-stream', methods=['POST'])
+@_limit_concurrency
+def generate_summary_stream():
+    """以SSE流式返回摘要，参数与 /api/generate-summary 相同"""
+    data = request.json
+    query = data.get('query')
+    store, error = _resolve_chat(data)
+    if error:
+        return error
     
-    # 转换回DataFrame
-    df = pd.DataFrame(chat_data)
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    store, prompt_stats = _summary_store(store, data)
     
-    # 创建解析器实例并格式化聊天记录
-    parser = ChatParser()
-    formatted_chat = parser.format_for_ai(df)
+    def generate():
+        parts = []
+        try:
+            for delta in summarizer.stream(store, query):
+                if delta.startswith(API_ERROR_PREFIX):
+                    yield _sse_event({'error': delta}, event='error')
+                    return
+                parts.append(delta)
+                yield _sse_event({'delta': delta})
+            yield _sse_event({'summary': ''.join(parts), 'prompt_stats': prompt_stats}, event='done')
+        except Exception as e:
+            yield _sse_event({'error': str(e)}, event='error')
     
-    # 生成摘要
-    summary = ai_engine.generate_summary(formatted_chat, query)
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/chat/<chat_id>/messages', methods=['GET'])
+def chat_messages(chat_id):
+    """分页读取已加载的聊天记录，参数: after（上一页返回的next_cursor）、limit"""
+    session = chat_sessions.get(chat_id)
+    if session is None:
+        return jsonify({'error': '聊天会话不存在或已过期，请重新加载聊天记录'}), 404
     
-    return jsonify({'summary': summary})
+    page = _page(session.store, request.args.get('after'), request.args.get('limit', 500))
+    return _respond({'chat_id': chat_id, **page})
+
+@app.route('/api/chat/<chat_id>', methods=['DELETE'])
+def close_chat(chat_id):
+    """释放服务端缓存的聊天记录"""
+    if not chat_sessions.remove(chat_id):
+        return jsonify({'error': '聊天会话不存在'}), 404
+    return jsonify({'success': True})
+
+@app.route('/api/summary-cache', methods=['GET'])
+def summary_cache_stats():
+    """摘要缓存命中统计"""
+    return jsonify(summary_cache.stats())
 
 @app.route('/api/export-summary', methods=['POST'])
 def export_summary():
@@ -161,6 +380,7 @@ def export_summary():
     return jsonify({'success': True, 'file_path': file_path})
 
 @app.route('/api/scan-chat-accounts', methods=['POST'])
+@_limit_concurrency
 def scan_chat_accounts():
     """扫描聊天账户"""
     try:
@@ -178,6 +398,7 @@ def scan_chat_accounts():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/extract-from-files', methods=['POST'])
+@_limit_concurrency
 def extract_from_files():
     """从文件提取聊天记录"""
     try:
@@ -189,21 +410,20 @@ def extract_from_files():
         if not privacy_manager.has_valid_consent(privacy_level):
             return jsonify({'error': '需要用户授权才能提取聊天记录'}), 403
         
-        # 提取消息
-        messages = extractor_manager.extract_from_files(file_configs)
+        # 提取消息，按文件逐个归并排序
+        messages = list(extractor_manager.iter_extract_merged(file_configs))
         
         # 根据隐私级别处理数据
         if privacy_level == 'basic':
             # 基础级别：不脱敏，仅本地处理
-            processed_messages = messages
+            unified_messages = messages
         else:
             # 进阶级别：脱敏处理
-            processed_messages = privacy_manager.anonymize_messages(messages)
-        
-        # 合并排序
-        unified_messages = extractor_manager.merge_and_sort_messages(processed_messages)
+            unified_messages = privacy_manager.anonymize_messages(
+                messages, parallel_threshold=anonymize_parallel_threshold
+            )
         
-        return jsonify({
+        return _respond({
             'messages': unified_messages,
             'message_count': len(unified_messages),
             'privacy_level': privacy_level
@@ -213,6 +433,7 @@ def extract_from_files():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/extract-chat-unified', methods=['POST'])
+@_limit_concurrency
 def extract_chat_unified():
     """统一聊天记录提取接口"""
     try:
@@ -229,16 +450,16 @@ def extract_chat_unified():
         if extraction_config.get('scan_accounts', False):
             scan_result = extractor_manager.scan_all_chat_accounts()
         
-        # 2. 从文件提取
-        messages = []
+        # 2. 从文件提取，按文件逐个归并排序
+        unified_messages = []
         if 'file_configs' in extraction_config:
-            messages = extractor_manager.extract_from_files(extraction_config['file_configs'])
+            unified_messages = list(extractor_manager.iter_extract_merged(extraction_config['file_configs']))
         
         # 3. 数据处理
         if privacy_level == 'advanced':
-            messages = privacy_manager.anonymize_messages(messages)
-        
-        unified_messages = extractor_manager.merge_and_sort_messages(messages)
+            unified_messages = privacy_manager.anonymize_messages(
+                unified_messages, parallel_threshold=anonymize_parallel_threshold
+            )
         
         # 4. 生成报告
         report = extractor_manager.generate_extraction_report(scan_result, unified_messages)
@@ -253,9 +474,43 @@ def extract_chat_unified():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/archive-search', methods=['POST'])
+def archive_search():
+    """在本地归档的所有聊天记录中全文检索"""
+    try:
+        data = request.json
+        query = data.get('query')
+        if not query:
+            return jsonify({'error': '未提供检索关键词'}), 400
+        
+        results = message_archive.search(query, limit=_int_param(data.get('limit'), 'limit', 50))
+        return jsonify({'results': results, 'count': len(results)})
+        
+    except InvalidParameter as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _export_file_info(path, stat):
+    return {
+        'name': os.path.basename(path),
+        'path': path,
+        'size': stat.st_size,
+        'modified': datetime.fromtimestamp(stat.st_mtime).isoformat(),
+        'extension': os.path.splitext(path)[1].lower()
+    }
+
+def _wants_ndjson(data):
+    return bool(data.get('stream')) or request.accept_mimetypes.best_match(
+        ['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+
 @app.route('/api/scan-directory', methods=['POST'])
 def scan_directory():
-    """扫描指定目录下的聊天文件"""
+    """扫描指定目录下的聊天文件
+
+    可选参数: max_depth（0表示只扫描该目录本身）、ignore（按文件或目录名匹配的通配符列表）、
+    stream（为true或Accept为application/x-ndjson时，以NDJSON逐行返回找到的文件，最后一行为汇总）
+    """
     try:
         data = request.json
         directory_path = data.get('directory_path')
@@ -269,38 +524,39 @@ def scan_directory():
         if not os.path.isdir(directory_path):
             return jsonify({'error': f'路径不是目录: {directory_path}'}), 400
         
-        # 扫描目录下的文件
-        files = []
-        supported_extensions = ['.txt', '.csv', '.json', '.log']
-        
-        try:
-            for root, dirs, filenames in os.walk(directory_path):
-                for filename in filenames:
-                    file_path = os.path.join(root, filename)
-                    file_ext = os.path.splitext(filename)[1].lower()
-                    
-                    # 只包含支持的文件类型
-                    if file_ext in supported_extensions:
-                        try:
-                            stat = os.stat(file_path)
-                            files.append({
-                                'name': filename,
-                                'path': file_path,
-                                'size': stat.st_size,
-                                'modified': datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                                'extension': file_ext
-                            })
-                        except (OSError, PermissionError) as e:
-                            print(f"[WARNING] 无法访问文件 {file_path}: {e}")
-                            continue
-        
-        except PermissionError:
+        if not os.access(directory_path, os.R_OK | os.X_OK):
             return jsonify({'error': f'无权限访问目录: {directory_path}'}), 403
-        except Exception as e:
-            return jsonify({'error': f'扫描目录时出错: {str(e)}'}), 500
         
-        # 按修改时间排序（最新的在前）
-        files.sort(key=lambda x: x['modified'], reverse=True)
+        max_depth = _int_param(data.get('max_depth'), 'max_depth')
+        ignore = data.get('ignore') or DEFAULT_SCAN_IGNORE
+        if isinstance(ignore, str):
+            ignore = [ignore]
+        
+        found = export_scanner.iter_files(directory_path, max_depth=max_depth, ignore=ignore, with_stat=True)
+        
+        if _wants_ndjson(data):
+            def generate():
+                count = 0
+                try:
+                    for path, stat in found:
+                        count += 1
+                        yield json.dumps(_export_file_info(path, stat), ensure_ascii=False) + '\n'
+                    yield json.dumps({'done': True, 'directory': directory_path, 'file_count': count,
+                                      'scan_time': datetime.now().isoformat()}, ensure_ascii=False) + '\n'
+                except Exception as e:
+                    yield json.dumps({'error': f'扫描目录时出错: {str(e)}'}, ensure_ascii=False) + '\n'
+                finally:
+                    export_scanner.save()
+            
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        
+        try:
+            # 按修改时间排序（最新的在前）
+            entries = sorted(found, key=lambda item: item[1].st_mtime, reverse=True)
+        finally:
+            export_scanner.save()
+        files = [_export_file_info(path, stat) for path, stat in entries]
         
         return jsonify({
             'ok': True,
@@ -313,12 +569,155 @@ def scan_directory():
             }
         })
         
+    except InvalidParameter as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"[ERROR] 扫描目录异常: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({'error': f'扫描目录时出错: {str(e)}'}), 500
 
+def _run_scan_job(job):
+    job.update(stage='scanning')
+    return extractor_manager.scan_all_chat_accounts()
+
+def _run_extract_job(job, extraction_config, privacy_level):
+    """后台执行 /api/extract-chat-unified 的流程，提取结果放入会话缓存，通过chat_id分页读取"""
+    scan_result = {}
+    if extraction_config.get('scan_accounts', False):
+        job.update(stage='scanning')
+        scan_result = extractor_manager.scan_all_chat_accounts()
+    
+    file_configs = extraction_config.get('file_configs', [])
+    job.update(stage='extracting', files_total=len(file_configs), files_parsed=0, messages_parsed=0)
+    
+    def on_file_parsed(config, message_count):
+        job.update(files_parsed=job.progress['files_parsed'] + 1,
+                   messages_parsed=job.progress['messages_parsed'] + message_count)
+    
+    if privacy_level == 'advanced':
+        # 发送者编号需要在全部消息中统一分配，脱敏时整体载入
+        messages = list(extractor_manager.iter_extract_merged(file_configs, progress=on_file_parsed))
+        job.update(stage='anonymizing')
+        messages = privacy_manager.anonymize_messages(messages, parallel_threshold=anonymize_parallel_threshold)
+        store = MessageStore.from_messages(messages, content_key='message')
+        del messages
+    else:
+        # 每个文件一个有序消息流，归并结果直接写入列式存储，不生成合并后的消息列表
+        store = extractor_manager.extract_to_store(file_configs, progress=on_file_parsed)
+    
+    # 报告也从存储中统计
+    report = extractor_manager.generate_extraction_report(scan_result, store.iter_records())
+    
+    session = chat_sessions.add(store, source='extract_job')
+    return {
+        'chat_id': session.chat_id,
+        'message_count': len(store),
+        'contacts': store.get_contacts(),
+        'scan_result': scan_result,
+        'report': report,
+        'privacy_level': privacy_level
+    }
+
+def _run_summary_job(job, store, query, prompt_stats):
+    job.update(stage='summarizing', chunks_done=0)
+    summary = summarizer.summarize(
+        store, query, progress=lambda done, total: job.update(chunks_done=done, chunks_total=total))
+    if summary.startswith(API_ERROR_PREFIX):
+        raise RuntimeError(summary)
+    return {'summary': summary, 'prompt_stats': prompt_stats}
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """提交后台任务，type为 scan / extract / summary，其余参数与对应的同步接口相同"""
+    data = request.json or {}
+    job_type = data.get('type')
+    privacy_level = data.get('privacy_level', 'basic')
+    
+    if job_type == 'scan':
+        if not privacy_manager.has_valid_consent(privacy_level):
+            return jsonify({'error': '需要用户授权才能扫描聊天账户'}), 403
+        job_id = job_manager.submit('scan', _run_scan_job)
+    elif job_type == 'extract':
+        if not privacy_manager.has_valid_consent(privacy_level):
+            return jsonify({'error': '需要用户授权'}), 403
+        extraction_config = data.get('config', {})
+        job_id = job_manager.submit(
+            'extract', lambda job: _run_extract_job(job, extraction_config, privacy_level))
+    elif job_type == 'summary':
+        store, error = _resolve_chat(data)
+        if error:
+            return error
+        store, prompt_stats = _summary_store(store, data)
+        query = data.get('query')
+        job_id = job_manager.submit(
+            'summary', lambda job: _run_summary_job(job, store, query, prompt_stats))
+    else:
+        return jsonify({'error': f'未知的任务类型: {job_type}'}), 400
+    
+    return jsonify({'job_id': job_id, 'status': 'queued'}), 202
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify({'jobs': job_manager.list(_int_param(request.args.get('limit'), 'limit', 50))})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """查询任务状态、进度和结果"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    if not job_manager.cancel(job_id):
+        return jsonify({'error': '任务不存在或已结束'}), 404
+    return jsonify({'success': True})
+
+# 导入模块和创建全局对象的耗时；pandas、requests、聊天提取器等在首次使用时才加载，不计入其中
+startup_seconds = time.perf_counter() - _import_started
+
+def _shutdown():
+    """退出前停止后台任务并关闭连接"""
+    job_manager.close()
+    process_pool.shutdown()
+    export_scanner.save()
+    ai_engine.close()
+    message_archive.close()
+
+def serve(host, port):
+    """生产模式：使用waitress多线程服务，收到终止信号时等待进行中的请求结束后退出"""
+    try:
+        from waitress import create_server
+    except ImportError:
+        print("[WARNING] 未安装waitress，使用Flask开发服务器运行", file=sys.stderr)
+        app.run(host=host, port=port, threaded=True)
+        return
+    
+    server = create_server(
+        app, host=host, port=port, threads=server_threads,
+        connection_limit=int(os.getenv('SERVER_CONNECTION_LIMIT', 100)),
+        backlog=int(os.getenv('SERVER_BACKLOG', 64))
+    )
+    
+    def handle_signal(signum, frame):
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, handle_signal)
+    
+    # Electron主进程根据 "Running on" 判断后端已启动
+    print(f" * Running on http://{host}:{port} (waitress, {server_threads} threads, "
+          f"启动耗时 {startup_seconds * 1000:.0f}ms)", file=sys.stderr, flush=True)
+    try:
+        server.run()
+    finally:
+        _shutdown()
+
 if __name__ == '__main__':
     port = int(os.getenv('FLASK_PORT', 6000))  # 从环境变量读取端口，默认6000
-    app.run(host='127.0.0.1', port=port)
+    # 在创建请求处理线程之前启动脱敏、解析共用的工作进程
+    process_pool.start()
+    if os.getenv('FLASK_ENV') == 'development':
+        app.run(host='127.0.0.1', port=port, threaded=True)
+    else:
+        serve('127.0.0.1', port)
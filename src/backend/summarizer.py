@@ -0,0 +1,164 @@
+"""
+分段汇总模块
+聊天记录超出模型上下文时，按对话边界切分为多个窗口并发总结，再合并各段摘要
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from ai_engine import API_ERROR_PREFIX, estimate_tokens
+from message_store import MessageStore
+from parser import ChatParser
+
+DEFAULT_WINDOW_TOKENS = 6000
+DEFAULT_MAX_WORKERS = 4
+# 相邻消息间隔超过30分钟视为新的一轮对话
+CONVERSATION_GAP_SECONDS = 30 * 60
+# 每行格式化文本中时间戳、发送者和标点的大致开销
+LINE_OVERHEAD_TOKENS = 12
+
+
+class HierarchicalSummarizer:
+    """分层摘要引擎：切分窗口 -> 并发总结各窗口 -> 合并部分摘要"""
+
+    def __init__(self, ai_engine, window_tokens: Optional[int] = None, max_workers: Optional[int] = None,
+                 gap_seconds: int = CONVERSATION_GAP_SECONDS):
+        self.ai_engine = ai_engine
+        self.window_tokens = window_tokens or int(os.getenv('SUMMARY_WINDOW_TOKENS', DEFAULT_WINDOW_TOKENS))
+        self.max_workers = max_workers or int(os.getenv('SUMMARY_MAX_WORKERS', DEFAULT_MAX_WORKERS))
+        self.gap_seconds = gap_seconds
+        self.parser = ChatParser()
+
+    def summarize(self, store: MessageStore, query: Optional[str] = None,
+                  progress: Optional[Callable[[int, int], None]] = None) -> str:
+        """生成摘要，未超出窗口预算时直接一次调用
+
+        progress(已完成段数, 总段数) 在每个分段总结完成后调用，用于后台任务上报进度
+        """
+        conversations = list(self._conversations(store))
+        total_tokens = sum(sum(row_tokens) for _, row_tokens in conversations)
+        if total_tokens <= self.window_tokens:
+            summary = self.ai_engine.generate_summary(self.parser.format_for_ai(store), query)
+            if progress:
+                progress(1, 1)
+            return summary
+
+        partials = self._summarize_windows(store, self._pack(conversations), query, progress)
+        return self._reduce(partials, query)
+
+    def _summarize_windows(self, store: MessageStore, windows: List[List[int]], query: Optional[str],
+                           progress: Optional[Callable[[int, int], None]] = None) -> List[str]:
+        """并发总结各个窗口"""
+        texts = [self.parser.format_for_ai(store, rows) for rows in windows]
+        done = [0]
+        lock = threading.Lock()
+
+        def summarize_window(item):
+            index, text = item
+            partial = self.ai_engine.summarize_window(text, index + 1, len(texts), query)
+            if progress:
+                with lock:
+                    done[0] += 1
+                    progress(done[0], len(texts))
+            return partial
+
+        return self._map(summarize_window, enumerate(texts))
+
+    def stream(self, store: MessageStore, query: Optional[str] = None) -> Iterator[str]:
+        """流式生成摘要：分段总结仍并发完成，最终输出阶段逐段返回文本"""
+        conversations = list(self._conversations(store))
+        total_tokens = sum(sum(row_tokens) for _, row_tokens in conversations)
+        if total_tokens <= self.window_tokens:
+            yield from self.ai_engine.stream_summary(self.parser.format_for_ai(store), query)
+            return
+
+        partials = self._summarize_windows(store, self._pack(conversations), query)
+        partials = self._reduce_to_budget(partials, query)
+        if isinstance(partials, str):
+            yield partials
+        elif len(partials) == 1:
+            yield partials[0]
+        else:
+            yield from self.ai_engine.stream_merge_summaries(partials, query)
+
+    def split_windows(self, store: MessageStore) -> List[List[int]]:
+        """按对话边界切分为不超过token预算的窗口，返回每个窗口的行号"""
+        return self._pack(self._conversations(store))
+
+    def _conversations(self, store: MessageStore) -> Iterator[Tuple[List[int], List[int]]]:
+        """按时间间隔划分对话，生成 (行号列表, 每行token数)"""
+        timestamps = store.timestamps
+        rows, row_tokens = [], []
+        for row in range(len(store)):
+            if rows and timestamps[row] - timestamps[rows[-1]] > self.gap_seconds:
+                yield rows, row_tokens
+                rows, row_tokens = [], []
+            rows.append(row)
+            row_tokens.append(estimate_tokens(store.content_at(row)) + LINE_OVERHEAD_TOKENS)
+        if rows:
+            yield rows, row_tokens
+
+    def _pack(self, conversations) -> List[List[int]]:
+        """将对话依次装入窗口，单个对话超出预算时在消息边界处拆分"""
+        windows, window, window_tokens = [], [], 0
+        for rows, row_tokens in conversations:
+            tokens = sum(row_tokens)
+            if window and window_tokens + tokens > self.window_tokens:
+                windows.append(window)
+                window, window_tokens = [], 0
+            if tokens <= self.window_tokens:
+                window.extend(rows)
+                window_tokens += tokens
+                continue
+            # 超长对话逐条拆分
+            for row, tokens in zip(rows, row_tokens):
+                if window and window_tokens + tokens > self.window_tokens:
+                    windows.append(window)
+                    window, window_tokens = [], 0
+                window.append(row)
+                window_tokens += tokens
+        if window:
+            windows.append(window)
+        return windows
+
+    def _map(self, func, items) -> List[str]:
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(func, items))
+
+    def _reduce(self, partials: List[str], query: Optional[str] = None) -> str:
+        """合并部分摘要"""
+        partials = self._reduce_to_budget(partials, query)
+        if isinstance(partials, str):
+            return partials
+        if len(partials) == 1:
+            return partials[0]
+        return self.ai_engine.merge_summaries(partials, query)
+
+    def _reduce_to_budget(self, partials: List[str], query: Optional[str] = None):
+        """合并内容超出预算时分组逐层合并，直到可以一次合并；任一调用失败时返回错误信息"""
+        for partial in partials:
+            if partial.startswith(API_ERROR_PREFIX):
+                return partial
+
+        while len(partials) > 1 and estimate_tokens("".join(partials)) > self.window_tokens:
+            groups, group, group_tokens = [], [], 0
+            for partial in partials:
+                tokens = estimate_tokens(partial)
+                if len(group) >= 2 and group_tokens + tokens > self.window_tokens:
+                    groups.append(group)
+                    group, group_tokens = [], 0
+                group.append(partial)
+                group_tokens += tokens
+            groups.append(group)
+            if len(groups) == 1:
+                break
+            partials = self._map(
+                lambda group: group[0] if len(group) == 1 else self.ai_engine.merge_summaries(group, query),
+                groups
+            )
+            for partial in partials:
+                if partial.startswith(API_ERROR_PREFIX):
+                    return partial
+        return partials
@@ -3,6 +3,7 @@ Windows QQ聊天记录处理模块
 支持多种获取方式：文件导入、路径扫描、数据库读取（实验性）
 """
 
+import io
 import os
 import sqlite3
 import json
@@ -12,12 +13,24 @@ from pathlib import Path
 import logging
 from typing import List, Dict, Optional
 
+from directory_scanner import DirectoryScanner, default_cache_dir
+
+# 账户目录中存放图片、语音、接收文件等的子目录，其中不会有聊天数据库，扫描时直接跳过
+QQ_SKIP_DIRS = ('Image', 'Audio', 'Video', 'FileRecv', 'CustomFace', 'CustomFaceRecent', 'OfflineFile',
+                'Temp', 'Cache', 'Thumb', 'Emoji', 'Ptt', 'AppWebCache')
+
+def _is_msg_db_file(name: str) -> bool:
+    # QQ数据库通常在 Msg3.0.db 或类似文件中
+    return name.endswith('.db') and 'Msg' in name
+
 class WindowsQQExtractor:
     """Windows QQ聊天记录提取器"""
     
     def __init__(self, privacy_manager=None):
         self.logger = self._setup_logger()
         self.qq_paths = self._get_default_qq_paths()
+        self.scanner = DirectoryScanner(_is_msg_db_file, skip_dirs=QQ_SKIP_DIRS,
+                                        cache_path=os.path.join(default_cache_dir(), 'scan_qq.json'))
         self.privacy_manager = privacy_manager
         
     def _setup_logger(self):
@@ -51,19 +64,24 @@ class WindowsQQExtractor:
             if self.privacy_manager:
                 self.privacy_manager.log_data_access('qq_scan_start', privacy_level, 0)
             
+            account_dirs = []
             for base_path in self.qq_paths:
                 try:
-                    for item in os.listdir(base_path):
-                        account_path = os.path.join(base_path, item)
-                        if os.path.isdir(account_path) and item.isdigit():
-                            account_info = self._analyze_qq_directory(account_path, item, privacy_level)
-                            if account_info:
-                                accounts.append(account_info)
+                    with os.scandir(base_path) as entries:
+                        for item in entries:
+                            if item.name.isdigit() and item.is_dir():
+                                account_dirs.append((item.path, item.name))
                 except PermissionError:
                     self.logger.warning(f"无权限访问路径: {base_path}")
                 except Exception as e:
                     self.logger.error(f"扫描路径 {base_path} 时出错: {e}")
             
+            # 多个账户并行分析
+            results = self.scanner.map(
+                lambda item: self._analyze_qq_directory(item[0], item[1], privacy_level), account_dirs)
+            self.scanner.save()
+            accounts = [account_info for account_info in results if account_info]
+            
             # 记录扫描结果
             if self.privacy_manager:
                 self.privacy_manager.log_data_access('qq_scan_complete', privacy_level, len(accounts))
@@ -80,12 +98,7 @@ class WindowsQQExtractor:
     def _analyze_qq_directory(self, account_path: str, qq_number: str, privacy_level: str = 'basic') -> Optional[Dict]:
         """分析QQ账户目录结构"""
         try:
-            # QQ数据库通常在 Msg3.0.db 或类似文件中
-            db_files = []
-            for root, dirs, files in os.walk(account_path):
-                for file in files:
-                    if file.endswith('.db') and 'Msg' in file:
-                        db_files.append(os.path.join(root, file))
+            db_files = self.scanner.find_files(account_path)
             
             account_info = {
                 'qq_number': qq_number if privacy_level == 'basic' else f"QQ用户{hash(qq_number) % 1000}",
@@ -101,8 +114,13 @@ class WindowsQQExtractor:
             self.logger.error(f"分析QQ目录 {account_path} 时出错: {e}")
             return None
     
-    def extract_from_text_export(self, file_path: str, privacy_level: str = 'basic') -> List[Dict]:
-        """从文本导出文件中提取聊天记录"""
+    def extract_from_text_export(self, file_path: str, privacy_level: str = 'basic',
+                                 offset: int = 0, raise_errors: bool = False) -> List[Dict]:
+        """从文本导出文件中提取聊天记录
+
+        读取失败时默认记录日志并返回空列表；raise_errors为True时重新抛出异常，
+        便于调用方区分"解析失败"和"文件中没有消息"
+        """
         try:
             # 验证文件
             if not os.path.exists(file_path):
@@ -119,8 +137,7 @@ class WindowsQQExtractor:
             if self.privacy_manager:
                 self.privacy_manager.log_data_access('qq_text_extract_start', privacy_level, 0)
             
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
+            content = self._read_text(file_path, offset, 'utf-8')
             
             messages = self._parse_qq_text_format(content, privacy_level)
             
@@ -134,20 +151,30 @@ class WindowsQQExtractor:
         except UnicodeDecodeError:
             self.logger.error(f"文件编码错误，尝试其他编码: {file_path}")
             try:
-                with open(file_path, 'r', encoding='gbk') as f:
-                    content = f.read()
+                content = self._read_text(file_path, offset, 'gbk')
                 messages = self._parse_qq_text_format(content, privacy_level)
                 self.logger.info(f"使用GBK编码成功提取 {len(messages)} 条消息")
                 return messages
             except Exception as e:
                 self.logger.error(f"使用GBK编码仍然失败: {e}")
+                if raise_errors:
+                    raise
                 return []
         except Exception as e:
             self.logger.error(f"读取QQ文本文件 {file_path} 时出错: {e}")
             if self.privacy_manager:
                 self.privacy_manager.log_data_access('qq_text_extract_error', privacy_level, 0)
+            if raise_errors:
+                raise
             return []
     
+    def _read_text(self, file_path: str, offset: int, encoding: str) -> str:
+        """从offset字节处开始读取文本，用于只解析追加到导出文件末尾的内容"""
+        with open(file_path, 'rb') as raw:
+            raw.seek(offset)
+            with io.TextIOWrapper(raw, encoding=encoding) as f:
+                return f.read()
+    
     def _parse_qq_text_format(self, content: str, privacy_level: str = 'basic') -> List[Dict]:
         """解析QQ文本格式"""
         messages = []
@@ -3,6 +3,7 @@ Windows微信聊天记录处理模块
 支持多种获取方式：文件导入、路径扫描、数据库读取（实验性）
 """
 
+import io
 import os
 import sqlite3
 import json
@@ -10,7 +11,40 @@ import re
 from datetime import datetime
 from pathlib import Path
 import logging
-from typing import List, Dict, Optional, Tuple
+from typing import Iterator, List, Dict, Optional, Tuple
+
+from directory_scanner import DirectoryScanner, default_cache_dir
+
+# 账户目录中存放图片、视频、文件等的子目录，其中不会有聊天数据库，扫描时直接跳过
+WECHAT_SKIP_DIRS = ('FileStorage', 'Image', 'Video', 'Attach', 'Cache', 'CustomEmotion', 'Emotion',
+                    'Temp', 'Voice', 'Thumb', 'Sns', 'Backup', 'ResUpdate')
+
+def _is_db_file(name: str) -> bool:
+    return name.endswith('.db')
+
+# 每次从MSG表读取的行数
+DB_BATCH_SIZE = 5000
+
+# MSG表中需要的字段，localId即rowid
+_MSG_COLUMNS = ('localId', 'Type', 'SubType', 'IsSender', 'CreateTime', 'StrTalker', 'StrContent')
+
+# MSG.Type 对应的消息类型，非文本消息的内容用占位文字代替
+WECHAT_MESSAGE_TYPES = {
+    1: ('text', None),
+    3: ('image', '[图片]'),
+    34: ('voice', '[语音]'),
+    42: ('card', '[名片]'),
+    43: ('video', '[视频]'),
+    47: ('emoji', '[表情]'),
+    48: ('location', '[位置]'),
+    49: ('app', '[链接/文件]'),
+    50: ('call', '[通话]'),
+    10000: ('system', None),
+    10002: ('system', '[撤回消息]'),
+}
+
+# 群聊消息内容以 "发送者wxid:\n" 开头
+_GROUP_SENDER = re.compile(r'^([A-Za-z0-9_\-@.]+):\n')
 
 class WindowsWeChatExtractor:
     """Windows微信聊天记录提取器"""
@@ -19,6 +53,8 @@ class WindowsWeChatExtractor:
         self.logger = self._setup_logger()
         self.wechat_paths = self._get_default_wechat_paths()
         self.privacy_manager = privacy_manager
+        self.scanner = DirectoryScanner(_is_db_file, skip_dirs=WECHAT_SKIP_DIRS,
+                                        cache_path=os.path.join(default_cache_dir(), 'scan_wechat.json'))
         
     def _setup_logger(self):
         """设置日志"""
@@ -42,23 +78,23 @@ class WindowsWeChatExtractor:
         return [path for path in possible_paths if os.path.exists(path)]
     
     def scan_wechat_accounts(self) -> List[Dict]:
-        """扫描微信账户目录"""
-        accounts = []
+        """扫描微信账户目录，多个账户并行分析"""
+        account_dirs = []
         
         for base_path in self.wechat_paths:
             try:
-                for item in os.listdir(base_path):
-                    account_path = os.path.join(base_path, item)
-                    if os.path.isdir(account_path) and item.startswith('wxid_'):
-                        account_info = self._analyze_account_directory(account_path, item)
-                        if account_info:
-                            accounts.append(account_info)
+                with os.scandir(base_path) as entries:
+                    for item in entries:
+                        if item.name.startswith('wxid_') and item.is_dir():
+                            account_dirs.append((item.path, item.name))
             except PermissionError:
                 self.logger.warning(f"无权限访问路径: {base_path}")
             except Exception as e:
                 self.logger.error(f"扫描路径 {base_path} 时出错: {e}")
         
-        return accounts
+        accounts = self.scanner.map(lambda item: self._analyze_account_directory(*item), account_dirs)
+        self.scanner.save()
+        return [account for account in accounts if account]
     
     def _analyze_account_directory(self, account_path: str, wxid: str) -> Optional[Dict]:
         """分析账户目录结构"""
@@ -68,11 +104,7 @@ class WindowsWeChatExtractor:
                 return None
                 
             # 查找数据库文件
-            db_files = []
-            for root, dirs, files in os.walk(msg_path):
-                for file in files:
-                    if file.endswith('.db'):
-                        db_files.append(os.path.join(root, file))
+            db_files = self.scanner.find_files(msg_path)
             
             return {
                 'wxid': wxid,
@@ -85,15 +117,19 @@ class WindowsWeChatExtractor:
             self.logger.error(f"分析账户目录 {account_path} 时出错: {e}")
             return None
     
-    def extract_from_text_export(self, file_path: str, privacy_level: str = 'basic') -> List[Dict]:
-        """从文本导出文件中提取聊天记录（推荐方式）"""
+    def extract_from_text_export(self, file_path: str, privacy_level: str = 'basic',
+                                 offset: int = 0, raise_errors: bool = False) -> List[Dict]:
+        """从文本导出文件中提取聊天记录（推荐方式）
+
+        读取失败时默认记录日志并返回空列表；raise_errors为True时重新抛出异常，
+        便于调用方区分"解析失败"和"文件中没有消息"
+        """
         try:
             # 记录数据访问
             if self.privacy_manager:
                 self.privacy_manager.log_data_access('text_extract', privacy_level, 0)
             
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
+            content = self._read_text(file_path, offset, 'utf-8')
             
             # 解析微信文本导出格式
             messages = self._parse_wechat_text_format(content)
@@ -107,8 +143,17 @@ class WindowsWeChatExtractor:
             
         except Exception as e:
             self.logger.error(f"读取文本文件 {file_path} 时出错: {e}")
+            if raise_errors:
+                raise
             return []
     
+    def _read_text(self, file_path: str, offset: int, encoding: str) -> str:
+        """从offset字节处开始读取文本，用于只解析追加到导出文件末尾的内容"""
+        with open(file_path, 'rb') as raw:
+            raw.seek(offset)
+            with io.TextIOWrapper(raw, encoding=encoding) as f:
+                return f.read()
+    
     def _parse_wechat_text_format(self, content: str) -> List[Dict]:
         """解析微信文本格式"""
         messages = []
@@ -135,7 +180,7 @@ class WindowsWeChatExtractor:
         return messages
     
     def attempt_database_read(self, db_path: str, password: str = None) -> List[Dict]:
-        """尝试读取数据库文件（实验性功能）"""
+        """读取已解密的数据库文件（实验性功能），需要流式处理时使用iter_database_messages"""
         self.logger.warning("⚠️  数据库直接读取功能仅供研究使用，请确保合规性")
         
         if not os.path.exists(db_path):
@@ -143,26 +188,7 @@ class WindowsWeChatExtractor:
             return []
         
         try:
-            # 检查文件是否被锁定
-            if self._is_file_locked(db_path):
-                self.logger.warning("数据库文件被微信进程锁定，请关闭微信后重试")
-                return []
-            
-            # 尝试连接数据库
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            
-            # 获取表结构
-            tables = self._get_database_tables(cursor)
-            self.logger.info(f"发现数据库表: {tables}")
-            
-            messages = []
-            if 'MSG' in tables:
-                messages = self._extract_from_msg_table(cursor)
-            
-            conn.close()
-            return messages
-            
+            return list(self.iter_database_messages(db_path))
         except sqlite3.DatabaseError as e:
             self.logger.error(f"数据库可能已加密: {e}")
             return []
@@ -170,49 +196,111 @@ class WindowsWeChatExtractor:
             self.logger.error(f"读取数据库时出错: {e}")
             return []
     
-    def _is_file_locked(self, file_path: str) -> bool:
-        """检查文件是否被锁定"""
+    def iter_database_messages(self, db_path: str, batch_size: int = DB_BATCH_SIZE,
+                               after: Optional[Tuple[int, int]] = None) -> Iterator[Dict]:
+        """按时间顺序逐条生成MSG表中的消息
+
+        以只读方式打开数据库，按 (CreateTime, localId) 分批读取，每批从上一批最后一行之后开始，
+        不使用OFFSET，内存占用与数据库大小无关。每条消息带有create_time和local_id，
+        after为 (create_time, local_id) 时只读取该位置之后的消息。
+        数据库仍加密或不是SQLite文件时抛出sqlite3.DatabaseError。
+        """
+        conn = self._connect_readonly(db_path)
         try:
-            with open(file_path, 'r+b') as f:
-                pass
-            return False
-        except IOError:
-            return True
+            tables = self._get_database_tables(conn.cursor())
+            if 'MSG' not in tables:
+                self.logger.warning(f"{db_path} 中没有MSG表，发现的表: {tables}")
+                return
+            
+            columns = self._msg_columns(conn)
+            count = 0
+            for row in self._iter_msg_rows(conn, columns, batch_size, after):
+                message = self._decode_msg_row(row)
+                if message is not None:
+                    count += 1
+                    yield message
+            self.logger.info(f"从数据库 {db_path} 读取到 {count} 条消息")
+        finally:
+            conn.close()
+    
+    def _connect_readonly(self, db_path: str) -> sqlite3.Connection:
+        """通过URI以只读方式打开数据库，不会创建文件或修改微信的数据"""
+        uri = Path(db_path).resolve().as_uri() + '?mode=ro'
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
     
     def _get_database_tables(self, cursor) -> List[str]:
         """获取数据库表列表"""
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
         return [row[0] for row in cursor.fetchall()]
     
-    def _extract_from_msg_table(self, cursor) -> List[Dict]:
-        """从MSG表提取消息"""
+    def _msg_columns(self, conn) -> List[str]:
+        """MSG表中实际存在的所需字段，不同版本的微信字段略有差异"""
+        available = {row[1] for row in conn.execute("PRAGMA table_info(MSG);")}
+        missing = {'localId', 'CreateTime'} - available
+        if missing:
+            raise sqlite3.DatabaseError(f"MSG表缺少字段: {sorted(missing)}")
+        return [column for column in _MSG_COLUMNS if column in available]
+    
+    def _iter_msg_rows(self, conn, columns: List[str], batch_size: int,
+                       after: Optional[Tuple[int, int]] = None) -> Iterator[sqlite3.Row]:
+        """按 (CreateTime, localId) 键集分页读取MSG表
+
+        CreateTime上有索引，索引中隐含rowid，范围条件 CreateTime >= ? 可以直接走索引，
+        排序也无需额外的临时B树。
+        """
+        query = (
+            f"SELECT {', '.join(columns)} FROM MSG "
+            "WHERE CreateTime >= ? AND (CreateTime > ? OR localId > ?) "
+            "ORDER BY CreateTime, localId LIMIT ?"
+        )
+        create_time, local_id = after if after is not None else (-1, -1)
+        while True:
+            rows = conn.execute(query, (create_time, create_time, local_id, batch_size)).fetchall()
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            create_time, local_id = rows[-1]['CreateTime'], rows[-1]['localId']
+    
+    def _decode_msg_row(self, row: sqlite3.Row) -> Optional[Dict]:
+        """将MSG表中的一行转换为标准消息格式，无法解析的行返回None"""
+        keys = row.keys()
         try:
-            # 获取表结构
-            cursor.execute("PRAGMA table_info(MSG);")
-            columns = [row[1] for row in cursor.fetchall()]
-            self.logger.info(f"MSG表字段: {columns}")
-            
-            # 尝试提取消息
-            query = "SELECT * FROM MSG LIMIT 10;"  # 限制数量避免过载
-            cursor.execute(query)
-            rows = cursor.fetchall()
-            
-            messages = []
-            for row in rows:
-                # 这里需要根据实际表结构解析
-                # 注意：实际的微信数据库结构可能很复杂
-                message_data = dict(zip(columns, row))
-                messages.append({
-                    'raw_data': message_data,
-                    'source': 'wechat_database',
-                    'note': '需要进一步解析'
-                })
-            
-            return messages
-            
-        except Exception as e:
-            self.logger.error(f"从MSG表提取数据时出错: {e}")
-            return []
+            timestamp = datetime.fromtimestamp(int(row['CreateTime']))
+        except (TypeError, ValueError, OverflowError, OSError):
+            return None
+        
+        msg_type = row['Type'] if 'Type' in keys else 1
+        type_name, placeholder = WECHAT_MESSAGE_TYPES.get(msg_type, ('other', '[其他消息]'))
+        talker = (row['StrTalker'] if 'StrTalker' in keys else None) or ''
+        content = (row['StrContent'] if 'StrContent' in keys else None) or ''
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', errors='replace')
+        
+        is_sender = bool(row['IsSender']) if 'IsSender' in keys else False
+        sender = '我' if is_sender else talker
+        if talker.endswith('@chatroom') and not is_sender:
+            match = _GROUP_SENDER.match(content)
+            if match:
+                sender = match.group(1)
+                content = content[match.end():]
+        
+        if placeholder is not None and type_name != 'text':
+            content = placeholder
+        if not content.strip():
+            return None
+        
+        return {
+            'timestamp': timestamp.isoformat(),
+            'sender': sender,
+            'message': content.strip(),
+            'type': type_name,
+            'talker': talker,
+            'source': 'wechat_database',
+            'create_time': row['CreateTime'],
+            'local_id': row['localId']
+        }
     
     def export_to_standard_format(self, messages: List[Dict], output_path: str):
         """导出为标准格式"""
@@ -6,7 +6,7 @@ import os
 # 添加src路径到Python路径
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../../src/backend'))
 
-from ai_engine import QwenAI
+from ai_engine import QwenAI, SummaryCache
 
 class TestQwenAI:
     def setup_method(self):
@@ -19,7 +19,7 @@ class TestQwenAI:
         assert self.ai_engine.api_key == self.api_key
         assert self.ai_engine.api_url is not None
     
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_generate_summary_success(self, mock_post):
         """测试成功生成摘要"""
         # 模拟API响应
@@ -42,7 +42,7 @@ class TestQwenAI:
         assert "测试摘要" in result
         mock_post.assert_called_once()
     
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_generate_summary_api_error(self, mock_post):
         """测试API错误处理"""
         mock_response = Mock()
@@ -63,4 +63,99 @@ class TestQwenAI:
     def test_generate_summary_invalid_messages(self):
         """测试无效消息格式"""
         with pytest.raises(TypeError):
-            self.ai_engine.generate_summary(None)
\ No newline at end of file
+            self.ai_engine.generate_summary(None)
+    
+    @patch('ai_engine.time.sleep')
+    @patch('requests.Session.post')
+    def test_generate_summary_retries_on_rate_limit(self, mock_post, mock_sleep):
+        """测试遇到429时退避重试，被重试的响应先关闭以归还连接"""
+        limited = Mock(status_code=429, headers={})
+        success = Mock(status_code=200, headers={})
+        success.json.return_value = {"output": {"text": "重试后的摘要"}}
+        mock_post.side_effect = [limited, limited, success]
+        
+        result = self.ai_engine.generate_summary("[2024/2/1 14:30:00] 用户A: 你好")
+        
+        assert result == "重试后的摘要"
+        assert mock_post.call_count == 3
+        assert mock_sleep.call_count == 2
+        assert mock_post.call_args.kwargs['timeout'] == self.ai_engine.timeout
+        assert limited.close.call_count == 2
+        success.close.assert_not_called()
+    
+    @patch('requests.Session.post')
+    def test_generate_many_keeps_order(self, mock_post):
+        """测试批量生成摘要时结果顺序与输入一致"""
+        def respond(url, json=None, **kwargs):
+            response = Mock(status_code=200, headers={})
+            response.json.return_value = {"output": {"text": json['input']['messages'][1]['content'][-2:]}}
+            return response
+        mock_post.side_effect = respond
+        
+        results = self.ai_engine.generate_many([f"消息{i:02d}" for i in range(8)], max_concurrency=3)
+        
+        assert results == [f"{i:02d}" for i in range(8)]
+    
+    @patch('requests.Session.post')
+    def test_summary_cache_hit(self, mock_post, tmp_path):
+        """测试相同提示词第二次直接命中缓存"""
+        mock_response = Mock(status_code=200, headers={})
+        mock_response.json.return_value = {"output": {"text": "缓存的摘要"}}
+        mock_post.return_value = mock_response
+        cache = SummaryCache(str(tmp_path))
+        ai_engine = QwenAI(api_key=self.api_key, cache=cache)
+        
+        assert ai_engine.generate_summary("聊天内容", "订单汇总") == "缓存的摘要"
+        assert ai_engine.generate_summary("聊天内容", "订单汇总") == "缓存的摘要"
+        
+        mock_post.assert_called_once()
+        assert cache.stats()['hits'] == 1
+        assert cache.stats()['misses'] == 1
+    
+    def test_summary_cache_eviction(self, tmp_path):
+        """测试超出容量时淘汰最久未使用的条目"""
+        cache = SummaryCache(str(tmp_path), max_bytes=600)
+        for i in range(10):
+            cache.set(f"{i:064d}", "摘要" * 20)
+        
+        assert cache.stats()['bytes'] <= 600
+        assert cache.get(f"{9:064d}") == "摘要" * 20
+        assert cache.get(f"{0:064d}") is None
+    
+    def test_summary_cache_overwrite_keeps_size(self, tmp_path):
+        """测试覆盖同一条目时缓存大小不会重复累加"""
+        cache = SummaryCache(str(tmp_path))
+        for _ in range(5):
+            cache.set(f"{1:064d}", "摘要")
+        
+        assert cache.stats()['entries'] == 1
+        assert cache._total_bytes == cache.stats()['bytes']
+    
+    @patch('requests.Session.post')
+    def test_stream_summary_truncated_not_cached(self, mock_post, tmp_path):
+        """测试未收到结束标记的流式输出不写入缓存"""
+        mock_response = Mock(status_code=200, headers={})
+        mock_response.iter_lines.return_value = ['data:{"output":{"text":"客户"}}', '']
+        mock_post.return_value = mock_response
+        cache = SummaryCache(str(tmp_path))
+        ai_engine = QwenAI(api_key=self.api_key, cache=cache)
+        
+        assert list(ai_engine.stream_summary("聊天内容")) == ["客户"]
+        assert list(ai_engine.stream_summary("聊天内容")) == ["客户"]
+        assert mock_post.call_count == 2
+    
+    @patch('requests.Session.post')
+    def test_stream_summary_incremental_output(self, mock_post):
+        """测试解析DashScope的SSE增量输出"""
+        mock_response = Mock(status_code=200, headers={})
+        mock_response.iter_lines.return_value = [
+            'id:1', 'event:result', 'data:{"output":{"text":"客户"}}', '',
+            'id:2', 'event:result', 'data:{"output":{"text":"下单3件","finish_reason":"stop"}}', ''
+        ]
+        mock_post.return_value = mock_response
+        
+        deltas = list(self.ai_engine.stream_summary("聊天内容"))
+        
+        assert deltas == ["客户", "下单3件"]
+        assert mock_post.call_args.kwargs['headers']['X-DashScope-SSE'] == 'enable'
+        assert mock_post.call_args.kwargs['json']['parameters']['incremental_output'] is True
@@ -0,0 +1,143 @@
+import pytest
+import sys
+import os
+
+# 添加src路径到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../../src/backend'))
+
+from chat_extractor_manager import ChatExtractorManager
+
+def _msg(timestamp, sender, message, source):
+    return {'timestamp': timestamp, 'sender': sender, 'message': message, 'source_file': source}
+
+class TestChatExtractorManager:
+    def setup_method(self):
+        """每个测试方法前的设置"""
+        self.manager = ChatExtractorManager(max_workers=1)
+    
+    def test_merge_sorted_files(self):
+        """测试多个文件的消息按时间归并"""
+        messages = [
+            _msg('2024-02-01T10:00:00', '客户', '你好', 'a.txt'),
+            _msg('2024-02-01T10:02:00', '客户', '在吗', 'a.txt'),
+            _msg('2024-02-01T10:01:00', '客服', '您好', 'b.txt'),
+            _msg('2024-02-01T10:03:00', '客服', '在的', 'b.txt'),
+        ]
+        
+        result = self.manager.merge_and_sort_messages(messages)
+        
+        assert [msg['message'] for msg in result] == ['你好', '您好', '在吗', '在的']
+    
+    def test_merge_removes_duplicates_across_files(self):
+        """测试同一条消息出现在多个文件中时只保留一条"""
+        messages = [
+            _msg('2024-02-01T10:00:00', '客户', '你好', 'a.txt'),
+            _msg('2024-02-01T10:00:00', '客服', '你好', 'a.txt'),
+            _msg('2024-02-01T10:00:00', '客户', '你好', 'b.txt'),
+            _msg('2024-02-01T10:05:00', '客户', '你好', 'b.txt'),
+        ]
+        
+        result = self.manager.merge_and_sort_messages(messages)
+        
+        assert [(msg['sender'], msg['source_file']) for msg in result] == [
+            ('客户', 'a.txt'), ('客服', 'a.txt'), ('客户', 'b.txt')
+        ]
+        assert result[2]['timestamp'] == '2024-02-01T10:05:00'
+    
+    def test_merge_unsorted_input(self):
+        """测试文件内部乱序时结果仍然有序"""
+        timestamps = ['2024-02-01T10:0%d:00' % i for i in (5, 3, 9, 1, 1, 7)]
+        messages = [_msg(ts, '客户', f'消息{i}', 'a.txt') for i, ts in enumerate(timestamps)]
+        
+        result = self.manager.merge_and_sort_messages(messages)
+        
+        assert [msg['timestamp'] for msg in result] == sorted(timestamps)
+    
+    def test_iter_merged_messages_streams(self):
+        """测试直接归并多个消息流"""
+        first = iter([_msg('2024-02-01T10:00:00', '客户', '一', 'a'), _msg('2024-02-01T10:02:00', '客户', '三', 'a')])
+        second = iter([_msg('2024-02-01T10:01:00', '客服', '二', 'b')])
+        
+        merged = self.manager.iter_merged_messages([first, second])
+        
+        assert next(merged)['message'] == '一'
+        assert [msg['message'] for msg in merged] == ['二', '三']
+    
+    def test_extract_error_distinguished_from_empty(self, tmp_path):
+        """测试读取出错时返回None，与没有消息的文件区分开"""
+        empty_file = tmp_path / "empty.txt"
+        empty_file.write_text("", encoding='utf-8')
+        
+        assert self.manager._extract_file({'file_path': str(empty_file), 'type': 'wechat'}) == []
+        assert self.manager._extract_file({'file_path': str(tmp_path), 'type': 'wechat'}) is None
+        assert self.manager._extract_file({'file_path': str(tmp_path), 'type': 'auto'}) is None
+    
+    def test_parallel_extraction_reuses_shared_pool(self, tmp_path):
+        """测试并行解析使用共享进程池，多次调用不新建进程池"""
+        import process_pool
+        configs = []
+        for i in range(2):
+            chat_file = tmp_path / f"chat{i}.txt"
+            chat_file.write_text(f"2024-02-01 14:3{i}:00 客户{i}\n消息{i}\n", encoding='utf-8')
+            configs.append({'file_path': str(chat_file), 'type': 'wechat'})
+        manager = ChatExtractorManager(max_workers=2)
+        
+        first = dict((c['file_path'], m) for c, m in manager.iter_extract_from_files(configs))
+        pool = process_pool.get_pool()
+        second = dict((c['file_path'], m) for c, m in manager.iter_extract_from_files(configs))
+        
+        assert first == second
+        assert [m[0]['message'] for m in (first[c['file_path']] for c in configs)] == ['消息0', '消息1']
+        assert process_pool.get_pool() is pool
+    
+    def test_merge_into_store_and_report(self):
+        """测试归并结果直接写入列式存储，报告与列表方式一致"""
+        from message_store import MessageStore
+        messages = [
+            _msg('2024-02-01T10:02:00', '客户', '在吗', 'a.txt'),
+            _msg('2024-02-01T10:00:00', '客服', '你好', 'b.txt'),
+            _msg('2024-02-01T10:00:00', '客服', '你好', 'b.txt'),
+            _msg('2024-02-01T10:05:00', '客服', '在的', 'b.txt'),
+        ]
+        
+        unified = self.manager.merge_and_sort_messages(messages)
+        store = MessageStore.from_messages(self.manager.iter_merge_and_sort(messages), content_key='message')
+        
+        assert [msg['message'] for msg in store.iter_records()] == [msg['message'] for msg in unified]
+        report = self.manager.generate_extraction_report({}, store.iter_records())
+        assert report == self.manager.generate_extraction_report({}, unified)
+        assert report['extraction_summary']['total_messages'] == 3
+        assert report['extraction_summary']['time_range'] == {
+            'earliest': '2024-02-01T10:00:00', 'latest': '2024-02-01T10:05:00'}
+        assert report['extraction_summary']['top_senders'][0] == {'sender': '客服', 'message_count': 2}
+    
+    def test_unordered_list_sorted_instead_of_merged(self):
+        """测试基本无序的消息列表不拆成大量有序段多路归并，直接排序"""
+        import random
+        messages = [_msg(f'2024-02-01T10:{i // 60:02d}:{i % 60:02d}', '客户', f'消息{i}', 'a.txt') for i in range(500)]
+        shuffled = messages[:]
+        random.Random(0).shuffle(shuffled)
+        
+        assert self.manager._sorted_runs(shuffled) is None
+        assert len(self.manager._sorted_runs(messages[250:] + messages[:250])) == 2
+        assert self.manager.merge_and_sort_messages(shuffled) == messages
+    
+    def test_extract_merged_per_file_streams(self, tmp_path):
+        """测试按文件逐个归并：直接解析和经过归档两种方式结果一致"""
+        from message_archive import MessageArchive
+        configs = []
+        for i in range(2):
+            chat_file = tmp_path / f"chat{i}.txt"
+            chat_file.write_text(
+                f"2024-02-01 10:0{i}:00 客户{i}\n第一条\n2024-02-01 10:0{i + 2}:00 客服\n第二条\n"
+                "2024-02-01 10:05:00 客服\n重复的消息\n", encoding='utf-8')
+            configs.append({'file_path': str(chat_file), 'type': 'wechat'})
+        archived = ChatExtractorManager(archive=MessageArchive(str(tmp_path / "archive.db")), max_workers=1)
+        
+        streams = archived.extract_file_streams(configs)
+        merged = list(self.manager.iter_extract_merged(configs))
+        
+        assert len(streams) == 2 and not isinstance(streams[0], list)
+        assert [(msg['timestamp'][11:16], msg['message']) for msg in merged] == [
+            ('10:00', '第一条'), ('10:01', '第一条'), ('10:02', '第二条'), ('10:03', '第二条'), ('10:05', '重复的消息')]
+        assert [msg['message'] for msg in archived.iter_merged_messages(streams)] == [msg['message'] for msg in merged]
@@ -0,0 +1,37 @@
+import pytest
+import sys
+import os
+from datetime import datetime, timedelta
+
+# 添加src路径到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../../src/backend'))
+
+from message_store import MessageStore
+from chat_session import ChatSessionCache
+
+class TestChatSessionCache:
+    def setup_method(self):
+        """每个测试方法前的设置"""
+        start = datetime(2024, 2, 1, 14, 0)
+        self.stores = []
+        for n in range(2):
+            store = MessageStore()
+            for i in range(50):
+                store.append(start + timedelta(minutes=i), '客户', f'第{n}份记录的第{i}条消息，订单{i:04d}')
+            self.stores.append(store)
+
+    def test_search_index_counted_in_cache_size(self):
+        """测试检索索引占用的内存计入缓存大小，超出上限时淘汰较早的会话"""
+        cache = ChatSessionCache(max_bytes=10 ** 9)
+        first = cache.add(self.stores[0])
+        before = cache.total_bytes
+
+        index = cache.search_index(first)
+        assert cache.search_index(first) is index
+        assert cache.total_bytes == before + index.nbytes
+
+        cache.max_bytes = cache.total_bytes + self.stores[1].nbytes - 1
+        cache.add(self.stores[1])
+        assert len(cache) == 1
+        assert cache.get(first.chat_id) is None
+        assert cache.total_bytes == self.stores[1].nbytes
@@ -0,0 +1,80 @@
+import pytest
+import sys
+import os
+from unittest.mock import patch
+
+# 添加src路径到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../../src/backend'))
+
+from directory_scanner import DirectoryScanner
+
+def _is_db(name):
+    return name.endswith('.db')
+
+class TestDirectoryScanner:
+    def setup_method(self):
+        """每个测试方法前的设置"""
+        self.skip_dirs = ('Image', 'Video')
+    
+    def _make_tree(self, root):
+        (root / "Msg" / "Multi").mkdir(parents=True)
+        (root / "Msg" / "MicroMsg.db").write_bytes(b'')
+        (root / "Msg" / "Multi" / "MSG0.db").write_bytes(b'')
+        (root / "Msg" / "Multi" / "notes.txt").write_bytes(b'')
+        (root / "Msg" / "Image").mkdir()
+        (root / "Msg" / "Image" / "thumb.db").write_bytes(b'')
+    
+    def test_find_files_prunes_skipped_dirs(self, tmp_path):
+        """测试只返回匹配的文件并跳过媒体目录"""
+        self._make_tree(tmp_path)
+        scanner = DirectoryScanner(_is_db, skip_dirs=self.skip_dirs)
+        
+        files = scanner.find_files(str(tmp_path / "Msg"))
+        
+        assert sorted(os.path.relpath(path, tmp_path) for path in files) == [
+            os.path.join('Msg', 'MicroMsg.db'), os.path.join('Msg', 'Multi', 'MSG0.db')
+        ]
+    
+    def test_rescan_only_lists_changed_dirs(self, tmp_path):
+        """测试再次扫描时只重新列出修改时间变化的目录"""
+        self._make_tree(tmp_path)
+        cache_path = str(tmp_path / "cache" / "scan.json")
+        scanner = DirectoryScanner(_is_db, skip_dirs=self.skip_dirs, cache_path=cache_path)
+        scanner.find_files(str(tmp_path / "Msg"))
+        scanner.save()
+        
+        new_file = tmp_path / "Msg" / "Multi" / "MSG1.db"
+        new_file.write_bytes(b'')
+        multi_dir = str(tmp_path / "Msg" / "Multi")
+        os.utime(multi_dir, ns=(os.stat(multi_dir).st_atime_ns, os.stat(multi_dir).st_mtime_ns + 10 ** 9))
+        
+        # 新的扫描器从磁盘缓存加载
+        rescanner = DirectoryScanner(_is_db, skip_dirs=self.skip_dirs, cache_path=cache_path)
+        with patch('directory_scanner.os.scandir', wraps=os.scandir) as scandir:
+            files = rescanner.find_files(str(tmp_path / "Msg"))
+        
+        assert [call.args[0] for call in scandir.call_args_list] == [multi_dir]
+        assert str(new_file) in files
+        assert len(files) == 3
+    
+    def test_iter_files_depth_ignore_and_stat(self, tmp_path):
+        """测试深度限制、忽略规则，以及缓存命中的目录仍返回最新的文件信息"""
+        self._make_tree(tmp_path)
+        (tmp_path / "Msg" / "backup.db").write_bytes(b'')
+        scanner = DirectoryScanner(_is_db, skip_dirs=self.skip_dirs)
+        root = str(tmp_path / "Msg")
+        
+        shallow = [path for path, _ in scanner.iter_files(root, max_depth=0, ignore=['backup*'])]
+        assert sorted(os.path.basename(path) for path in shallow) == ['MicroMsg.db']
+        
+        (tmp_path / "Msg" / "Multi" / "MSG0.db").write_bytes(b'12345')
+        results = dict(scanner.iter_files(root, ignore=['Multi'], with_stat=True))
+        assert str(tmp_path / "Msg" / "Multi" / "MSG0.db") not in results
+        
+        results = dict(scanner.iter_files(root, with_stat=True))
+        assert results[str(tmp_path / "Msg" / "Multi" / "MSG0.db")].st_size == 5
+    
+    def test_map_runs_all_items(self):
+        """测试并行处理多个账户目录时保持顺序"""
+        scanner = DirectoryScanner(_is_db, max_workers=3)
+        assert scanner.map(lambda x: x * 2, range(5)) == [0, 2, 4, 6, 8]
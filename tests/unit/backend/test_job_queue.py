@@ -0,0 +1,79 @@
+import pytest
+import sys
+import os
+import threading
+
+# 添加src路径到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../../src/backend'))
+
+from job_queue import JobManager
+
+class TestJobManager:
+    def test_job_reports_progress_and_result(self, tmp_path):
+        """测试任务上报进度并保存结果"""
+        manager = JobManager(str(tmp_path / "jobs.db"), max_workers=1)
+        
+        def run(job):
+            for i in range(3):
+                job.update(files_parsed=i + 1, files_total=3)
+            return {'message_count': 42}
+        
+        job_id = manager.submit('extract', run)
+        job = manager.wait(job_id, timeout=5)
+        
+        assert job['status'] == 'succeeded'
+        assert job['progress'] == {'files_parsed': 3, 'files_total': 3}
+        assert job['result'] == {'message_count': 42}
+        manager.close()
+    
+    def test_cancel_running_job(self, tmp_path):
+        """测试取消运行中的任务，任务在下一次上报进度时停止"""
+        manager = JobManager(str(tmp_path / "jobs.db"), max_workers=1)
+        started = threading.Event()
+        release = threading.Event()
+        
+        def run(job):
+            started.set()
+            release.wait(5)
+            job.update(chunks_done=1)
+            return {'summary': '不应完成'}
+        
+        job_id = manager.submit('summary', run)
+        started.wait(5)
+        assert manager.cancel(job_id)
+        release.set()
+        job = manager.wait(job_id, timeout=5)
+        
+        assert job['status'] == 'cancelled'
+        assert job['result'] is None
+        assert not manager.cancel(job_id)
+        manager.close()
+    
+    def test_failed_job_records_error(self, tmp_path):
+        """测试任务异常时记录错误信息"""
+        manager = JobManager(str(tmp_path / "jobs.db"), max_workers=1)
+        
+        def run(job):
+            raise ValueError('文件格式错误')
+        
+        job = manager.wait(manager.submit('extract', run), timeout=5)
+        
+        assert job['status'] == 'failed'
+        assert job['error'] == '文件格式错误'
+        manager.close()
+    
+    def test_unfinished_jobs_marked_interrupted_after_restart(self, tmp_path):
+        """测试服务重启后，上次未完成的任务标记为中断"""
+        db_path = str(tmp_path / "jobs.db")
+        manager = JobManager(db_path, max_workers=1)
+        release = threading.Event()
+        job_id = manager.submit('scan', lambda job: release.wait(5) and {})
+        manager.conn.close()
+        manager._conn = None
+        
+        restarted = JobManager(db_path)
+        
+        assert restarted.get(job_id)['status'] == 'interrupted'
+        assert [job['job_id'] for job in restarted.list()] == [job_id]
+        release.set()
+        restarted.close()
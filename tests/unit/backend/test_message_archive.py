@@ -0,0 +1,237 @@
+import pytest
+import sqlite3
+import sys
+import os
+from unittest.mock import Mock
+
+# 添加src路径到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../../src/backend'))
+
+from message_archive import MessageArchive
+
+def _make_msg_db(db_path, count):
+    """创建只含文本消息的解密后微信MSG表"""
+    conn = sqlite3.connect(str(db_path))
+    conn.execute("CREATE TABLE MSG (localId INTEGER PRIMARY KEY, Type INT, SubType INT, IsSender INT, "
+                 "CreateTime INT, StrTalker TEXT, StrContent TEXT)")
+    conn.executemany(
+        "INSERT INTO MSG (Type, SubType, IsSender, CreateTime, StrTalker, StrContent) VALUES (1, 0, ?, ?, ?, ?)",
+        [(i % 2, 1706769000 + i * 60, 'wxid_zhang', f'消息{i}') for i in range(count)]
+    )
+    conn.commit()
+    conn.close()
+    return db_path
+
+class TestMessageArchive:
+    def setup_method(self):
+        """每个测试方法前的设置"""
+        self.extract_file = Mock(side_effect=lambda config: [
+            {'timestamp': '2024-02-01T14:30:00', 'sender': '客户A', 'message': '订单什么时候发货',
+             'type': 'text', 'source': 'wechat_text_export'},
+            {'timestamp': '2024-02-01T14:31:00', 'sender': '客服', 'message': '明天上午发货，单号稍后发您',
+             'type': 'text', 'source': 'wechat_text_export'},
+        ])
+        self.extract_many = lambda configs: ((config, self.extract_file(config)) for config in configs)
+    
+    def test_unchanged_file_is_not_reparsed(self, tmp_path):
+        """测试文件未变化时直接读取归档"""
+        chat_file = tmp_path / "chat.txt"
+        chat_file.write_text("聊天内容", encoding='utf-8')
+        archive = MessageArchive(str(tmp_path / "archive.db"))
+        config = {'file_path': str(chat_file), 'type': 'wechat'}
+        
+        first = archive.extract([config], self.extract_many)
+        second = archive.extract([config], self.extract_many)
+        
+        assert self.extract_file.call_count == 1
+        assert first == second
+        assert second[1]['message'] == '明天上午发货，单号稍后发您'
+        assert second[1]['source'] == 'wechat_text_export'
+    
+    def test_changed_file_is_reingested(self, tmp_path):
+        """测试文件内容变化后重新解析且不留下旧消息"""
+        chat_file = tmp_path / "chat.txt"
+        chat_file.write_text("聊天内容", encoding='utf-8')
+        archive = MessageArchive(str(tmp_path / "archive.db"))
+        config = {'file_path': str(chat_file), 'type': 'wechat'}
+        
+        archive.extract([config], self.extract_many)
+        chat_file.write_text("新的聊天内容", encoding='utf-8')
+        messages = archive.extract([config], self.extract_many)
+        
+        assert self.extract_file.call_count == 2
+        assert len(messages) == 2
+        assert archive.stats()['messages'] == 2
+    
+    def test_failed_parse_is_retried(self, tmp_path):
+        """测试解析失败的文件不记录为已导入，下次导入时重新解析"""
+        chat_file = tmp_path / "chat.txt"
+        chat_file.write_text("聊天内容", encoding='utf-8')
+        archive = MessageArchive(str(tmp_path / "archive.db"))
+        config = {'file_path': str(chat_file), 'type': 'wechat'}
+        
+        failed = archive.extract([config], lambda configs: ((c, None) for c in configs))
+        messages = archive.extract([config], self.extract_many)
+        
+        assert failed == []
+        assert self.extract_file.call_count == 1
+        assert len(messages) == 2
+    
+    def test_concurrent_first_import_not_duplicated(self, tmp_path):
+        """测试两个线程同时首次导入同一文件时，消息只归档一份"""
+        chat_file = tmp_path / "chat.txt"
+        chat_file.write_text("聊天内容", encoding='utf-8')
+        archive = MessageArchive(str(tmp_path / "archive.db"))
+        path = str(chat_file)
+        
+        # 两次检查都发生在任何一次写入之前，看到的都是尚未导入的状态
+        states = [archive._check_file(path, 'wechat') for _ in range(2)]
+        for state in states:
+            archive._store_file(state, self.extract_file({'file_path': path}))
+        
+        assert states[0]['file_id'] is None and states[1]['file_id'] is None
+        assert archive.stats()['messages'] == 2
+        assert len(archive.load_messages([path])) == 2
+    
+    def test_full_text_search(self, tmp_path):
+        """测试全文检索，包括少于3个字的中文关键词"""
+        chat_file = tmp_path / "chat.txt"
+        chat_file.write_text("聊天内容", encoding='utf-8')
+        archive = MessageArchive(str(tmp_path / "archive.db"))
+        archive.extract([{'file_path': str(chat_file)}], self.extract_many)
+        
+        assert [r['sender'] for r in archive.search('发货')] == ['客服', '客户A']
+        assert [r['sender'] for r in archive.search('单号稍后')] == ['客服']
+        assert archive.search('退款') == []
+    
+    def test_parallel_extraction_through_manager(self, tmp_path):
+        """测试多文件并行解析后写入归档"""
+        from chat_extractor_manager import ChatExtractorManager
+        
+        configs = []
+        for i in range(3):
+            chat_file = tmp_path / f"chat{i}.txt"
+            chat_file.write_text(
+                f"2024-02-0{i + 1} 10:00:00 客户{i}\n第一条\n2024-02-0{i + 1} 10:01:00 客服\n第二条\n",
+                encoding='utf-8')
+            configs.append({'file_path': str(chat_file), 'type': 'wechat'})
+        archive = MessageArchive(str(tmp_path / "archive.db"))
+        manager = ChatExtractorManager(archive=archive, max_workers=2)
+        
+        messages = manager.extract_from_files(configs)
+        
+        assert [msg['sender'] for msg in messages] == ['客户0', '客服', '客户1', '客服', '客户2', '客服']
+        assert messages[0]['source_file'] == configs[0]['file_path']
+        assert archive.stats()['files'] == 3
+    
+    def test_appended_file_parses_only_tail(self, tmp_path):
+        """测试导出文件只在末尾追加时只解析新增部分"""
+        from chat_extractor_manager import ChatExtractorManager
+        
+        chat_file = tmp_path / "chat.txt"
+        chat_file.write_text("2024-02-01 10:00:00 客户\n你好\n2024-02-01 10:01:00 客服\n您好\n", encoding='utf-8')
+        archive = MessageArchive(str(tmp_path / "archive.db"))
+        manager = ChatExtractorManager(archive=archive, max_workers=1)
+        config = {'file_path': str(chat_file), 'type': 'wechat'}
+        manager.extract_from_files([config])
+        
+        with open(chat_file, 'a', encoding='utf-8') as f:
+            f.write("2024-02-08 09:00:00 客户\n又来了\n")
+        extract = Mock(wraps=manager._extract_file)
+        manager._extract_file = extract
+        messages = manager.extract_from_files([config])
+        
+        assert extract.call_args[0][0]['offset'] > 0
+        assert [msg['message'] for msg in messages] == ['你好', '您好', '又来了']
+        assert archive.stats()['messages'] == 3
+    
+    def test_append_after_unterminated_last_message(self, tmp_path):
+        """测试文件末尾没有换行、最后两条消息时间相同时，增量导入不丢失消息"""
+        from chat_extractor_manager import ChatExtractorManager
+        
+        chat_file = tmp_path / "chat.txt"
+        chat_file.write_text("2024-02-01 10:00:00 客户\n第一\n2024-02-01 10:01:00 客服\n第二\n"
+                             "2024-02-01 10:01:00 客服\n第三", encoding='utf-8')
+        archive = MessageArchive(str(tmp_path / "archive.db"))
+        manager = ChatExtractorManager(archive=archive, max_workers=1)
+        config = {'file_path': str(chat_file), 'type': 'wechat'}
+        manager.extract_from_files([config])
+        
+        with open(chat_file, 'a', encoding='utf-8') as f:
+            f.write("\n2024-02-01 10:02:00 客户\n第四\n")
+        messages = manager.extract_from_files([config])
+        full = ChatExtractorManager(max_workers=1).extract_from_files([config])
+        
+        assert [msg['message'] for msg in messages] == [msg['message'] for msg in full]
+        assert [msg['message'] for msg in messages] == ['第一', '第二', '第三', '第四']
+        assert archive.stats()['messages'] == 4
+    
+    def test_modified_prefix_falls_back_to_full_parse(self, tmp_path):
+        """测试已归档部分被修改时回退为完整解析"""
+        from chat_extractor_manager import ChatExtractorManager
+        
+        chat_file = tmp_path / "chat.txt"
+        chat_file.write_text("2024-02-01 10:00:00 客户\n你好\n2024-02-01 10:01:00 客服\n您好\n", encoding='utf-8')
+        archive = MessageArchive(str(tmp_path / "archive.db"))
+        manager = ChatExtractorManager(archive=archive, max_workers=1)
+        config = {'file_path': str(chat_file), 'type': 'wechat'}
+        manager.extract_from_files([config])
+        
+        chat_file.write_text("2024-02-01 10:00:00 客户\n在吗\n2024-02-01 10:01:00 客服\n您好\n"
+                             "2024-02-08 09:00:00 客户\n又来了\n", encoding='utf-8')
+        messages = manager.extract_from_files([config])
+        
+        assert [msg['message'] for msg in messages] == ['在吗', '您好', '又来了']
+        assert archive.stats()['messages'] == 3
+    
+    def test_decrypted_database_streamed_into_archive(self, tmp_path):
+        """测试已解密的微信数据库逐条读取后写入归档，未变化时不再读取"""
+        from chat_extractor_manager import ChatExtractorManager
+        
+        db_path = _make_msg_db(tmp_path / "MSG0.db", 4)
+        archive = MessageArchive(str(tmp_path / "archive.db"))
+        manager = ChatExtractorManager(archive=archive)
+        config = {'file_path': str(db_path), 'type': 'wechat_db'}
+        progress = Mock()
+        
+        messages = manager.extract_from_files([config], progress=progress)
+        
+        assert [msg['message'] for msg in messages] == [f'消息{i}' for i in range(4)]
+        assert messages[0]['detected_type'] == 'wechat_db'
+        progress.assert_called_once_with(config, 4)
+        assert archive.stats()['messages'] == 4
+        
+        manager.wechat_extractor.iter_database_messages = Mock()
+        assert len(manager.extract_from_files([config])) == 4
+        manager.wechat_extractor.iter_database_messages.assert_not_called()
+    
+    def test_iter_file_messages_in_time_order(self, tmp_path):
+        """测试分批按时间顺序读取单个文件的归档消息，批次边界处不重复也不遗漏"""
+        chat_file = tmp_path / "chat.txt"
+        chat_file.write_text("聊天内容", encoding='utf-8')
+        archive = MessageArchive(str(tmp_path / "archive.db"))
+        timestamps = ['2024-02-01T10:02:00', '2024-02-01T10:00:00', '2024-02-01T10:01:00', '2024-02-01T10:01:00', None]
+        extract_many = lambda configs: ((c, [{'timestamp': t, 'sender': '客户', 'message': f'消息{i}'}
+                                             for i, t in enumerate(timestamps)]) for c in configs)
+        paths = archive.ingest([{'file_path': str(chat_file), 'type': 'wechat'}], extract_many)
+        
+        messages = list(archive.iter_file_messages(paths[0], batch_size=2))
+        
+        assert [msg['message'] for msg in messages] == ['消息4', '消息1', '消息2', '消息3', '消息0']
+    
+    def test_cancelled_job_stops_database_import(self, tmp_path):
+        """测试进度回调中抛出的任务取消不会被当作单个文件的写入失败，导入直接中止"""
+        from chat_extractor_manager import ChatExtractorManager
+        from job_queue import JobCancelled
+        
+        archive = MessageArchive(str(tmp_path / "archive.db"))
+        manager = ChatExtractorManager(archive=archive)
+        configs = [{'file_path': str(_make_msg_db(tmp_path / f"MSG{i}.db", 3)), 'type': 'wechat_db'} for i in range(2)]
+        progress = Mock(side_effect=JobCancelled())
+        
+        with pytest.raises(JobCancelled):
+            manager.extract_from_files(configs, progress=progress)
+        
+        progress.assert_called_once()
+        assert archive.stats()['files'] == 0
+        assert archive.stats()['messages'] == 0
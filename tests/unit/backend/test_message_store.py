@@ -0,0 +1,94 @@
+import pytest
+import sys
+import os
+from datetime import datetime
+
+# 添加src路径到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../../src/backend'))
+
+from message_store import MessageStore, iso_formatter, to_epoch
+
+class TestMessageStore:
+    def setup_method(self):
+        """每个测试方法前的设置"""
+        self.store = MessageStore.from_messages([
+            {'timestamp': '2024-02-01T14:30:00', 'sender': '用户A', 'content': '你好'},
+            {'timestamp': datetime(2024, 2, 1, 14, 31), 'sender': '用户B', 'content': '订单已发货'},
+            {'timestamp': '2024-02-01T14:32:00', 'sender': '用户A', 'content': '收到，谢谢', 'source': 'qq'},
+        ])
+    
+    def test_round_trip_records(self):
+        """测试消息写入后能完整还原"""
+        records = self.store.to_records()
+        
+        assert len(self.store) == 3
+        assert records[1] == {'timestamp': '2024-02-01T14:31:00', 'sender': '用户B', 'content': '订单已发货'}
+        assert records[2]['source'] == 'qq'
+        assert 'source' not in records[0]
+    
+    def test_senders_are_interned(self):
+        """测试发送者只保存一份"""
+        assert self.store.get_contacts() == ['用户A', '用户B']
+        assert list(self.store.sender_ids) == [0, 1, 0]
+    
+    def test_filter_by_time_and_sender(self):
+        """测试按时间和发送者筛选"""
+        rows = self.store.filter(datetime(2024, 2, 1, 14, 30), datetime(2024, 2, 1, 14, 31))
+        assert rows == [0, 1]
+        
+        rows = self.store.filter(datetime(2024, 2, 1, 14, 30), datetime(2024, 2, 1, 14, 32), '用户A')
+        assert rows == [0, 2]
+        assert self.store.filter(sender='不存在') == []
+    
+    def test_index_on_unsorted_store(self):
+        """测试乱序消息上的索引查询仍按原顺序返回行号"""
+        store = MessageStore.from_messages([
+            {'timestamp': '2024-02-01T15:00:00', 'sender': '用户A', 'content': '3'},
+            {'timestamp': '2024-02-01T14:00:00', 'sender': '用户B', 'content': '1'},
+            {'timestamp': '2024-02-01T14:30:00', 'sender': '用户A', 'content': '2'},
+            {'timestamp': '2024-02-01T16:00:00', 'sender': '用户A', 'content': '4'},
+        ])
+        
+        assert not store.index.is_time_sorted
+        assert store.filter(datetime(2024, 2, 1, 14, 10), datetime(2024, 2, 1, 15, 0)) == [0, 2]
+        assert store.filter(datetime(2024, 2, 1, 14, 0), datetime(2024, 2, 1, 15, 0), '用户A') == [0, 2]
+        
+        # 追加消息后索引重新建立
+        store.append(datetime(2024, 2, 1, 14, 45), '用户A', '5')
+        assert store.filter(sender='用户A') == [0, 2, 3, 4]
+    
+    def test_iso_formatter_matches_isoformat(self):
+        """测试批量时间戳格式化与datetime.isoformat()一致"""
+        format_timestamp = iso_formatter()
+        for value in (datetime(2024, 2, 1, 14, 30, 5), datetime(1999, 12, 31, 23, 59, 59),
+                      datetime(1960, 1, 1, 0, 0, 1), datetime(2024, 2, 1, 0, 0)):
+            assert format_timestamp(to_epoch(value)) == value.isoformat()
+    
+    def test_integer_extras_stored_without_interning(self):
+        """测试整数字段直接按列保存，出现其他类型时转为驻留列，1与True不会被合并"""
+        store = MessageStore()
+        for i in range(100):
+            store.append(1706797800 + i, '用户A', f'消息{i}', local_id=i + 1, type='text')
+        store.append(1706797900, '用户A', '没有编号')
+        store.append(1706797901, '用户A', '布尔值', local_id=True)
+        store.append(1706797902, '用户A', '整数', local_id=1)
+        
+        records = store.to_records()
+        
+        assert [msg['local_id'] for msg in records[:100]] == list(range(1, 101))
+        assert 'local_id' not in records[100]
+        assert records[101]['local_id'] is True
+        assert type(records[102]['local_id']) is int
+        assert store.take([0, 101]).to_records()[1]['local_id'] is True
+        # 'text'、转换后的100个编号和True，最后的1与第一行的编号相同
+        assert len(store._values) == 102
+    
+    def test_nbytes_counts_intern_tables(self):
+        """测试内存估算包含驻留表中的取值"""
+        plain = MessageStore()
+        tagged = MessageStore()
+        for i in range(1000):
+            plain.append(1706797800 + i, '用户A', '消息')
+            tagged.append(1706797800 + i, '用户A', '消息', msg_id=f'id-{i}')
+        
+        assert tagged.nbytes - plain.nbytes > 1000 * (sys.getsizeof('id-0') + 4)
@@ -65,4 +65,73 @@ class TestChatParser:
     def test_parse_empty_content(self):
         """测试空内容处理"""
         with pytest.raises(ValueError, match="聊天内容不能为空"):
-            self.parser.parse_chat_content("")
\ No newline at end of file
+            self.parser.parse_chat_content("")
+    
+    def test_iter_messages_across_chunk_boundaries(self, tmp_path):
+        """测试流式解析时跨块的记录能被正确拼接"""
+        lines = [f"[2024/2/1 14:{i:02d}:00] 用户{i % 3}: 第{i}条消息内容" for i in range(50)]
+        chat_file = tmp_path / "wechat.txt"
+        chat_file.write_text("\n".join(lines) + "\n", encoding='utf-8')
+
+        parser = ChatParser(file_path=str(chat_file))
+        messages = list(parser.iter_messages(chunk_size=37))
+
+        assert len(messages) == 50
+        assert messages[17]['content'] == '第17条消息内容'
+        assert messages[49]['timestamp'] == datetime(2024, 2, 1, 14, 49)
+        assert set(parser.get_contacts()) == {'用户0', '用户1', '用户2'}
+        # 流式解析不会读取完整文件内容
+        assert parser._raw_text is None
+
+    def test_auto_detect_uses_head_sample(self, tmp_path):
+        """测试格式检测只依赖文件开头的片段"""
+        chat_file = tmp_path / "qq.txt"
+        chat_file.write_text("2024-02-01 14:30:00 用户A: 你好\n2024-02-01 14:31:00 用户B: 在的\n", encoding='utf-8')
+
+        parser = ChatParser(file_path=str(chat_file))
+        assert parser.detect_format() == 'qq'
+
+        df = parser.auto_detect_and_parse()
+        assert len(df) == 2
+        assert list(df['sender']) == ['用户A', '用户B']
+
+    def test_parse_to_store_falls_back_when_head_undetected(self, tmp_path):
+        """测试文件开头无法判断格式时，列式存储与DataFrame两种入口都会依次尝试两种格式"""
+        chat_file = tmp_path / "qq.txt"
+        preamble = "聊天记录导出说明\n" * 600
+        chat_file.write_text(preamble + "2024-02-01 14:30:00 用户A: 你好\n2024-02-01 14:31:00 用户B: 在的\n",
+                             encoding='utf-8')
+
+        parser = ChatParser(file_path=str(chat_file))
+        assert parser.detect_format() is None
+
+        store = parser.parse_to_store()
+        assert len(store) == 2
+        assert len(ChatParser(file_path=str(chat_file)).auto_detect_and_parse()) == 2
+
+    def test_fallback_when_detected_format_parses_nothing(self, tmp_path):
+        """测试文件开头像微信格式但实际是QQ记录时，仍会按QQ格式解析"""
+        chat_file = tmp_path / "qq.txt"
+        chat_file.write_text("备份于 [2024/2/1]\n2024-02-01 14:30:00 用户A: 你好\n2024-02-01 14:31:00 用户B: 在的\n",
+                             encoding='utf-8')
+
+        parser = ChatParser(file_path=str(chat_file))
+        assert parser.detect_format() == 'wechat'
+
+        assert [msg['content'] for msg in parser.parse_to_store().iter_records()] == ['你好', '在的']
+        assert len(ChatParser(file_path=str(chat_file)).auto_detect_and_parse()) == 2
+
+    def test_format_for_ai_store_and_dataframe(self):
+        """测试MessageStore和DataFrame格式化结果一致，并支持长度上限"""
+        from message_store import MessageStore
+
+        messages = [
+            {'timestamp': datetime(2024, 2, 1, 14, 30, 5), 'sender': '用户A', 'content': '你好'},
+            {'timestamp': datetime(2024, 2, 1, 14, 31, 0), 'sender': '用户B', 'content': '在的'},
+        ]
+        store = MessageStore.from_messages(messages)
+        expected = "[2024-02-01 14:30:05] 用户A: 你好\n[2024-02-01 14:31:00] 用户B: 在的\n"
+
+        assert self.parser.format_for_ai(store) == expected
+        assert self.parser.format_for_ai(store.to_dataframe()) == expected
+        assert self.parser.format_for_ai(store, max_chars=len(expected) - 1) == expected.splitlines(True)[0]
@@ -0,0 +1,66 @@
+import pytest
+import sys
+import os
+
+# 添加src路径到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../../src/backend'))
+
+from privacy_manager import PrivacyManager
+
+class TestPrivacyManager:
+    def setup_method(self):
+        """每个测试方法前的设置"""
+        self.privacy_manager = PrivacyManager()
+    
+    def test_anonymize_content(self):
+        """测试单次扫描脱敏各类敏感信息"""
+        content = "电话13812345678，邮箱 test@example.com，身份证110101199003077777，微信wxid_abc123"
+        
+        result = self.privacy_manager._anonymize_content(content)
+        
+        assert result == "电话[PHONE]，邮箱 [EMAIL]，身份证[ID_CARD]，微信[WECHAT_ID]"
+    
+    def test_plain_message_unchanged(self):
+        """测试不含敏感字符的消息原样返回"""
+        assert self.privacy_manager._anonymize_content("好的，明天见") == "好的，明天见"
+    
+    def test_anonymize_messages(self):
+        """测试批量脱敏时发送者映射保持一致"""
+        messages = [
+            {'sender': '张三', 'message': '我的QQ是123456789', 'sender_qq': '123456789'},
+            {'sender': '李四', 'message': '收到'},
+            {'sender': '张三', 'message': '寄到浙江省杭州市西湖区文三路'},
+        ]
+        
+        result = self.privacy_manager.anonymize_messages(messages)
+        
+        assert [msg['sender'] for msg in result] == ['用户1', '用户2', '用户1']
+        assert result[0]['message'] == '我的QQ是[QQ_NUMBER]'
+        assert result[0]['sender_qq'] == '***'
+        assert result[2]['message'] == '[ADDRESS]'
+        assert messages[0]['sender'] == '张三'
+    
+    def test_parallel_anonymize_matches_serial(self):
+        """测试多进程脱敏与单进程结果一致，发送者编号跨分片保持一致"""
+        messages = [
+            {'sender': f'客户{i % 7}', 'message': f'订单{i}，电话1381234{i:04d}' if i % 2 else '好的'}
+            for i in range(3000)
+        ]
+        
+        serial = self.privacy_manager.anonymize_messages(messages, parallel_threshold=0)
+        parallel = self.privacy_manager.anonymize_messages(messages, parallel_threshold=1, max_workers=2)
+        
+        assert parallel == serial
+        assert parallel[2999]['sender'] == parallel[3]['sender']
+    
+    def test_parallel_anonymize_reuses_shared_pool(self):
+        """测试多次并行脱敏复用同一个进程池，不在每次调用时新建"""
+        import process_pool
+        contents = [f'电话1381234{i:04d}' for i in range(3000)]
+        
+        first = self.privacy_manager.anonymize_contents_parallel(contents, max_workers=2)
+        pool = process_pool.get_pool()
+        second = self.privacy_manager.anonymize_contents_parallel(contents, max_workers=2)
+        
+        assert first == second == ['电话[PHONE]'] * 3000
+        assert process_pool.get_pool() is pool
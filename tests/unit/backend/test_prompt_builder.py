@@ -0,0 +1,72 @@
+import pytest
+import sys
+import os
+from datetime import datetime, timedelta
+
+# 添加src路径到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../../src/backend'))
+
+from message_store import MessageStore
+from prompt_builder import PromptBuilder
+
+class TestPromptBuilder:
+    def setup_method(self):
+        """每个测试方法前的设置"""
+        contents = [
+            '在吗',
+            '我想买这款鞋，价格多少',
+            '嗯嗯',
+            '299元，今天下单明天发货',
+            '👍',
+            '随便聊聊今天天气真不错呀',
+            '好的，订单号 SO20240201',
+        ]
+        start = datetime(2024, 2, 1, 14, 0)
+        self.store = MessageStore()
+        for i, content in enumerate(contents):
+            self.store.append(start + timedelta(minutes=i), '客户' if i % 2 == 0 else '客服', content)
+    
+    def test_chatter_is_dropped(self):
+        """测试寒暄和纯表情被去掉，带关键信息的"好的"保留"""
+        rows, stats = PromptBuilder(budget_tokens=0).select(self.store)
+        
+        assert rows == [1, 3, 5, 6]
+        assert stats['dropped_chatter'] == 3
+        assert stats['dropped_over_budget'] == 0
+    
+    def test_budget_keeps_salient_messages(self):
+        """测试超出预算时优先保留价格、订单等信息"""
+        builder = PromptBuilder(budget_tokens=60)
+        
+        rows, stats = builder.select(self.store)
+        
+        assert 5 not in rows
+        assert 3 in rows
+        assert rows == sorted(rows)
+        assert stats['kept_tokens'] <= 60
+        assert stats['dropped_over_budget'] == 4 - len(rows)
+    
+    def test_query_terms_raise_salience(self):
+        """测试查询关键词命中的消息优先保留"""
+        rows, _ = PromptBuilder(budget_tokens=30).select(self.store, query='天气')
+        
+        assert rows == [5]
+    
+    def test_unsegmented_chinese_query_matches(self):
+        """测试没有空格分隔的中文问题按二元组部分匹配也能提高得分"""
+        terms = PromptBuilder.query_terms('合同细节是什么')
+        
+        assert PromptBuilder.salience('我们讨论合同的细节', terms) > PromptBuilder.salience('我们讨论合同的细节', []) + 3
+        assert PromptBuilder.salience('今天天气不错', terms) == PromptBuilder.salience('今天天气不错', [])
+    
+    def test_long_emoji_line_is_chatter(self):
+        """测试较长的纯表情刷屏不因长度加分而保留"""
+        store = MessageStore()
+        store.append(datetime(2024, 2, 1, 14, 0), '客户', '😂' * 20)
+        store.append(datetime(2024, 2, 1, 14, 1), '客户', '[微笑][微笑][微笑][微笑]！！')
+        store.append(datetime(2024, 2, 1, 14, 2), '客户', '随便聊聊今天天气真不错呀')
+        
+        rows, stats = PromptBuilder(budget_tokens=0).select(store)
+        
+        assert rows == [2]
+        assert stats['dropped_chatter'] == 2
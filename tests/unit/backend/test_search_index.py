@@ -0,0 +1,69 @@
+import pytest
+import sys
+import os
+from datetime import datetime, timedelta
+
+# 添加src路径到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../../src/backend'))
+
+from message_store import MessageStore
+from search_index import SearchIndex, get_search_index
+
+class TestSearchIndex:
+    def setup_method(self):
+        """每个测试方法前的设置"""
+        contents = [
+            '你好，在吗',
+            '我想问下订单 SO20240201 什么时候发货',
+            '稍等我查一下',
+            '明天上午发货',
+            '好的谢谢',
+            '另外还想再买两件',
+        ]
+        start = datetime(2024, 2, 1, 14, 0)
+        self.store = MessageStore()
+        for i, content in enumerate(contents):
+            self.store.append(start + timedelta(minutes=i), '客户' if i % 2 == 0 else '客服', content)
+        self.index = SearchIndex(self.store)
+    
+    def test_search_chinese_keyword(self):
+        """测试中文关键词检索"""
+        hits = self.index.search('发货', context=1)
+        
+        assert [hit['id'] for hit in hits] == [3, 1]
+        assert [item['content'] for item in hits[0]['context']] == ['稍等我查一下', '好的谢谢']
+    
+    def test_search_order_number_case_insensitive(self):
+        """测试订单号检索且不区分大小写"""
+        assert [hit['id'] for hit in self.index.search('so20240201')] == [1]
+        assert self.index.search('SO20249999') == []
+    
+    def test_multiple_terms_rank_higher(self):
+        """测试同时命中多个关键词的消息排在前面"""
+        hits = self.index.search('订单 发货')
+        assert hits[0]['id'] == 1
+    
+    def test_relevant_rows_with_context(self):
+        """测试相关行号包含上下文且限定在筛选范围内"""
+        assert self.index.relevant_rows('发货', context=1) == [0, 1, 2, 3, 4]
+        assert self.index.relevant_rows('发货', context=0, rows=[2, 3]) == [3]
+    
+    def test_context_stays_within_filtered_rows(self):
+        """测试指定筛选范围时上下文只取范围内的相邻消息"""
+        # 客服发送的消息为第1、3、5行
+        assert self.index.relevant_rows('发货', context=1, rows=[1, 3, 5]) == [1, 3, 5]
+        assert self.index.relevant_rows('订单', context=1, rows=[1, 3]) == [1, 3]
+        
+        hits = self.index.search('明天', context=1, rows=[1, 3, 5])
+        assert [item['content'] for item in hits[0]['context']] == [
+            '我想问下订单 SO20240201 什么时候发货', '另外还想再买两件']
+    
+    def test_index_cached_per_store(self):
+        """测试同一份数据复用索引，追加消息后重建"""
+        index = get_search_index(self.store)
+        assert get_search_index(self.store) is index
+        
+        self.store.append(datetime(2024, 2, 1, 15, 0), '客户', '已经发货了吗')
+        rebuilt = get_search_index(self.store)
+        assert rebuilt is not index
+        assert 6 in rebuilt.relevant_rows('发货', context=0)
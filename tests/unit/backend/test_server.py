@@ -3,6 +3,7 @@ import json
 import sys
 import os
 from unittest.mock import patch, Mock
+from datetime import datetime
 
 # 添加src路径到Python路径
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../../src/backend'))
@@ -87,4 +88,187 @@ class TestServerAPI:
                              json=test_data,
                              content_type='application/json')
         
-        assert response.status_code == 400
\ No newline at end of file
+        assert response.status_code == 400
+    
+    def test_filter_chat_by_chat_id(self, client, tmp_path):
+        """测试加载后通过chat_id筛选，无需重新上传聊天数据"""
+        chat_file = tmp_path / "chat.txt"
+        chat_file.write_text("[2024/2/1 14:30:00] 用户A: 你好\n[2024/2/1 14:31:00] 用户B: 订单已发货\n",
+                             encoding='utf-8')
+        
+        response = client.post('/api/load-chat', json={'file_path': str(chat_file)})
+        chat_id = json.loads(response.data)['chat_id']
+        
+        response = client.post('/api/filter-chat', json={'chat_id': chat_id, 'sender': '用户B'})
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert [item['content'] for item in data['filtered_data']] == ['订单已发货']
+    
+    def test_load_chat_paginated(self, client, tmp_path):
+        """测试首屏只返回第一页，后续按游标分页获取"""
+        chat_file = tmp_path / "chat.txt"
+        chat_file.write_text("".join(f"[2024/2/1 14:{i:02d}:00] 用户A: 消息{i}\n" for i in range(5)),
+                             encoding='utf-8')
+        
+        response = client.post('/api/load-chat', json={'file_path': str(chat_file), 'limit': 2})
+        data = json.loads(response.data)
+        assert [item['content'] for item in data['chat_data']] == ['消息0', '消息1']
+        assert data['total'] == 5
+        
+        contents = []
+        cursor = data['next_cursor']
+        while cursor is not None:
+            response = client.get(f"/api/chat/{data['chat_id']}/messages?after={cursor}&limit=2")
+            page = json.loads(response.data)
+            contents.extend(item['content'] for item in page['chat_data'])
+            cursor = page['next_cursor']
+        assert contents == ['消息2', '消息3', '消息4']
+    
+    def test_invalid_integer_params_return_400(self, client, tmp_path):
+        """测试分页等整数参数无效时返回400而不是500"""
+        chat_file = tmp_path / "chat.txt"
+        chat_file.write_text("[2024/2/1 14:30:00] 用户A: 你好\n", encoding='utf-8')
+        
+        response = client.post('/api/load-chat', json={'file_path': str(chat_file), 'limit': 'abc'})
+        assert response.status_code == 400
+        assert 'limit' in response.get_json()['error']
+        
+        chat_id = client.post('/api/load-chat', json={'file_path': str(chat_file)}).get_json()['chat_id']
+        assert client.get(f'/api/chat/{chat_id}/messages?after=x').status_code == 400
+        assert client.get('/api/jobs?limit=abc').status_code == 400
+        assert client.post('/api/search-chat', json={'chat_id': chat_id, 'query': '你好', 'context': 'a'}).status_code == 400
+    
+    def test_json_provider_keeps_flask_output(self, client):
+        """测试替换JSON序列化后输出格式与Flask默认实现一致"""
+        from flask.json.provider import DefaultJSONProvider
+        
+        payload = {'b': [1, 2.5, None], 'a': '中文', 'time': datetime(2024, 2, 1, 14, 30)}
+        assert json.loads(app.json.dumps(payload)) == json.loads(DefaultJSONProvider(app).dumps(payload))
+    
+    @patch('ai_engine.QwenAI.generate_summary')
+    def test_generate_summary_skips_chatter(self, mock_generate, client):
+        """测试发送给模型前去掉寒暄内容并返回挑选统计"""
+        mock_generate.return_value = "摘要"
+        chat_data = [
+            {'timestamp': '2024-02-01T14:30:00', 'sender': '用户A', 'content': '订单什么时候发货'},
+            {'timestamp': '2024-02-01T14:31:00', 'sender': '用户B', 'content': '好的'},
+            {'timestamp': '2024-02-01T14:32:00', 'sender': '用户B', 'content': '😊😊'},
+            {'timestamp': '2024-02-01T14:33:00', 'sender': '用户B', 'content': '明天上午发货'},
+        ]
+        
+        response = client.post('/api/generate-summary', json={'chat_data': chat_data})
+        
+        data = json.loads(response.data)
+        assert data['prompt_stats']['dropped_chatter'] == 2
+        prompt_text = mock_generate.call_args[0][0]
+        assert '订单什么时候发货' in prompt_text and '明天上午发货' in prompt_text
+        assert '好的' not in prompt_text
+    
+    @patch('ai_engine.QwenAI.generate_summary')
+    def test_summary_job(self, mock_generate, client, tmp_path):
+        """测试以后台任务生成摘要并查询结果"""
+        from job_queue import JobManager
+        mock_generate.return_value = "订单明天发货"
+        chat_data = [{'timestamp': '2024-02-01T14:30:00', 'sender': '用户A', 'content': '订单什么时候发货'}]
+        job_manager = JobManager(str(tmp_path / "jobs.db"), max_workers=1)
+        
+        with patch('server.job_manager', job_manager):
+            response = client.post('/api/jobs', json={'type': 'summary', 'chat_data': chat_data})
+            assert response.status_code == 202
+            job_id = json.loads(response.data)['job_id']
+            job_manager.wait(job_id, timeout=5)
+            
+            data = json.loads(client.get(f'/api/jobs/{job_id}').data)
+        assert data['status'] == 'succeeded'
+        assert data['result']['summary'] == "订单明天发货"
+        assert data['progress']['chunks_done'] == 1
+    
+    def test_extract_job(self, client, tmp_path):
+        """测试以后台任务提取多个文件，结果按时间归并后写入会话缓存"""
+        from job_queue import JobManager
+        from chat_extractor_manager import ChatExtractorManager
+        file_configs = []
+        for i in range(2):
+            chat_file = tmp_path / f"chat{i}.txt"
+            chat_file.write_text(f"2024-02-01 14:3{i}:00 客户{i}\n消息{i}\n2024-02-01 14:3{i + 2}:00 客服\n回复{i}\n",
+                                 encoding='utf-8')
+            file_configs.append({'file_path': str(chat_file), 'type': 'wechat'})
+        job_manager = JobManager(str(tmp_path / "jobs.db"), max_workers=1)
+        
+        with patch('server.job_manager', job_manager), \
+                patch('server.extractor_manager', ChatExtractorManager(max_workers=1)), \
+                patch('server.privacy_manager.has_valid_consent', return_value=True):
+            response = client.post('/api/jobs', json={'type': 'extract', 'config': {'file_configs': file_configs}})
+            assert response.status_code == 202
+            job_id = json.loads(response.data)['job_id']
+            job_manager.wait(job_id, timeout=5)
+            
+            data = json.loads(client.get(f'/api/jobs/{job_id}').data)
+            assert data['status'] == 'succeeded'
+            page = json.loads(client.get(f"/api/chat/{data['result']['chat_id']}/messages").data)
+        assert data['result']['message_count'] == 4
+        assert data['progress']['files_parsed'] == 2 and data['progress']['messages_parsed'] == 4
+        assert [msg['message'] for msg in page['chat_data']] == ['消息0', '消息1', '回复0', '回复1']
+    
+    def test_heavy_endpoints_return_503_when_busy(self, client):
+        """测试耗时接口并发已满时返回503，健康检查不受影响"""
+        import threading
+        
+        with patch('server.heavy_requests', threading.BoundedSemaphore(1)) as semaphore:
+            semaphore.acquire()
+            response = client.post('/api/load-chat', json={'file_path': './nonexistent.txt'})
+            assert response.status_code == 503
+            assert response.headers['Retry-After'] == '1'
+            assert client.get('/api/health').status_code == 200
+            
+            semaphore.release()
+            response = client.post('/api/load-chat', json={'file_path': './nonexistent.txt'})
+            assert response.status_code == 404
+            # 请求结束后名额已归还
+            assert semaphore.acquire(blocking=False)
+    
+    def test_scan_directory_stream(self, client, tmp_path):
+        """测试以NDJSON流式返回扫描结果，并支持深度限制和忽略规则"""
+        from directory_scanner import DirectoryScanner
+        import server
+        (tmp_path / "export" / "nested").mkdir(parents=True)
+        (tmp_path / "export" / "a.txt").write_text('a', encoding='utf-8')
+        (tmp_path / "export" / "skip.log").write_text('b', encoding='utf-8')
+        (tmp_path / "export" / "image.png").write_bytes(b'')
+        (tmp_path / "export" / "nested" / "b.csv").write_text('c', encoding='utf-8')
+        scanner = DirectoryScanner(server.export_scanner.match, cache_path=str(tmp_path / "scan.json"))
+        
+        with patch.object(server, 'export_scanner', scanner):
+            response = client.post('/api/scan-directory', json={
+                'directory_path': str(tmp_path / "export"), 'stream': True, 'ignore': ['skip*']
+            })
+            lines = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+            
+            shallow = client.post('/api/scan-directory', json={
+                'directory_path': str(tmp_path / "export"), 'max_depth': 0
+            }).get_json()
+        
+        assert response.mimetype == 'application/x-ndjson'
+        assert sorted(line['name'] for line in lines[:-1]) == ['a.txt', 'b.csv']
+        assert lines[-1]['done'] is True and lines[-1]['file_count'] == 2
+        assert sorted(f['name'] for f in shallow['data']['files']) == ['a.txt', 'skip.log']
+        assert (tmp_path / "scan.json").exists()
+    
+    def test_filter_chat_unknown_chat_id(self, client):
+        """测试会话不存在时返回404"""
+        response = client.post('/api/filter-chat', json={'chat_id': 'missing'})
+        assert response.status_code == 404
+    
+    @patch('ai_engine.QwenAI.stream_summary')
+    def test_generate_summary_stream(self, mock_stream, client):
+        """测试流式摘要以SSE逐段返回"""
+        mock_stream.return_value = iter(["订单", "已发货"])
+        
+        test_data = {'chat_data': [{'timestamp': '2024-02-01T14:30:00', 'sender': '用户A', 'content': '发货了吗'}]}
+        response = client.post('/api/generate-summary-stream', json=test_data)
+        
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        body = response.get_data(as_text=True)
+        assert 'data: {"delta": "订单"}' in body
+        assert 'event: done\ndata: {"summary": "订单已发货", "prompt_stats": {' in body
@@ -0,0 +1,57 @@
+import pytest
+import sys
+import os
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+# 添加src路径到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../../src/backend'))
+
+from message_store import MessageStore
+from summarizer import HierarchicalSummarizer
+
+def build_store(conversations, messages_per_conversation=10):
+    """构造多轮对话，每轮之间间隔一天"""
+    store = MessageStore()
+    start = datetime(2024, 2, 1, 9, 0)
+    for c in range(conversations):
+        for m in range(messages_per_conversation):
+            timestamp = start + timedelta(days=c, minutes=m)
+            store.append(timestamp, f'用户{m % 2}', f'第{c}轮对话的第{m}条消息，订单数量{m}件')
+    return store
+
+class TestHierarchicalSummarizer:
+    def setup_method(self):
+        """每个测试方法前的设置"""
+        self.ai_engine = Mock()
+        self.ai_engine.generate_summary.return_value = "完整摘要"
+        self.ai_engine.summarize_window.side_effect = lambda text, index, total, query=None: f"第{index}段摘要"
+        self.ai_engine.merge_summaries.side_effect = lambda partials, query=None: "合并:" + "|".join(partials)
+    
+    def test_small_chat_single_call(self):
+        """测试未超出预算时只调用一次"""
+        summarizer = HierarchicalSummarizer(self.ai_engine, window_tokens=10000)
+        
+        assert summarizer.summarize(build_store(2), '发货时间') == "完整摘要"
+        self.ai_engine.summarize_window.assert_not_called()
+    
+    def test_windows_split_on_conversation_boundaries(self):
+        """测试窗口在对话边界处切分且不超出预算"""
+        store = build_store(6)
+        summarizer = HierarchicalSummarizer(self.ai_engine, window_tokens=700)
+        
+        windows = summarizer.split_windows(store)
+        
+        assert len(windows) > 1
+        assert sum(len(rows) for rows in windows) == len(store)
+        for rows in windows:
+            assert len(rows) % 10 == 0
+    
+    def test_map_reduce(self):
+        """测试分段总结后合并"""
+        summarizer = HierarchicalSummarizer(self.ai_engine, window_tokens=700, max_workers=2)
+        
+        result = summarizer.summarize(build_store(6), '发货时间')
+        
+        assert result.startswith("合并:第1段摘要")
+        self.ai_engine.generate_summary.assert_not_called()
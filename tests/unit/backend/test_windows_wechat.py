@@ -0,0 +1,109 @@
+import pytest
+import sqlite3
+import sys
+import os
+from datetime import datetime
+
+# 添加src路径到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../../src/backend'))
+
+from windows_wechat import WindowsWeChatExtractor
+from message_store import MessageStore
+
+# 与解密后的MSG0.db相同的表结构（省略了与解析无关的字段）
+MSG_SCHEMA = """
+CREATE TABLE MSG (
+    localId INTEGER PRIMARY KEY AUTOINCREMENT,
+    TalkerId INT DEFAULT 0,
+    MsgSvrID INT,
+    Type INT,
+    SubType INT,
+    IsSender INT,
+    CreateTime INT,
+    Sequence INT DEFAULT 0,
+    StrTalker TEXT,
+    StrContent TEXT,
+    DisplayContent TEXT,
+    CompressContent BLOB,
+    BytesExtra BLOB
+);
+CREATE INDEX MSG_CREATETIME ON MSG(CreateTime);
+"""
+
+class TestWindowsWeChatExtractor:
+    def setup_method(self):
+        """每个测试方法前的设置"""
+        self.extractor = WindowsWeChatExtractor()
+        self.base_time = int(datetime(2024, 1, 1, 12, 0, 0).timestamp())
+
+    def _make_db(self, path, rows):
+        conn = sqlite3.connect(str(path))
+        conn.executescript(MSG_SCHEMA)
+        conn.executemany(
+            "INSERT INTO MSG (Type, SubType, IsSender, CreateTime, StrTalker, StrContent) VALUES (?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        conn.commit()
+        conn.close()
+
+    def test_iter_database_messages_decodes_rows(self, tmp_path):
+        """测试将MSG表中的文本、群聊和非文本消息转换为标准格式"""
+        db_path = tmp_path / "MSG0.db"
+        self._make_db(db_path, [
+            (1, 0, 0, self.base_time + 60, 'wxid_zhang', '晚点发货'),
+            (1, 0, 1, self.base_time, 'wxid_zhang', '你好'),
+            (1, 0, 0, self.base_time + 120, '123@chatroom', 'wxid_li:\n群里的消息'),
+            (3, 0, 0, self.base_time + 180, 'wxid_zhang', '<msg><img /></msg>'),
+        ])
+
+        messages = list(self.extractor.iter_database_messages(str(db_path)))
+
+        assert [msg['message'] for msg in messages] == ['你好', '晚点发货', '群里的消息', '[图片]']
+        assert [msg['sender'] for msg in messages] == ['我', 'wxid_zhang', 'wxid_li', 'wxid_zhang']
+        assert messages[0]['timestamp'] == '2024-01-01T12:00:00'
+        assert messages[3]['type'] == 'image'
+        assert all(msg['source'] == 'wechat_database' for msg in messages)
+
+    def test_keyset_pagination_covers_equal_timestamps(self, tmp_path):
+        """测试分批读取时同一时间的多条消息不会重复或遗漏，并可从游标处继续"""
+        db_path = tmp_path / "MSG0.db"
+        self._make_db(db_path, [
+            (1, 0, 0, self.base_time + i // 3, 'wxid_zhang', f'消息{i}') for i in range(10)
+        ])
+
+        messages = list(self.extractor.iter_database_messages(str(db_path), batch_size=2))
+        assert [msg['message'] for msg in messages] == [f'消息{i}' for i in range(10)]
+
+        resumed = list(self.extractor.iter_database_messages(str(db_path), after=(messages[4]['create_time'], messages[4]['local_id'])))
+        assert [msg['message'] for msg in resumed] == [f'消息{i}' for i in range(5, 10)]
+
+    def test_decoded_rows_load_into_message_store(self, tmp_path):
+        """测试逐条读取的数据库消息可以直接写入列式存储，游标字段作为普通字段保存"""
+        db_path = tmp_path / "MSG0.db"
+        self._make_db(db_path, [
+            (1, 0, i % 2, self.base_time + i, 'wxid_zhang', f'消息{i}') for i in range(5)
+        ])
+
+        store = MessageStore.from_messages(
+            self.extractor.iter_database_messages(str(db_path), batch_size=2), content_key='message')
+
+        records = list(store.iter_records())
+        assert len(store) == 5
+        assert [msg['message'] for msg in records] == [f'消息{i}' for i in range(5)]
+        assert [msg['local_id'] for msg in records] == [1, 2, 3, 4, 5]
+        assert records[2]['create_time'] == self.base_time + 2
+
+    def test_database_opened_read_only(self, tmp_path):
+        """测试只读打开数据库，不存在的文件和非数据库文件返回空列表"""
+        db_path = tmp_path / "MSG0.db"
+        self._make_db(db_path, [(1, 0, 0, self.base_time, 'wxid_zhang', '你好')])
+
+        conn = self.extractor._connect_readonly(str(db_path))
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("DELETE FROM MSG")
+        conn.close()
+
+        encrypted = tmp_path / "encrypted.db"
+        encrypted.write_bytes(os.urandom(4096))
+        assert self.extractor.attempt_database_read(str(encrypted)) == []
+        assert self.extractor.attempt_database_read(str(tmp_path / "missing.db")) == []